@@ -1,21 +1,34 @@
 import os
 import datetime
 import requests
-from flask import Flask, request, jsonify, session
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from flask import Flask, request, jsonify, session, g, make_response
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import pymongo
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import gridfs
 from bson import ObjectId
 import json
 import google.generativeai as genai
-from PIL import Image
+from PIL import Image, features
 import base64
 from io import BytesIO
 import uuid
+import time
+import hashlib
+import mimetypes
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_client import Counter, Gauge, Histogram
 
 # Load environment variables
 load_dotenv()
@@ -23,9 +36,71 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'default-secret-key')
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Uploads are stored once per distinct content, under uploads/objects, and
+# reference-counted in the upload_files collection (see gc_uploads.py)
+app.config['UPLOAD_OBJECT_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'objects')
+app.config['UPLOAD_CHUNK_SIZE'] = 256 * 1024
+# Unreferenced uploads are only collected once this old, so one being saved is never removed
+app.config['UPLOAD_GC_GRACE'] = int(os.getenv('UPLOAD_GC_GRACE', str(3600)))
+# Each server process runs the collector this often in the background (0: only gc_uploads.py)
+app.config['UPLOAD_GC_INTERVAL'] = float(os.getenv('UPLOAD_GC_INTERVAL', str(3600)))
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 app.config['ML_SERVICE_URL'] = os.getenv('ML_SERVICE_URL', 'http://fast-app:8001')
+app.config['TRACE_SPANS'] = os.getenv('TRACE_SPANS', '0') == '1'
+# ML service client: keep-alive pool size, (connect, read) timeouts in seconds and retries
+app.config['ML_SERVICE_POOL_SIZE'] = int(os.getenv('ML_SERVICE_POOL_SIZE', '16'))
+app.config['ML_SERVICE_TIMEOUT'] = (
+    float(os.getenv('ML_SERVICE_CONNECT_TIMEOUT', '3')),
+    float(os.getenv('ML_SERVICE_READ_TIMEOUT', '60'))
+)
+app.config['ML_SERVICE_RETRIES'] = int(os.getenv('ML_SERVICE_RETRIES', '2'))
+# Send the upload bytes already in memory instead of re-reading the saved file
+app.config['ML_SEND_FROM_MEMORY'] = os.getenv('ML_SEND_FROM_MEMORY', '1') == '1'
+# Tumor highlighting requested from the ML service: "png" overlay or "rle" mask blended by the client
+app.config['ML_OVERLAY_FORMAT'] = os.getenv('ML_OVERLAY_FORMAT', 'png')
+# "deferred" answers uploads with the classification alone; the highlighting is
+# fetched from the ML service in the background (ML_HIGHLIGHT_WORKERS threads), or
+# when the highlighted image is first requested (waiting up to ML_HIGHLIGHT_WAIT seconds)
+app.config['ML_HIGHLIGHT_MODE'] = os.getenv('ML_HIGHLIGHT_MODE', 'inline')
+app.config['ML_HIGHLIGHT_WORKERS'] = int(os.getenv('ML_HIGHLIGHT_WORKERS', '2'))
+app.config['ML_HIGHLIGHT_WAIT'] = float(os.getenv('ML_HIGHLIGHT_WAIT', '20'))
+# Image bytes live outside the images collection: "gridfs" or a "local" content-addressed folder
+app.config['BLOB_STORE'] = os.getenv('BLOB_STORE', 'gridfs')
+app.config['BLOB_FOLDER'] = os.getenv('BLOB_FOLDER', os.path.join('uploads', 'blobs'))
+app.config['IMAGE_CACHE_MAX_AGE'] = int(os.getenv('IMAGE_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+# Downscaled renditions made at upload time: longest side in pixels, format (WEBP or JPEG) and quality
+app.config['THUMBNAIL_SIZE'] = int(os.getenv('THUMBNAIL_SIZE', '320'))
+app.config['PREVIEW_SIZE'] = int(os.getenv('PREVIEW_SIZE', '1024'))
+app.config['RENDITION_FORMAT'] = os.getenv('RENDITION_FORMAT', 'WEBP').upper()
+app.config['RENDITION_QUALITY'] = int(os.getenv('RENDITION_QUALITY', '80'))
+# WebP encoder effort from 0 (fastest) to 6; 2 costs about a third of the default 4 for ~1% larger files
+app.config['RENDITION_WEBP_METHOD'] = int(os.getenv('RENDITION_WEBP_METHOD', '2'))
+app.config['HISTORY_PAGE_SIZE'] = int(os.getenv('HISTORY_PAGE_SIZE', '20'))
+app.config['HISTORY_MAX_PAGE_SIZE'] = int(os.getenv('HISTORY_MAX_PAGE_SIZE', '100'))
+app.config['STARRED_PAGE_SIZE'] = int(os.getenv('STARRED_PAGE_SIZE', '50'))
+app.config['STARRED_MAX_PAGE_SIZE'] = int(os.getenv('STARRED_MAX_PAGE_SIZE', '200'))
+# Upload jobs: uploads sent with async=1 (or all of them with UPLOAD_ASYNC=1) are queued
+# in the upload_jobs collection and processed by a pool of background threads
+app.config['UPLOAD_ASYNC'] = os.getenv('UPLOAD_ASYNC', '0') == '1'
+app.config['UPLOAD_WORKERS'] = int(os.getenv('UPLOAD_WORKERS', '4'))
+app.config['UPLOAD_JOB_POLL_INTERVAL'] = float(os.getenv('UPLOAD_JOB_POLL_INTERVAL', '1'))
+app.config['UPLOAD_JOB_MAX_WAIT'] = float(os.getenv('UPLOAD_JOB_MAX_WAIT', '25'))
+# Running jobs not finished after this long are assumed lost with their worker and run again
+app.config['UPLOAD_JOB_TIMEOUT'] = float(os.getenv('UPLOAD_JOB_TIMEOUT', '300'))
+app.config['UPLOAD_JOB_MAX_ATTEMPTS'] = int(os.getenv('UPLOAD_JOB_MAX_ATTEMPTS', '3'))
+app.config['UPLOAD_JOB_TTL'] = int(os.getenv('UPLOAD_JOB_TTL', str(24 * 3600)))
+# Per-user token buckets at /api/upload: UPLOAD_RATE_LIMIT uploads a second on
+# average, in bursts of up to UPLOAD_RATE_BURST (0 turns the limit off). Buckets
+# are kept per process, like the metrics
+app.config['UPLOAD_RATE_LIMIT'] = float(os.getenv('UPLOAD_RATE_LIMIT', '0.5'))
+app.config['UPLOAD_RATE_BURST'] = float(os.getenv('UPLOAD_RATE_BURST', '10'))
+# Uploads go to the ML service's "interactive" lane and upload jobs to its
+# "bulk" lane. It sheds requests it cannot start within ML_SERVICE_DEADLINE
+# seconds (default: half the read timeout, leaving the rest for the work)
+app.config['ML_PRIORITY'] = os.getenv('ML_PRIORITY', 'interactive')
+app.config['ML_JOB_PRIORITY'] = os.getenv('ML_JOB_PRIORITY', 'bulk')
+app.config['ML_SERVICE_DEADLINE'] = float(os.getenv('ML_SERVICE_DEADLINE', str(app.config['ML_SERVICE_TIMEOUT'][1] / 2)))
 
 metrics = PrometheusMetrics(
     app,
@@ -36,9 +111,62 @@ metrics = PrometheusMetrics(
 # Optional: Include the status code in metrics labels
 metrics.info('app_info', 'Application info', version='1.0.3')
 
+# ML service client metrics, exported through the same /metrics endpoint
+ml_service_request_seconds = Histogram(
+    'flask_app_ml_service_request_seconds',
+    'Latency of calls from the gateway to the ML service',
+    ['outcome'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+ml_service_requests_total = Counter(
+    'flask_app_ml_service_requests_total',
+    'HTTP requests sent to the ML service, including retries'
+)
+ml_service_new_connections_total = Counter(
+    'flask_app_ml_service_new_connections_total',
+    'New TCP connections opened to the ML service (requests minus these were served on kept-alive connections)'
+)
+upload_job_queue_depth = Gauge(
+    'flask_app_upload_job_queue_depth',
+    'Upload jobs waiting for a worker'
+)
+upload_job_wait_seconds = Histogram(
+    'flask_app_upload_job_wait_seconds',
+    'Time upload jobs spend queued before a worker picks them up',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+upload_job_latency_seconds = Histogram(
+    'flask_app_upload_job_latency_seconds',
+    'Time from queueing an upload job to its result',
+    ['status'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+upload_rejected_total = Counter(
+    'flask_app_upload_rejected_total',
+    'Uploads turned away before processing, by reason (rate_limited, ml_busy)',
+    ['reason']
+)
+upload_job_deferred_total = Counter(
+    'flask_app_upload_job_deferred_total',
+    'Upload jobs put back in the queue because the ML service shed them'
+)
+upload_dedup_total = Counter(
+    'flask_app_upload_dedup_total',
+    'Uploads whose content was already stored'
+)
+upload_dedup_bytes_total = Counter(
+    'flask_app_upload_dedup_bytes_total',
+    'Bytes not stored again because the upload was a duplicate'
+)
+upload_gc_reclaimed_bytes_total = Counter(
+    'flask_app_upload_gc_reclaimed_bytes_total',
+    'Bytes of unreferenced uploads removed by the garbage collector'
+)
+
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_OBJECT_FOLDER'], exist_ok=True)
 
 # Configure CORS to allow requests from the frontend
 CORS(app, supports_credentials=True, origins=["*"])
@@ -52,14 +180,157 @@ try:
     users_collection = db.users
     images_collection = db.images
     starred_collection = db.starred
+    upload_jobs_collection = db.upload_jobs
+    upload_files_collection = db.upload_files
     
     # Create indexes for faster queries
     users_collection.create_index("email", unique=True)
+    # Serves history pages newest first without scanning or sorting in memory
+    images_collection.create_index(
+        [("user_id", pymongo.ASCENDING), ("upload_time", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+        name="user_history"
+    )
+    # Starred pages follow _id, which re-starring and note edits leave alone
+    # (unlike timestamp), so a page boundary never moves under a client
+    starred_collection.create_index(
+        [("user_id", pymongo.ASCENDING), ("_id", pymongo.DESCENDING)],
+        name="user_starred_id"
+    )
+    if "user_starred" in starred_collection.index_information():
+        starred_collection.drop_index("user_starred")
+    # Workers claim the oldest queued job; finished jobs expire after UPLOAD_JOB_TTL
+    upload_jobs_collection.create_index(
+        [("status", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)],
+        name="status_created"
+    )
+    upload_jobs_collection.create_index(
+        "finished_at", expireAfterSeconds=app.config['UPLOAD_JOB_TTL'], name="finished_ttl"
+    )
+    # Lets the garbage collector find unreferenced uploads without a scan
+    upload_files_collection.create_index(
+        [("refs", pymongo.ASCENDING), ("updated_at", pymongo.ASCENDING)],
+        name="refs_updated"
+    )
     
     print("Connected to MongoDB Atlas")
 except Exception as e:
     print(f"Error connecting to MongoDB Atlas: {e}")
 
+def ensure_unique_starred_index():
+    """
+    One starred entry per (user_id, image_id). Older data may hold duplicates
+    from the non-atomic check-then-insert, so keep the newest and retry.
+    """
+    keys = [("user_id", pymongo.ASCENDING), ("image_id", pymongo.ASCENDING)]
+    try:
+        starred_collection.create_index(keys, unique=True, name="user_image_unique")
+    except DuplicateKeyError:
+        duplicates = starred_collection.aggregate([
+            {"$sort": {"timestamp": -1}},
+            {"$group": {"_id": {"user_id": "$user_id", "image_id": "$image_id"},
+                        "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ])
+        for group in duplicates:
+            starred_collection.delete_many({"_id": {"$in": group["ids"][1:]}})
+        starred_collection.create_index(keys, unique=True, name="user_image_unique")
+
+try:
+    ensure_unique_starred_index()
+except Exception as e:
+    print(f"Error creating starred index: {e}")
+
+# Image blob storage. Blobs are keyed by the SHA-256 of their content, so the
+# same bytes are only stored once and a blob ID doubles as a strong ETag.
+class GridFSBlobStore:
+    def __init__(self, database):
+        self.fs = gridfs.GridFS(database, collection='blobs')
+
+    def put(self, data):
+        blob_id = hashlib.sha256(data).hexdigest()
+        if not self.fs.exists(blob_id):
+            try:
+                self.fs.put(data, _id=blob_id)
+            except gridfs.errors.FileExists:
+                pass
+        return blob_id
+
+    def get(self, blob_id):
+        try:
+            return self.fs.get(blob_id).read()
+        except gridfs.errors.NoFile:
+            return None
+
+class LocalBlobStore:
+    """Content-addressed folder on local disk, also used as a stand-in for GridFS in tests"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, blob_id):
+        return os.path.join(self.root, blob_id[:2], blob_id)
+
+    def put(self, data):
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return blob_id
+
+    def get(self, blob_id):
+        try:
+            with open(self.path(blob_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+try:
+    if app.config['BLOB_STORE'] == 'local':
+        blob_store = LocalBlobStore(app.config['BLOB_FOLDER'])
+    else:
+        blob_store = GridFSBlobStore(db)
+except Exception as e:
+    print(f"Error configuring blob store, using local folder: {e}")
+    blob_store = LocalBlobStore(app.config['BLOB_FOLDER'])
+
+# Image kinds that can be fetched from /api/image/<image_id>/<kind>, with the
+# field that held them inline in documents written before blobs were split out
+IMAGE_KINDS = {
+    'original': 'image_data',
+    'highlighted': 'highlighted_image'
+}
+
+# Downscaled copies of the original and highlighted images: kind -> (source kind, longest side)
+RENDITIONS = {
+    'thumbnail': ('original', app.config['THUMBNAIL_SIZE']),
+    'preview': ('original', app.config['PREVIEW_SIZE']),
+    'highlighted_thumbnail': ('highlighted', app.config['THUMBNAIL_SIZE']),
+    'highlighted_preview': ('highlighted', app.config['PREVIEW_SIZE'])
+}
+
+# Image kinds linked from listings; full-size images are only linked from get_image
+LISTING_KINDS = [kind for kind in RENDITIONS]
+
+# Fields returned by listing queries. Inline image bytes from older documents
+# (image_data, highlighted_image, ml_results.highlighted_image) never leave Mongo.
+LISTING_FIELDS = {
+    'original_filename': 1,
+    'upload_time': 1,
+    'is_appropriate': 1,
+    'blobs': 1,
+    'ml_results.prediction': 1,
+    'ml_results.confidence': 1,
+    'ml_results.tumor_type': 1,
+    'ml_results.precautions': 1,
+    'ml_results.treatment_options': 1,
+    'ml_results.highlight_status': 1
+}
+
 # Configure Google Gemini API
 try:
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
@@ -68,6 +339,39 @@ try:
 except Exception as e:
     print(f"Error configuring Google Gemini API: {e}")
 
+# Request tracing: reuse the caller's X-Request-ID (or create one) and forward it to the ML service
+@app.before_request
+def start_trace():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.spans = []
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def finish_trace(response):
+    request_id = getattr(g, 'request_id', None)
+    if request_id is None:
+        return response
+    response.headers['X-Request-ID'] = request_id
+    if app.config['TRACE_SPANS'] and g.spans:
+        total = time.perf_counter() - g.request_start
+        response.headers['Server-Timing'] = ", ".join(
+            f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in g.spans
+        )
+        spans = " ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in g.spans)
+        print(f"trace request_id={request_id} {request.method} {request.path} total={total * 1000:.1f}ms {spans}")
+        if getattr(g, 'ml_server_timing', None):
+            print(f"trace request_id={request_id} ml_service {g.ml_server_timing}")
+    return response
+
+@contextmanager
+def span(name):
+    """Record how long a block takes as a span of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.spans.append((name, time.perf_counter() - start))
+
 # Helper class for JSON serialization
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -81,51 +385,349 @@ class JSONEncoder(json.JSONEncoder):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def upload_path(upload_id):
+    return os.path.join(app.config['UPLOAD_OBJECT_FOLDER'], upload_id[:2], upload_id)
+
 def save_image(file):
-    """Save uploaded image and return the file path"""
-    filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4()}_{filename}"
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-    file.save(file_path)
-    return file_path, unique_filename
-
-def image_to_base64(image_path):
-    """Convert image to base64 for storage"""
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode('utf-8')
-
-def process_with_ml_model(image_path):
     """
-    Process image with ML model by calling the FastAPI ML service
+    Save an uploaded image under the SHA-256 of its content, hashed while it is
+    written, and take a reference on it. Identical scans share one file.
+    Returns the file path and the upload ID (the hash).
+    """
+    tmp_path = os.path.join(app.config['UPLOAD_OBJECT_FOLDER'], f"{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    with open(tmp_path, 'wb') as out:
+        for chunk in iter(lambda: file.stream.read(app.config['UPLOAD_CHUNK_SIZE']), b''):
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    upload_id = digest.hexdigest()
+    file_path = upload_path(upload_id)
+    
+    now = datetime.datetime.utcnow()
+    entry = upload_files_collection.find_one_and_update(
+        {"_id": upload_id},
+        {"$inc": {"refs": 1}, "$set": {"updated_at": now}, "$setOnInsert": {"size": size, "created_at": now}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    # Other references keep an existing file from being collected; otherwise
+    # (new content, or one the collector may be removing) put ours in place
+    if entry["refs"] > 1 and os.path.exists(file_path):
+        os.remove(tmp_path)
+        upload_dedup_total.inc()
+        upload_dedup_bytes_total.inc(size)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(tmp_path, file_path)
+    return file_path, upload_id
+
+def retain_upload(upload_id):
+    """Take another reference on a stored upload; False for files saved before uploads were shared"""
+    result = upload_files_collection.update_one(
+        {"_id": upload_id},
+        {"$inc": {"refs": 1}, "$set": {"updated_at": datetime.datetime.utcnow()}}
+    )
+    return result.matched_count > 0
+
+def release_upload(upload_id):
+    """Drop a reference on a stored upload; unreferenced files are left to the garbage collector"""
+    upload_files_collection.update_one(
+        {"_id": upload_id},
+        {"$inc": {"refs": -1}, "$set": {"updated_at": datetime.datetime.utcnow()}}
+    )
+
+def collect_upload_garbage(grace=None, dry_run=False):
+    """
+    Remove stored uploads nothing references any more, and temp files left by
+    interrupted uploads, once older than the grace period. Returns a report.
+    """
+    grace = app.config['UPLOAD_GC_GRACE'] if grace is None else grace
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace)
+    report = {"removed_files": 0, "reclaimed_bytes": 0, "removed_temp_files": 0}
+    
+    for entry in upload_files_collection.find({"refs": {"$lte": 0}, "updated_at": {"$lt": cutoff}}):
+        if dry_run:
+            report["removed_files"] += 1
+            report["reclaimed_bytes"] += entry["size"]
+            continue
+        # Move the file aside first: an upload of the same content that takes a
+        # reference meanwhile makes the delete below miss, and the file goes back
+        path = upload_path(entry["_id"])
+        collected_path = f"{path}.{uuid.uuid4().hex}.gc"
+        try:
+            os.rename(path, collected_path)
+        except FileNotFoundError:
+            collected_path = None
+        if upload_files_collection.delete_one({"_id": entry["_id"], "refs": {"$lte": 0}}).deleted_count:
+            if collected_path:
+                os.remove(collected_path)
+            report["removed_files"] += 1
+            report["reclaimed_bytes"] += entry["size"]
+            upload_gc_reclaimed_bytes_total.inc(entry["size"])
+        elif collected_path:
+            os.replace(collected_path, path)
+    
+    cutoff_timestamp = time.time() - grace
+    for name in os.listdir(app.config['UPLOAD_OBJECT_FOLDER']):
+        path = os.path.join(app.config['UPLOAD_OBJECT_FOLDER'], name)
+        try:
+            if name.endswith('.tmp') and os.path.getmtime(path) < cutoff_timestamp:
+                if not dry_run:
+                    os.remove(path)
+                report["removed_temp_files"] += 1
+        except FileNotFoundError:
+            # Removed by a collector in another process
+            continue
+    return report
+
+class UploadGarbageCollector:
+    """
+    Background thread that runs collect_upload_garbage every UPLOAD_GC_INTERVAL
+    seconds. Started once per process (see gunicorn.flask.conf.py); collectors
+    in several processes are safe to run together.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid() or self.interval <= 0:
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name="upload-gc", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                report = collect_upload_garbage()
+                if report["removed_files"] or report["removed_temp_files"]:
+                    print(f"Upload garbage collected: {report}")
+            except Exception as e:
+                print(f"Error collecting upload garbage: {e}")
+
+upload_gc = UploadGarbageCollector(app.config['UPLOAD_GC_INTERVAL'])
+
+def upload_storage_report():
+    """What content addressing saves: bytes referenced by uploads and stars against bytes stored"""
+    files = referenced_bytes = stored_bytes = references = unreferenced_bytes = 0
+    for entry in upload_files_collection.find({}, {"size": 1, "refs": 1}):
+        files += 1
+        if entry["refs"] > 0:
+            references += entry["refs"]
+            stored_bytes += entry["size"]
+            referenced_bytes += entry["size"] * entry["refs"]
+        else:
+            unreferenced_bytes += entry["size"]
+    return {
+        "files": files,
+        "references": references,
+        "stored_bytes": stored_bytes,
+        "referenced_bytes": referenced_bytes,
+        "saved_bytes": referenced_bytes - stored_bytes,
+        "unreferenced_bytes": unreferenced_bytes
+    }
+
+def store_image_blob(data, content_type):
+    """Save image bytes in the blob store and return the reference kept on the document"""
+    return {"id": blob_store.put(data), "content_type": content_type, "size": len(data)}
+
+def rendition_format():
+    """Pillow format and content type for renditions, falling back to JPEG without WebP support"""
+    fmt = app.config['RENDITION_FORMAT']
+    if fmt == 'WEBP' and not features.check('webp'):
+        fmt = 'JPEG'
+    return fmt, f"image/{fmt.lower()}"
+
+def build_renditions(source, data):
+    """Encode every rendition of one source image, returning {kind: bytes}"""
+    fmt, _ = rendition_format()
+    options = {'quality': app.config['RENDITION_QUALITY']}
+    if fmt == 'WEBP':
+        options['method'] = app.config['RENDITION_WEBP_METHOD']
+    
+    # Largest first, so each smaller rendition is resized from the previous one
+    sizes = sorted(
+        ((size, kind) for kind, (kind_source, size) in RENDITIONS.items() if kind_source == source),
+        reverse=True
+    )
+    if not sizes:
+        return {}
+    
+    renditions = {}
+    with Image.open(BytesIO(data)) as img:
+        # JPEG only: let the decoder scale down by up to 8x while reading
+        img.draft('RGB', (sizes[0][0], sizes[0][0]))
+        img = img.convert('RGB')
+        for size, kind in sizes:
+            img.thumbnail((size, size), Image.LANCZOS)
+            buffer = BytesIO()
+            img.save(buffer, format=fmt, **options)
+            renditions[kind] = buffer.getvalue()
+    return renditions
+
+def store_renditions(source, data):
+    """Build the renditions of one source image and save them in the blob store"""
+    _, content_type = rendition_format()
+    return {
+        kind: store_image_blob(rendition, content_type)
+        for kind, rendition in build_renditions(source, data).items()
+    }
+
+def image_urls(image, kinds=None):
+    """URLs for the image kinds a document has (all of them by default), served by get_image_blob"""
+    image_id = str(image["_id"])
+    blobs = image.get("blobs", {})
+    if "original" in blobs:
+        sources = [kind for kind in IMAGE_KINDS if kind in blobs]
+        # Deferred highlights are attached later, or fetched on first request.
+        # Run-length masks are not images: they arrive in ml_results instead
+        if (image.get("ml_results", {}).get("highlight_status") == "pending" and "highlighted" not in sources
+                and app.config['ML_OVERLAY_FORMAT'] != 'rle'):
+            sources.append('highlighted')
+    else:
+        # Older documents keep the bytes inline, and only positive results were highlighted
+        sources = ['original']
+        if image.get("ml_results", {}).get("prediction") == "Positive":
+            sources.append('highlighted')
+    # Renditions missing from a document are generated on first request
+    available = sources + [kind for kind, (source, _) in RENDITIONS.items() if source in sources]
+    if kinds is not None:
+        available = [kind for kind in available if kind in kinds]
+    return {f"{kind}_url": f"/api/image/{image_id}/{kind}" for kind in available}
+
+class CountingConnectionPoolMixin:
+    """Counts attempts and newly opened connections so keep-alive reuse shows up in metrics"""
+
+    def _new_conn(self):
+        ml_service_new_connections_total.inc()
+        return super()._new_conn()
+
+    def urlopen(self, *args, **kwargs):
+        # Retries re-enter urlopen, so each attempt is counted
+        ml_service_requests_total.inc()
+        return super().urlopen(*args, **kwargs)
+
+class CountingHTTPConnectionPool(CountingConnectionPoolMixin, HTTPConnectionPool):
+    pass
+
+class CountingHTTPSConnectionPool(CountingConnectionPoolMixin, HTTPSConnectionPool):
+    pass
+
+class MLServiceAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+def create_ml_session():
+    """Keep-alive session for the ML service with a bounded pool and retries on transient errors"""
+    # 503 is the ML service shedding load: retrying it at once would add to the
+    # overload, so it is passed back to the caller with its Retry-After instead.
+    # Nor are read timeouts retried, as the service may still be working on the request
+    retry = Retry(
+        total=app.config['ML_SERVICE_RETRIES'],
+        read=0,
+        backoff_factor=0.2,
+        status_forcelist=(502, 504),
+        respect_retry_after_header=False,
+        allowed_methods=frozenset(['GET', 'POST']),
+        raise_on_status=False
+    )
+    adapter = MLServiceAdapter(
+        pool_connections=1,
+        pool_maxsize=app.config['ML_SERVICE_POOL_SIZE'],
+        max_retries=retry
+    )
+    http = requests.Session()
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    return http
+
+ml_session = create_ml_session()
+
+class MLServiceBusy(Exception):
+    """The ML service shed a request under load; try again after retry_after seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"ML service is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def retry_after_seconds(response, default=1):
+    try:
+        return max(1, int(response.headers.get('Retry-After', default)))
+    except ValueError:
+        return default
+
+def process_with_ml_model(image_path, image_bytes=None, priority=None):
+    """
+    Process image with ML model by calling the FastAPI ML service.
+    Sends image_bytes when given, otherwise reads the saved file at image_path.
+    Raises MLServiceBusy when the service sheds the request.
     """
+    url = f"{app.config['ML_SERVICE_URL']}/predict"
+    start = time.perf_counter()
+    outcome = 'error'
     try:
         # Prepare the image file for sending to the ML service
-        with open(image_path, 'rb') as img_file:
-            files = {'file': (os.path.basename(image_path), img_file, 'image/jpeg')}
+        if image_bytes is None:
+            with open(image_path, 'rb') as img_file:
+                image_bytes = img_file.read()
+        files = {'file': (os.path.basename(image_path), image_bytes, 'image/jpeg')}
+        
+        # Call the ML service
+        response = ml_session.post(
+            url,
+            files=files,
+            params={
+                'overlay': app.config['ML_OVERLAY_FORMAT'],
+                'highlight': app.config['ML_HIGHLIGHT_MODE'],
+                'priority': priority or app.config['ML_PRIORITY'],
+                'deadline': app.config['ML_SERVICE_DEADLINE']
+            },
+            headers={'X-Request-ID': g.request_id},
+            timeout=app.config['ML_SERVICE_TIMEOUT']
+        )
+        g.ml_server_timing = response.headers.get('Server-Timing')
+        
+        if response.status_code == 503:
+            outcome = 'shed'
+            raise MLServiceBusy(retry_after_seconds(response))
+        
+        if response.status_code == 200:
+            outcome = 'ok'
+            result = response.json()
             
-            # Call the ML service
-            response = requests.post(
-                f"{app.config['ML_SERVICE_URL']}/predict", 
-                files=files
-            )
+            # If image is not appropriate
+            if not result.get("is_appropriate", True):
+                return None, False
             
-            if response.status_code == 200:
-                result = response.json()
-                
-                # If image is not appropriate
-                if not result.get("is_appropriate", True):
-                    return None, False
-                
-                # Return the ML results
-                return result.get("ml_results", {}), True
-            else:
-                print(f"ML service error: {response.status_code} - {response.text}")
-                # Fallback prediction if ML service fails
-                return fallback_prediction(), True
+            # Return the ML results
+            return result.get("ml_results", {}), True
+        else:
+            outcome = f"http_{response.status_code}"
+            print(f"ML service error: {response.status_code} - {response.text}")
+            # Fallback prediction if ML service fails
+            return fallback_prediction(), True
+    except MLServiceBusy:
+        raise
+    except requests.exceptions.Timeout as e:
+        outcome = 'timeout'
+        print(f"ML service timed out: {e}")
+        return fallback_prediction(), True
     except Exception as e:
         print(f"Error calling ML service: {e}")
         # Fallback prediction if ML service fails
         return fallback_prediction(), True
+    finally:
+        ml_service_request_seconds.labels(outcome=outcome).observe(time.perf_counter() - start)
 
 def fallback_prediction():
     """Fallback prediction if ML service is unavailable"""
@@ -211,6 +813,43 @@ def login():
     
     return jsonify({"message": "Login successful", "user": user_data}), 200
 
+class TokenBuckets:
+    """
+    One token bucket per key: tokens refill at `rate` a second up to `burst`
+    and each call to take() spends one. Keys not seen for a while are dropped
+    once there are more than max_keys of them, since their buckets are full.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """Spend a token for key; returns 0 if there was one, else the seconds until there will be"""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+upload_rate_limiter = TokenBuckets(app.config['UPLOAD_RATE_LIMIT'], app.config['UPLOAD_RATE_BURST'])
+
+def retry_later(message, retry_after, status):
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status
+
 # In the upload_image function, ensure the highlighted image is passed along
 # Look for the @app.route('/api/upload', methods=['POST']) function and update:
 
@@ -221,6 +860,11 @@ def upload_image():
     if not user_id:
         return jsonify({"error": "User not authenticated"}), 401
     
+    wait = upload_rate_limiter.take(user_id)
+    if wait:
+        upload_rejected_total.labels(reason='rate_limited').inc()
+        return retry_later("Too many uploads, please wait a moment and try again", math.ceil(wait), 429)
+    
     # Check if image was provided
     if 'image' not in request.files:
         return jsonify({"error": "No image provided"}), 400
@@ -230,59 +874,411 @@ def upload_image():
         return jsonify({"error": "No image selected"}), 400
     
     if file and allowed_file(file.filename):
-        # Save the uploaded image
-        file_path, unique_filename = save_image(file)
+        # Keep the upload in memory so the ML call and base64 don't re-read it from disk
+        image_bytes = None
+        if app.config['ML_SEND_FROM_MEMORY']:
+            image_bytes = file.read()
+            file.stream.seek(0)
         
-        # Process with ML model
-        ml_results, is_appropriate = process_with_ml_model(file_path)
+        # Save the uploaded image
+        with span('save'):
+            file_path, unique_filename = save_image(file)
         
-        if not is_appropriate:
-            # Remove the file if it's not appropriate
-            os.remove(file_path)
+        # Job mode: acknowledge right away and leave the rest to the upload workers
+        if wants_async_upload():
+            with span('enqueue'):
+                job_id = enqueue_upload_job(user_id, file_path, unique_filename, file.filename)
             return jsonify({
-                "error": "Please upload an appropriate brain MRI or CT scan image for tumor detection"
-            }), 400
-        
-        # Convert image to base64 for storage
-        image_base64 = image_to_base64(file_path)
-        
-        # Store image information in database
-        image_data = {
-            "user_id": ObjectId(user_id),
-            "filename": unique_filename,
-            "original_filename": file.filename,
-            "image_data": image_base64,
-            "upload_time": datetime.datetime.utcnow(),
-            "is_appropriate": is_appropriate,
-            "ml_results": ml_results
-        }
+                "message": "Image queued for processing",
+                "job_id": str(job_id),
+                "status": "queued",
+                "status_url": f"/api/upload/jobs/{job_id}"
+            }), 202
+        
+        try:
+            result, status = process_upload(user_id, file_path, unique_filename, file.filename, image_bytes)
+        except MLServiceBusy as e:
+            release_upload(unique_filename)
+            upload_rejected_total.labels(reason='ml_busy').inc()
+            return retry_later("The analysis service is busy, please try again shortly", e.retry_after, 503)
+        return jsonify(result), status
+    
+    return jsonify({"error": "File type not allowed"}), 400
+
+def process_upload(user_id, file_path, unique_filename, original_filename, image_bytes=None, priority=None):
+    """
+    Run a saved upload through the ML service and store it. Returns the
+    response body and status code, for both the synchronous path and upload jobs.
+    The upload's reference passes to the new image document, or is released;
+    when the ML service is busy it is kept for the caller to retry or release.
+    """
+    try:
+        image_data, ml_results, is_appropriate = store_upload(
+            user_id, file_path, unique_filename, original_filename, image_bytes, priority
+        )
+    except MLServiceBusy:
+        raise
+    except Exception:
+        release_upload(unique_filename)
+        raise
+    
+    if not is_appropriate:
+        # Drop the reference; the file goes once nothing else uses it
+        release_upload(unique_filename)
+        return {
+            "error": "Please upload an appropriate brain MRI or CT scan image for tumor detection"
+        }, 400
+    image_id = image_data["_id"]
+    
+    if ml_results.get('highlight_status') == 'pending':
+        highlight_executor.submit(attach_highlight, image_id, app.config['ML_HIGHLIGHT_WAIT'])
+    
+    # Return results
+    return {
+        "message": "Image processed successfully",
+        "image_id": str(image_id),
+        "is_appropriate": is_appropriate,
+        "ml_results": ml_results,
+        **image_urls(image_data)
+    }, 200
+
+def store_upload(user_id, file_path, unique_filename, original_filename, image_bytes=None, priority=None):
+    """Classify an upload and insert its image document; returns (image_data, ml_results, is_appropriate)"""
+    # Process with ML model
+    with span('ml_service'):
+        ml_results, is_appropriate = process_with_ml_model(file_path, image_bytes, priority)
+    
+    if not is_appropriate:
+        return None, ml_results, False
+    
+    # Store the image bytes outside the document
+    with span('blob_store'):
+        if image_bytes is None:
+            with open(file_path, 'rb') as img_file:
+                image_bytes = img_file.read()
+        content_type = mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
+        blobs = {"original": store_image_blob(image_bytes, content_type)}
         
         # Store highlighted image separately if it exists
-        if 'highlighted_image' in ml_results:
-            image_data['highlighted_image'] = ml_results['highlighted_image']
+        highlighted_bytes = None
+        if ml_results.get('highlighted_image'):
+            highlighted_bytes = base64.b64decode(ml_results['highlighted_image'])
+            blobs["highlighted"] = store_image_blob(highlighted_bytes, 'image/png')
+    
+    # Thumbnails and previews for listings; any that fail here are retried on first request
+    with span('renditions'):
+        try:
+            blobs.update(store_renditions('original', image_bytes))
+            if highlighted_bytes:
+                blobs.update(store_renditions('highlighted', highlighted_bytes))
+        except Exception as e:
+            print(f"Error generating renditions: {e}")
+    
+    # Store image information in database
+    image_data = {
+        "user_id": ObjectId(user_id),
+        "filename": os.path.relpath(file_path, app.config['UPLOAD_FOLDER']),
+        "upload_id": unique_filename,
+        "original_filename": original_filename,
+        "blobs": blobs,
+        "upload_time": datetime.datetime.utcnow(),
+        "is_appropriate": is_appropriate,
+        "ml_results": {k: v for k, v in ml_results.items() if k != 'highlighted_image'}
+    }
+    
+    with span('db_insert'):
+        image_data["_id"] = images_collection.insert_one(image_data).inserted_id
+    return image_data, ml_results, is_appropriate
+
+highlight_executor = ThreadPoolExecutor(
+    max_workers=max(1, app.config['ML_HIGHLIGHT_WORKERS']), thread_name_prefix='highlight'
+)
+
+def fetch_highlight(image_obj_id, highlight_id, wait):
+    """
+    Deferred highlight fields from the ML service, by the highlight_id its
+    /predict returned; if it no longer has them, the original is sent again
+    """
+    base_url = app.config['ML_SERVICE_URL']
+    params = {'overlay': app.config['ML_OVERLAY_FORMAT']}
+    timeout = (app.config['ML_SERVICE_TIMEOUT'][0], app.config['ML_SERVICE_TIMEOUT'][1] + wait)
+    response = ml_session.get(f"{base_url}/highlight/{highlight_id}", params={**params, 'wait': wait}, timeout=timeout)
+    if response.status_code == 404:
+        data, content_type = source_image_bytes(image_obj_id, 'original')
+        if data is None:
+            return None
+        response = ml_session.post(
+            f"{base_url}/highlight", files={'file': ('image', data, content_type)}, params=params, timeout=timeout
+        )
+    if response.status_code != 200:
+        print(f"Highlight for {image_obj_id} not available: {response.status_code}")
+        return None
+    return response.json()
+
+def attach_highlight(image_obj_id, wait=0):
+    """
+    Store the deferred highlight of an image: the overlay and its renditions
+    as blobs, or the run-length mask in ml_results. Returns the new blobs
+    """
+    try:
+        image = images_collection.find_one({"_id": image_obj_id}, {"ml_results.highlight_id": 1, "ml_results.highlight_status": 1})
+        ml_results = (image or {}).get("ml_results", {})
+        if ml_results.get("highlight_status") != "pending":
+            return {}
         
-        image_id = images_collection.insert_one(image_data).inserted_id
+        highlight = fetch_highlight(image_obj_id, ml_results["highlight_id"], wait)
+        if highlight is None:
+            return {}
         
-        # Return results
-        return jsonify({
-            "message": "Image processed successfully",
-            "image_id": str(image_id),
-            "is_appropriate": is_appropriate,
-            "ml_results": ml_results
-        }), 200
+        update = {"ml_results.highlight_status": "done"}
+        blobs = {}
+        if highlight.get('highlighted_image'):
+            highlighted_bytes = base64.b64decode(highlight['highlighted_image'])
+            blobs["highlighted"] = store_image_blob(highlighted_bytes, 'image/png')
+            blobs.update(store_renditions('highlighted', highlighted_bytes))
+        if highlight.get('tumor_mask'):
+            update["ml_results.tumor_mask"] = highlight['tumor_mask']
+        update.update({f"blobs.{kind}": blob for kind, blob in blobs.items()})
+        images_collection.update_one({"_id": image_obj_id}, {"$set": update})
+        return blobs
+    except Exception as e:
+        print(f"Error attaching highlight to {image_obj_id}: {e}")
+        return {}
+
+def wants_async_upload():
+    value = request.args.get('async', request.form.get('async'))
+    if value is None:
+        return app.config['UPLOAD_ASYNC']
+    return value.lower() in ('1', 'true', 'yes')
+
+def enqueue_upload_job(user_id, file_path, unique_filename, original_filename):
+    """Queue a saved upload for the upload workers and return the job ID"""
+    job_id = upload_jobs_collection.insert_one({
+        "user_id": ObjectId(user_id),
+        "status": "queued",
+        "file_path": file_path,
+        "filename": unique_filename,
+        "original_filename": original_filename,
+        "request_id": g.request_id,
+        "attempts": 0,
+        "created_at": datetime.datetime.utcnow()
+    }).inserted_id
+    upload_workers.start()
+    upload_workers.notify()
+    return job_id
+
+def claim_upload_job():
+    """
+    Atomically take the oldest queued job, or a running one whose worker
+    has gone quiet for longer than UPLOAD_JOB_TIMEOUT
+    """
+    now = datetime.datetime.utcnow()
+    stale = now - datetime.timedelta(seconds=app.config['UPLOAD_JOB_TIMEOUT'])
+    return upload_jobs_collection.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "not_before": {"$not": {"$gt": now}}},
+            {"status": "running", "started_at": {"$lt": stale}}
+        ]},
+        {"$set": {"status": "running", "started_at": now}, "$inc": {"attempts": 1}},
+        sort=[("created_at", pymongo.ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def run_upload_job(job):
+    """Process one claimed job and record its result on the job document"""
+    if job["attempts"] == 1 and "not_before" not in job:
+        upload_job_wait_seconds.observe((job["started_at"] - job["created_at"]).total_seconds())
     
-    return jsonify({"error": "File type not allowed"}), 400
+    if job["attempts"] > app.config['UPLOAD_JOB_MAX_ATTEMPTS']:
+        release_upload(job["filename"])
+        result, status = {"error": "Upload job abandoned after repeated failures"}, 500
+    else:
+        # Jobs keep the request ID of the upload that queued them, so ML service traces line up
+        with app.app_context():
+            g.request_id = job.get("request_id") or uuid.uuid4().hex
+            g.spans = []
+            try:
+                result, status = process_upload(
+                    str(job["user_id"]), job["file_path"], job["filename"], job["original_filename"],
+                    priority=app.config['ML_JOB_PRIORITY']
+                )
+            except MLServiceBusy as e:
+                defer_upload_job(job, e.retry_after)
+                return
+            except Exception as e:
+                print(f"Upload job {job['_id']} failed: {e}")
+                result, status = {"error": f"Error processing upload: {str(e)}"}, 500
+        if status == 200:
+            # Job documents are polled and kept around: the overlay is served by URL, not inline
+            result["ml_results"] = {k: v for k, v in result["ml_results"].items() if k != 'highlighted_image'}
+    
+    finished_at = datetime.datetime.utcnow()
+    job_status = "done" if status == 200 else "failed"
+    upload_jobs_collection.update_one(
+        {"_id": job["_id"]},
+        {"$set": {
+            "status": job_status,
+            "http_status": status,
+            "result": result,
+            "finished_at": finished_at
+        }}
+    )
+    upload_job_latency_seconds.labels(status=job_status).observe((finished_at - job["created_at"]).total_seconds())
+    with upload_job_finished:
+        upload_job_finished.notify_all()
+
+def defer_upload_job(job, retry_after):
+    """Put a job the ML service shed back in the queue, without counting the attempt"""
+    upload_job_deferred_total.inc()
+    upload_jobs_collection.update_one(
+        {"_id": job["_id"]},
+        {"$set": {
+            "status": "queued",
+            "not_before": datetime.datetime.utcnow() + datetime.timedelta(seconds=retry_after)
+        }, "$inc": {"attempts": -1}}
+    )
+
+class UploadWorkerPool:
+    """
+    Background threads that claim jobs from the upload_jobs collection.
+    Started on first use in each process, so forked server workers run their own.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pid = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid() or self.size <= 0:
+                return
+            self.pid = os.getpid()
+            for i in range(self.size):
+                threading.Thread(target=self._run, name=f"upload-worker-{i}", daemon=True).start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                job = claim_upload_job()
+            except Exception as e:
+                print(f"Error claiming upload job: {e}")
+                job = None
+            
+            if job is None:
+                # Poll as well, for jobs queued by other processes
+                self.wakeup.wait(app.config['UPLOAD_JOB_POLL_INTERVAL'])
+                self.wakeup.clear()
+                continue
+            run_upload_job(job)
+
+upload_workers = UploadWorkerPool(app.config['UPLOAD_WORKERS'])
+upload_job_finished = threading.Condition()
+
+def queued_upload_jobs():
+    try:
+        return upload_jobs_collection.count_documents({"status": "queued"})
+    except Exception:
+        return float('nan')
+
+upload_job_queue_depth.set_function(queued_upload_jobs)
+
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Status of an upload job, with the upload result once finished. ?wait=N long-polls up to N seconds."""
+    try:
+        job_obj_id = ObjectId(job_id)
+        upload_workers.start()
+        
+        try:
+            wait = min(float(request.args.get('wait', 0)), app.config['UPLOAD_JOB_MAX_WAIT'])
+        except ValueError:
+            wait = 0
+        deadline = time.monotonic() + wait
+        
+        while True:
+            job = upload_jobs_collection.find_one({"_id": job_obj_id}, {"file_path": 0})
+            if not job:
+                return jsonify({"error": "Job not found"}), 404
+            
+            remaining = deadline - time.monotonic()
+            if job["status"] in ("done", "failed") or remaining <= 0:
+                break
+            # Woken by jobs finishing in this process; re-check periodically for other processes
+            with upload_job_finished:
+                upload_job_finished.wait(min(remaining, app.config['UPLOAD_JOB_POLL_INTERVAL']))
+        
+        response_data = {
+            "job_id": str(job["_id"]),
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "started_at": job.get("started_at"),
+            "finished_at": job.get("finished_at")
+        }
+        if "result" in job:
+            response_data["http_status"] = job["http_status"]
+            response_data["result"] = job["result"]
+        
+        return jsonify(response_data), 200
+    
+    except Exception as e:
+        return jsonify({"error": f"Error retrieving upload job: {str(e)}"}), 500
+
+def encode_cursor(sort_time, doc_id):
+    """Opaque keyset cursor pointing just after (sort_time, _id)"""
+    raw = f"{sort_time.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_time, doc_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.datetime.fromisoformat(sort_time), ObjectId(doc_id)
+
+def after_cursor(field, cursor):
+    """Query clause selecting documents that sort after the cursor, newest first"""
+    after_time, after_id = decode_cursor(cursor)
+    return [
+        {field: {"$lt": after_time}},
+        {field: after_time, "_id": {"$lt": after_id}}
+    ]
+
+def page_limit(default, maximum):
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
 
 @app.route('/api/history/<user_id>', methods=['GET'])
 def get_history(user_id):
     try:
         # Convert user_id string to ObjectId
         user_obj_id = ObjectId(user_id)
+        limit = page_limit(app.config['HISTORY_PAGE_SIZE'], app.config['HISTORY_MAX_PAGE_SIZE'])
+        
+        # Keyset pagination: newest first, continuing after the cursor's (upload_time, _id)
+        query = {"user_id": user_obj_id}
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                query["$or"] = after_cursor("upload_time", cursor)
+            except Exception:
+                return jsonify({"error": "Invalid cursor"}), 400
         
-        # Query the database for all images uploaded by this user
-        user_images = list(images_collection.find({"user_id": user_obj_id}))
+        # Fetch one extra document to know whether another page exists
+        user_images = list(
+            images_collection.find(query, LISTING_FIELDS)
+            .sort([("upload_time", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+            .limit(limit + 1)
+        )
+        has_more = len(user_images) > limit
+        user_images = user_images[:limit]
         
-        # Prepare the response data (exclude large image_data field to reduce payload size)
+        # Prepare the response data (images are fetched separately through their URLs)
         history = []
         for img in user_images:
             history.append({
@@ -291,10 +1287,15 @@ def get_history(user_id):
                 "upload_time": img["upload_time"],
                 "is_appropriate": img["is_appropriate"],
                 "ml_results": img["ml_results"],
-                "image_data": img["image_data"]  # Include image data for display
+                **image_urls(img, LISTING_KINDS)
             })
         
-        return jsonify({"history": history}), 200
+        next_cursor = None
+        if has_more:
+            last = user_images[-1]
+            next_cursor = encode_cursor(last["upload_time"], last["_id"])
+        
+        return jsonify({"history": history, "next_cursor": next_cursor}), 200
     
     except Exception as e:
         return jsonify({"error": f"Error retrieving history: {str(e)}"}), 500
@@ -306,30 +1307,118 @@ def get_image(image_id):
         image_obj_id = ObjectId(image_id)
         
         # Query the database for the image
-        image = images_collection.find_one({"_id": image_obj_id})
+        image = images_collection.find_one({"_id": image_obj_id}, {**LISTING_FIELDS, 'ml_results.tumor_mask': 1})
         
         if not image:
             return jsonify({"error": "Image not found"}), 404
         
-        # Return the image data including highlighted image if available
+        if image["ml_results"].get("highlight_status") == "pending" and app.config['ML_OVERLAY_FORMAT'] == 'rle':
+            # A deferred run-length mask is part of the metadata: attach it now,
+            # waiting up to ?wait= seconds for the ML service to finish it
+            try:
+                wait = min(float(request.args.get('wait', 0)), app.config['ML_HIGHLIGHT_WAIT'])
+            except ValueError:
+                wait = 0
+            attach_highlight(image_obj_id, wait)
+            image = images_collection.find_one({"_id": image_obj_id}, {**LISTING_FIELDS, 'ml_results.tumor_mask': 1})
+        
+        # Return the image metadata with URLs for the full-size images and their renditions
         response_data = {
             "image_id": str(image["_id"]),
             "filename": image["original_filename"],
             "upload_time": image["upload_time"],
             "is_appropriate": image["is_appropriate"],
             "ml_results": image["ml_results"],
-            "image_data": image["image_data"]
+            **image_urls(image)
         }
         
-        # Add highlighted image if it exists
-        if "highlighted_image" in image:
-            response_data["highlighted_image"] = image["highlighted_image"]
-        
         return jsonify(response_data), 200
     
     except Exception as e:
         return jsonify({"error": f"Error retrieving image: {str(e)}"}), 500
 
+def source_image_bytes(image_obj_id, kind):
+    """Bytes and content type of an original or highlighted image, or (None, None) if it has none"""
+    legacy_field = IMAGE_KINDS[kind]
+    image = images_collection.find_one(
+        {"_id": image_obj_id},
+        {f"blobs.{kind}": 1, legacy_field: 1, "original_filename": 1}
+    )
+    if not image:
+        return None, None
+    
+    blob = image.get("blobs", {}).get(kind)
+    if blob:
+        return blob_store.get(blob["id"]), blob["content_type"]
+    if image.get(legacy_field):
+        # Documents from before blobs were split out keep the bytes inline
+        data = base64.b64decode(image[legacy_field])
+        if kind == 'original':
+            return data, mimetypes.guess_type(image.get("original_filename", ""))[0] or 'application/octet-stream'
+        return data, 'image/png'
+    return None, None
+
+def backfill_renditions(image_obj_id, source):
+    """Generate and save the renditions of a document uploaded before they were made at ingest"""
+    data, _ = source_image_bytes(image_obj_id, source)
+    if data is None:
+        return {}
+    blobs = store_renditions(source, data)
+    if blobs:
+        images_collection.update_one(
+            {"_id": image_obj_id},
+            {"$set": {f"blobs.{kind}": blob for kind, blob in blobs.items()}}
+        )
+    return blobs
+
+@app.route('/api/image/<image_id>/<kind>', methods=['GET'])
+def get_image_blob(image_id, kind):
+    """Serve the bytes of one image kind with ETag and Cache-Control headers"""
+    if kind not in IMAGE_KINDS and kind not in RENDITIONS:
+        return jsonify({"error": f"Unknown image kind: {kind}"}), 404
+    
+    try:
+        image_obj_id = ObjectId(image_id)
+        image = images_collection.find_one({"_id": image_obj_id}, {f"blobs.{kind}": 1, "ml_results.highlight_status": 1})
+        if not image:
+            return jsonify({"error": "Image not found"}), 404
+        
+        blob = image.get("blobs", {}).get(kind)
+        source = RENDITIONS[kind][0] if kind in RENDITIONS else kind
+        if blob is None and source == 'highlighted' and image.get("ml_results", {}).get("highlight_status") == "pending":
+            # Deferred highlight not attached yet: fetch it now
+            blob = attach_highlight(image_obj_id, app.config['ML_HIGHLIGHT_WAIT']).get(kind)
+        if blob is None and kind in RENDITIONS:
+            blob = backfill_renditions(image_obj_id, RENDITIONS[kind][0]).get(kind)
+        
+        if blob:
+            etag = blob["id"]
+            # Answer revalidation without touching the blob store
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+            data = blob_store.get(blob["id"])
+            content_type = blob["content_type"]
+        elif kind in IMAGE_KINDS:
+            data, content_type = source_image_bytes(image_obj_id, kind)
+            etag = hashlib.sha256(data).hexdigest() if data is not None else None
+        else:
+            data = None
+        
+        if data is None:
+            return jsonify({"error": f"No {kind} image for {image_id}"}), 404
+        
+        response = make_response(data)
+        response.headers['Content-Type'] = content_type
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = app.config['IMAGE_CACHE_MAX_AGE']
+        return response.make_conditional(request)
+    
+    except Exception as e:
+        return jsonify({"error": f"Error retrieving image: {str(e)}"}), 500
+
 # Starred image endpoints
 @app.route('/api/starred/<user_id>', methods=['GET'])
 def get_starred_images(user_id):
@@ -337,14 +1426,37 @@ def get_starred_images(user_id):
         # Convert user_id string to ObjectId
         user_obj_id = ObjectId(user_id)
         
-        # Query the database for all starred items for this user
-        starred_items = list(starred_collection.find({"user_id": user_obj_id}))
+        limit = page_limit(app.config['STARRED_PAGE_SIZE'], app.config['STARRED_MAX_PAGE_SIZE'])
+        
+        # One page of starred items for this user, most recently starred first
+        # (by _id; the cursor is the last _id served)
+        query = {"user_id": user_obj_id}
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                query["_id"] = {"$lt": ObjectId(cursor)}
+            except Exception:
+                return jsonify({"error": "Invalid cursor", "starred_images": {}}), 400
+        
+        starred_items = list(
+            starred_collection.find(query, {"image_id": 1, "user_id": 1, "note": 1, "timestamp": 1})
+            .sort("_id", pymongo.DESCENDING)
+            .limit(limit + 1)
+        )
+        has_more = len(starred_items) > limit
+        starred_items = starred_items[:limit]
+        
+        # Fetch all the referenced images in one query instead of one per item
+        image_ids = [item["image_id"] for item in starred_items]
+        images = {
+            image["_id"]: image
+            for image in images_collection.find({"_id": {"$in": image_ids}}, LISTING_FIELDS)
+        }
         
-        # Process each starred item to add the image data
         starred_images = {}
         for item in starred_items:
             image_id = str(item["image_id"])
-            image = images_collection.find_one({"_id": item["image_id"]})
+            image = images.get(item["image_id"])
             
             if image:
                 starred_images[image_id] = {
@@ -352,16 +1464,20 @@ def get_starred_images(user_id):
                     "user_id": str(item["user_id"]),
                     "filename": image["original_filename"],
                     "upload_time": image["upload_time"],
-                    "image_data": image["image_data"],
                     "ml_results": image["ml_results"],
                     "note": item["note"],
-                    "timestamp": item["timestamp"]
+                    "timestamp": item["timestamp"],
+                    **image_urls(image, LISTING_KINDS)
                 }
         
+        next_cursor = None
+        if has_more:
+            next_cursor = str(starred_items[-1]["_id"])
+        
         # Log for debugging
         print(f"Found {len(starred_images)} starred images for user {user_id}")
         
-        return jsonify({"starred_images": starred_images}), 200
+        return jsonify({"starred_images": starred_images, "next_cursor": next_cursor}), 200
     
     except Exception as e:
         print(f"Error retrieving starred images: {str(e)}")
@@ -384,62 +1500,68 @@ def add_starred_image():
         image_id = ObjectId(data["image_id"])
         
         # Check if image exists
-        image = images_collection.find_one({"_id": image_id})
+        image = images_collection.find_one({"_id": image_id}, {"filename": 1, "upload_id": 1})
         if not image:
             return jsonify({"error": f"Image not found with ID: {data['image_id']}"}), 404
-            
-        # Check if already starred
-        existing = starred_collection.find_one({
-            "user_id": user_id,
-            "image_id": image_id
-        })
-        
-        # Create starred_images directory if it doesn't exist
-        starred_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'starred_images')
-        os.makedirs(starred_dir, exist_ok=True)
         
-        # Copy image to starred_images directory
-        original_image_path = os.path.join(app.config['UPLOAD_FOLDER'], image['filename'])
-        starred_image_path = os.path.join(starred_dir, f"starred_{image['filename']}")
+        # Insert or update the starred item in one atomic upsert, backed by the
+        # unique (user_id, image_id) index
+        selector = {"user_id": user_id, "image_id": image_id}
+        update = {"$set": {
+            "note": data["note"],
+            "timestamp": datetime.datetime.utcnow()
+        }}
+        try:
+            result = starred_collection.update_one(selector, update, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent request inserted the same item first; update it instead
+            result = starred_collection.update_one(selector, update)
         
-        if not os.path.exists(starred_image_path):
-            import shutil
-            shutil.copy2(original_image_path, starred_image_path)
+        if result.upserted_id is not None:
+            # New stars reference the stored upload rather than copying it
+            local_path, upload_id = starred_file(image)
+            starred_collection.update_one({"_id": result.upserted_id}, {"$set": {
+                "local_path": local_path,
+                "upload_id": upload_id
+            }})
         
-        if existing:
-            # Update existing starred item
-            print(f"Updating existing starred item for image {data['image_id']}")
-            starred_collection.update_one(
-                {"_id": existing["_id"]},
-                {"$set": {
-                    "note": data["note"],
-                    "timestamp": datetime.datetime.utcnow(),
-                    "local_path": starred_image_path
-                }}
-            )
+        if result.upserted_id is None:
+            print(f"Updated existing starred item for image {data['image_id']}")
             return jsonify({"message": "Starred image updated successfully"}), 200
-            
-        # Add new starred item
-        print(f"Adding new starred item for image {data['image_id']}")
-        starred_data = {
-            "user_id": user_id,
-            "image_id": image_id,
-            "note": data["note"],
-            "timestamp": datetime.datetime.utcnow(),
-            "local_path": starred_image_path
-        }
-        
-        result = starred_collection.insert_one(starred_data)
         
+        print(f"Added new starred item for image {data['image_id']}")
         return jsonify({
             "message": "Image starred successfully",
-            "starred_id": str(result.inserted_id)
+            "starred_id": str(result.upserted_id)
         }), 201
     
     except Exception as e:
         print(f"Error starring image: {str(e)}")
         return jsonify({"error": f"Error starring image: {str(e)}"}), 500
 
+def starred_file(image):
+    """
+    The file a new starred item points at: the image's stored upload, with a
+    reference taken on it, or for images uploaded before uploads were shared a
+    hard link to the old file in starred_images (a copy across file systems).
+    Returns (path, upload_id), with upload_id None when no reference was taken
+    """
+    upload_id = image.get("upload_id")
+    if upload_id and retain_upload(upload_id):
+        return upload_path(upload_id), upload_id
+    
+    starred_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'starred_images')
+    os.makedirs(starred_dir, exist_ok=True)
+    original_image_path = os.path.join(app.config['UPLOAD_FOLDER'], image['filename'])
+    starred_image_path = os.path.join(starred_dir, f"starred_{os.path.basename(image['filename'])}")
+    if not os.path.exists(starred_image_path):
+        try:
+            os.link(original_image_path, starred_image_path)
+        except OSError:
+            import shutil
+            shutil.copy2(original_image_path, starred_image_path)
+    return starred_image_path, None
+
 @app.route('/api/starred/<user_id>/<image_id>', methods=['DELETE'])
 def remove_starred_image(user_id, image_id):
     try:
@@ -448,13 +1570,15 @@ def remove_starred_image(user_id, image_id):
         image_obj_id = ObjectId(image_id)
         
         # Delete the starred item
-        result = starred_collection.delete_one({
+        starred = starred_collection.find_one_and_delete({
             "user_id": user_obj_id,
             "image_id": image_obj_id
-        })
+        }, projection={"upload_id": 1})
         
-        if result.deleted_count == 0:
+        if starred is None:
             return jsonify({"error": "Starred image not found"}), 404
+        if starred.get("upload_id"):
+            release_upload(starred["upload_id"])
             
         return jsonify({"message": "Image removed from starred successfully"}), 200
     
@@ -492,4 +1616,6 @@ def debug_collections(user_id):
         return jsonify({"error": f"Debug error: {str(e)}"}), 500
 
 if __name__ == '__main__':
+    upload_workers.start()
+    upload_gc.start()
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Helpers shared by the benchmark scripts. Run the scripts from backend/,
+e.g. `python -m bench.history_pagination`.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def load_flask_app(mongo_uri=None):
+    """
+    Import app.py against mongo_uri, or against an in-process mongomock
+    database when no URI is given. Image blobs go to a local folder.
+    """
+    os.environ["MONGO_URI"] = mongo_uri or "mongodb://mongomock"
+    os.environ.setdefault("BLOB_STORE", "local")
+    if mongo_uri is None:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        # mongomock adds _id to the projection dict it is given, which breaks
+        # app.py's shared LISTING_FIELDS under concurrent requests
+        find = mongomock.collection.Collection.find
+        mongomock.collection.Collection.find = lambda self, filter=None, projection=None, *args, **kwargs: find(
+            self, filter, dict(projection) if isinstance(projection, dict) else projection, *args, **kwargs
+        )
+    import app
+    return app
+
+
+def timed(fn, *args, **kwargs):
+    """Call fn and return (result, seconds)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def summarize(samples):
+    """p50/p95/p99/mean in milliseconds for a list of durations in seconds"""
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3)
+    }
+
+
+def write_results(results, path=None):
+    """Print results as JSON and optionally save them for regression tracking"""
+    text = json.dumps(results, indent=2, default=str)
+    print(text)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+
+
+def run_metadata():
+    """Where and on what code a benchmark ran, stored next to its results"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def run_load(send, concurrency, duration):
+    """
+    Call send(client, i) from `concurrency` threads for `duration` seconds,
+    where i counts that client's requests, and report throughput and latency.
+    send raises on a failed request.
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        i = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                send(index, i)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            i += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    elapsed = time.monotonic() - started
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "latency": summarize(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5]
+    }
+
+
+def process_tree(pid):
+    """pid and all of its descendants (Linux /proc)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def process_usage(pid):
+    """(CPU seconds, RSS bytes) summed over a process tree"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    cpu, rss = 0.0, 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{member}/statm") as f:
+                rss += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError):
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+    return cpu, rss
+
+
+def process_memory(pid):
+    """
+    RSS, PSS and USS in MB of each process in a tree, from /proc/<pid>/smaps_rollup
+    (Linux 4.14+). PSS charges each shared page to its sharers in equal parts,
+    and USS counts only the pages a process has to itself, so they show what
+    forked workers really share, which RSS does not
+    """
+    processes = []
+    for member in process_tree(pid):
+        fields = {}
+        try:
+            with open(f"/proc/{member}/smaps_rollup") as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if value.strip().endswith("kB"):
+                        fields[name] = int(value.split()[0])
+        except OSError:
+            continue
+        processes.append({
+            "pid": member,
+            "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+            "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+            "uss_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1)
+        })
+    return {
+        "processes": processes,
+        **{f"{key}_total_mb": round(sum(p[key + "_mb"] for p in processes), 1) for key in ("rss", "pss", "uss")}
+    }
+
+
+class ResourceSampler:
+    """
+    Samples CPU time and RSS of a service's process tree while a block runs:
+
+        with ResourceSampler(pid) as usage:
+            ...
+        usage.result  # cpu_seconds, cpu_percent, rss_peak_mb, rss_end_mb
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.result = {}
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._cpu_start, rss = process_usage(self.pid)
+        self._rss_peak = rss
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._rss_peak = max(self._rss_peak, process_usage(self.pid)[1])
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        cpu, rss = process_usage(self.pid)
+        elapsed = time.monotonic() - self._start
+        self.result = {
+            "cpu_seconds": round(cpu - self._cpu_start, 3),
+            "cpu_percent": round(100 * (cpu - self._cpu_start) / elapsed, 1),
+            "rss_peak_mb": round(max(self._rss_peak, rss) / 2**20, 1),
+            "rss_end_mb": round(rss / 2**20, 1)
+        }
+        return False
@@ -0,0 +1,97 @@
+"""
+Highlight pool benchmark: concurrent tumor highlighting (segmentation plus
+overlay encoding) run inline on the event loop (0 workers) and through
+HighlightPool with each process count. Reports throughput, per-job latency
+and event loop lag, i.e. how late a 5 ms ticker wakes up while the jobs run.
+
+    python -m bench.highlight_pool --workers 0,1,2,4 --concurrency 16 --jobs 200
+    SEGMENTATION_ENGINE=histogram python -m bench.highlight_pool --overlay rle
+
+With SEGMENTATION_ENGINE=histogram the results are deterministic and are
+checked against the inline ones.
+"""
+import argparse
+import asyncio
+import time
+
+import highlighting
+import ml_service
+from bench.common import run_metadata, summarize, write_results
+from bench.synthetic import synthetic_scans
+
+TICK = 0.005
+
+
+async def measure_lag(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append(time.perf_counter() - start - TICK)
+
+
+async def run_pool(workers, scans, args):
+    pool = ml_service.HighlightPool(workers)
+    pool.start()
+    try:
+        await pool.warm_up(ml_service.warmup_scan())
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, lag, results = [], [], [None] * args.jobs
+
+        async def job(i):
+            async with semaphore:
+                start = time.perf_counter()
+                results[i] = await pool.highlight(scans[i % len(scans)], args.overlay)
+                latencies.append(time.perf_counter() - start)
+
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(measure_lag(lag, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(job(i) for i in range(args.jobs)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await ticker
+    finally:
+        pool.stop()
+
+    return results, {
+        "throughput_per_s": round(args.jobs / elapsed, 2),
+        "latency": summarize(latencies),
+        "event_loop_lag": {**summarize(lag), "max_ms": round(max(lag, default=0) * 1000, 3)}
+    }
+
+
+async def run(args):
+    scans = synthetic_scans(args.images, args.image_size)
+    results = {}
+    reference = None
+    for workers in (int(w) for w in args.workers.split(",")):
+        outputs, results[workers] = await run_pool(workers, scans, args)
+        if highlighting.SEGMENTATION_ENGINE == "histogram":
+            if reference is None:
+                reference = outputs
+            results[workers]["matches_first_run"] = outputs == reference
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="0,1,2,4", help="pool sizes to compare (0 = inline)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=ml_service.MODEL_INPUT_SIZE[0])
+    parser.add_argument("--overlay", default=ml_service.OVERLAY_FORMAT, choices=ml_service.OVERLAY_FORMATS)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = {
+        **run_metadata(),
+        "segmentation_engine": highlighting.SEGMENTATION_ENGINE,
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "workers": asyncio.run(run(args))
+    }
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
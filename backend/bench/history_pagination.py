@@ -0,0 +1,106 @@
+"""
+History API benchmark: seeds one user's history and measures per-page
+latency of GET /api/history/<user_id> at increasing depths, next to the
+old unbounded, unprojected query.
+
+    python -m bench.history_pagination --documents 20000
+    python -m bench.history_pagination --mongo-uri mongodb://localhost:27017
+
+mongomock (the default) checks correctness and payload sizes, but scans on
+every query; use a local mongod to see the user_history index keep page
+latency flat.
+"""
+import argparse
+import base64
+import datetime
+import os
+
+from bson import ObjectId
+
+from bench.common import load_flask_app, summarize, timed, write_results
+
+
+def seed(images_collection, user_id, count, inline_kb):
+    """Insert count documents for user_id (plus as many for other users)"""
+    inline = base64.b64encode(os.urandom(inline_kb * 1024)).decode() if inline_kb else None
+    start = datetime.datetime(2024, 1, 1)
+    batch = []
+    for i in range(count * 2):
+        owner = user_id if i % 2 == 0 else ObjectId()
+        doc = {
+            "user_id": owner,
+            "filename": f"{i}.png",
+            "original_filename": f"scan_{i}.png",
+            "upload_time": start + datetime.timedelta(seconds=i),
+            "is_appropriate": True,
+            "ml_results": {"prediction": "Negative", "confidence": 0.9, "tumor_type": "None",
+                           "precautions": [], "treatment_options": []}
+        }
+        if inline:
+            doc["image_data"] = inline
+        batch.append(doc)
+        if len(batch) == 1000:
+            images_collection.insert_many(batch)
+            batch = []
+    if batch:
+        images_collection.insert_many(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", help="local mongod to benchmark against (default: mongomock)")
+    parser.add_argument("--documents", type=int, default=20000, help="history size for the benchmark user")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--depths", default="1,10,100,500", help="page numbers to sample")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--inline-kb", type=int, default=0, help="legacy inline image_data size per document")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    app = load_flask_app(args.mongo_uri)
+    client = app.app.test_client()
+    user_id = ObjectId()
+    seed(app.images_collection, user_id, args.documents, args.inline_kb)
+
+    try:
+        results = {"documents": args.documents, "page_size": args.page_size, "pages": {}}
+
+        # Old behaviour: every document for the user, every field
+        samples = []
+        for _ in range(args.repeats):
+            _, elapsed = timed(lambda: list(app.images_collection.find({"user_id": user_id})))
+            samples.append(elapsed)
+        results["unbounded_query"] = summarize(samples)
+
+        # Walk the cursor chain once, remembering the cursor for each sampled depth
+        depths = sorted(int(d) for d in args.depths.split(","))
+        cursors, cursor, page = {1: None}, None, 1
+        while page < depths[-1]:
+            url = f"/api/history/{user_id}?limit={args.page_size}" + (f"&cursor={cursor}" if cursor else "")
+            cursor = client.get(url).get_json()["next_cursor"]
+            if cursor is None:
+                break
+            page += 1
+            cursors[page] = cursor
+
+        for depth in depths:
+            if depth not in cursors:
+                continue
+            url = f"/api/history/{user_id}?limit={args.page_size}"
+            if cursors[depth]:
+                url += f"&cursor={cursors[depth]}"
+            samples, size = [], 0
+            for _ in range(args.repeats):
+                response, elapsed = timed(client.get, url)
+                samples.append(elapsed)
+                size = len(response.data)
+            results["pages"][depth] = {**summarize(samples), "response_bytes": size}
+
+        write_results(results, args.output)
+    finally:
+        app.images_collection.delete_many({"upload_time": {"$gte": datetime.datetime(2024, 1, 1)},
+                                           "filename": {"$regex": r"^\d+\.png$"}})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+K-means highlighting before and after vectorization: the original per-pixel
+Python loops (kept here as loop_tumor_mask, the reference implementation)
+against highlighting.tumor_mask with the cv2.kmeans engine. Both runs of each
+scan use the same cv2.setRNGSeed, so the masks must match pixel for pixel;
+the run fails if any scan differs.
+
+    python -m bench.kmeans_loops --sizes 250,512 --images 20
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+import highlighting
+import ml_service
+from bench.common import run_metadata, summarize, timed, write_results
+from bench.synthetic import synthetic_scans
+
+
+def loop_tumor_mask(pixels):
+    """tumor_mask as it was written before vectorization, without the error fallback"""
+    if len(pixels.shape) == 3 and pixels.shape[2] == 3:
+        gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = pixels
+    
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, brain_mask = cv2.threshold(blurred, 20, 255, cv2.THRESH_BINARY)
+    kernel = np.ones((5, 5), np.uint8)
+    brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    brain_region = cv2.bitwise_and(blurred, blurred, mask=brain_mask)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    enhanced = clahe.apply(brain_region)
+    
+    data = []
+    coords = []
+    for y in range(enhanced.shape[0]):
+        for x in range(enhanced.shape[1]):
+            if brain_mask[y, x] > 0:
+                data.append([enhanced[y, x]])
+                coords.append([y, x])
+    data = np.float32(data)
+    
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    _, labels, centers = cv2.kmeans(data, 3, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    highest_intensity_cluster = np.argmax(centers)
+    
+    segmentation = np.zeros_like(gray)
+    for i, (y, x) in enumerate(coords):
+        if labels[i] == highest_intensity_cluster:
+            segmentation[y, x] = 255
+    
+    num_labels, labels_img = cv2.connectedComponents(segmentation)
+    label_areas = []
+    for label in range(1, num_labels):
+        label_areas.append((label, np.sum(labels_img == label)))
+    label_areas.sort(key=lambda x: x[1], reverse=True)
+    
+    tumor_mask = np.zeros_like(segmentation)
+    top_n = min(3, len(label_areas))
+    brain_area = np.sum(brain_mask > 0)
+    min_area = 50
+    max_area = brain_area * 0.2
+    for i in range(min(top_n, len(label_areas))):
+        label, area = label_areas[i]
+        if min_area <= area <= max_area:
+            tumor_mask[labels_img == label] = 255
+    
+    if np.sum(tumor_mask) == 0:
+        binary = cv2.adaptiveThreshold(enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY_INV, 11, 2)
+        binary = cv2.bitwise_and(binary, binary, mask=brain_mask)
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area >= min_area and area <= max_area:
+                cv2.drawContours(tumor_mask, [contour], -1, 255, -1)
+    
+    tumor_mask = cv2.GaussianBlur(tumor_mask, (9, 9), 0)
+    return tumor_mask > 128
+
+
+def seeded(fn, pixels, seed):
+    cv2.setRNGSeed(seed)
+    return timed(fn, pixels)
+
+
+def run_size(size, args):
+    loop_samples, vectorized_samples, mismatches = [], [], 0
+    for seed, pixels in enumerate(synthetic_scans(args.images, size)):
+        for _ in range(args.repeats):
+            expected, seconds = seeded(loop_tumor_mask, pixels, seed)
+            loop_samples.append(seconds)
+            mask, seconds = seeded(highlighting.tumor_mask, pixels, seed)
+            vectorized_samples.append(seconds)
+            mismatches += not np.array_equal(expected, mask)
+    loops, vectorized = summarize(loop_samples), summarize(vectorized_samples)
+    return {
+        "loops": loops,
+        "vectorized": vectorized,
+        "speedup_p50": round(loops["p50_ms"] / vectorized["p50_ms"], 2),
+        "mismatched_masks": mismatches
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=str(ml_service.MODEL_INPUT_SIZE[0]), help="comma-separated scan sizes")
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    highlighting.SEGMENTATION_ENGINE = "kmeans"
+    results = {
+        **run_metadata(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "sizes": {}
+    }
+    for size in (int(size) for size in args.sizes.split(",")):
+        results["sizes"][size] = run_size(size, args)
+
+    write_results(results, args.output)
+    failures = [f"{size}px: {result['mismatched_masks']} masks differ from the loop version"
+                for size, result in results["sizes"].items() if result["mismatched_masks"]]
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+End-to-end load test for both services. Starts the ML service (Gemini
+stubbed) and the Flask API (mongomock, or --mongo-uri for a local mongod),
+then runs each scenario with concurrent clients cycling through synthetic
+MRI-like scans:
+
+    predict  POST /predict on the ML service
+    upload   POST /api/upload on the Flask API (synchronous, calls the ML service)
+    history  GET /api/history/<user_id> on the Flask API
+
+For every scenario it reports throughput, p50/p95/p99 latency, errors and
+the CPU time and RSS of each service's processes, as JSON:
+
+    python -m bench.load --concurrency 8 --duration 30 --output results.json
+    python -m bench.load --scenarios predict --ml-workers 4
+    python -m bench.load --ml-url http://127.0.0.1:8001 --flask-url http://127.0.0.1:5000
+
+Pointing --ml-url/--flask-url at running services skips starting them (and
+their resource figures).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+
+import requests
+from bson import ObjectId
+
+from bench.common import ResourceSampler, run_load, run_metadata, write_results
+from bench.synthetic import encode, synthetic_scans
+
+SCENARIOS = ("predict", "upload", "history")
+
+
+def start_ml_service(port, workers, cache):
+    env = {
+        **os.environ,
+        "GEMINI_STUB": os.getenv("GEMINI_STUB", "yes"),
+        "PREDICTION_CACHE_SIZE": os.environ.get("PREDICTION_CACHE_SIZE", "256") if cache else "0",
+        "PREDICTION_CACHE_DIR": os.environ.get("PREDICTION_CACHE_DIR", "") if cache else ""
+    }
+    if workers:
+        env.update(ML_WORKERS=str(workers), ML_BIND=f"127.0.0.1:{port}")
+        command = ["-m", "gunicorn", "-c", "gunicorn.fast.conf.py", "ml_service:app"]
+    else:
+        command = ["-m", "uvicorn", "ml_service:app", "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen([sys.executable, *command], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_flask(port, ml_url, mongo_uri):
+    command = ["-m", "bench.serve_flask", "--port", str(port), "--ml-service-url", ml_url]
+    if mongo_uri:
+        command += ["--mongo-uri", mongo_uri]
+    # Every simulated client uploads as the same user, so the per-user limit is off
+    env = {**os.environ, "PYTHONPATH": os.getcwd(), "UPLOAD_RATE_LIMIT": os.getenv("UPLOAD_RATE_LIMIT", "0")}
+    return subprocess.Popen([sys.executable, *command], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for(url, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def checked(response):
+    response.raise_for_status()
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20, help="seconds per scenario")
+    parser.add_argument("--images", type=int, default=32, help="distinct synthetic scans")
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--image-format", default="PNG", choices=("PNG", "JPEG"))
+    parser.add_argument("--cache", action="store_true", help="keep the ML prediction cache on")
+    parser.add_argument("--ml-workers", type=int, default=0, help="run the ML service under gunicorn with N workers")
+    parser.add_argument("--ml-url", help="use a running ML service")
+    parser.add_argument("--flask-url", help="use a running Flask API")
+    parser.add_argument("--ml-port", type=int, default=8100)
+    parser.add_argument("--flask-port", type=int, default=5100)
+    parser.add_argument("--mongo-uri", help="local mongod for the Flask API (default: mongomock)")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    extension = "png" if args.image_format == "PNG" else "jpg"
+    images = [encode(pixels, args.image_format) for pixels in synthetic_scans(args.images, args.image_size)]
+
+    processes = {}
+    ml_url = args.ml_url or f"http://127.0.0.1:{args.ml_port}"
+    flask_url = args.flask_url or f"http://127.0.0.1:{args.flask_port}"
+    if not args.ml_url:
+        processes["ml_service"] = start_ml_service(args.ml_port, args.ml_workers, args.cache)
+    if not args.flask_url and {"upload", "history"} & set(scenarios):
+        processes["flask"] = start_flask(args.flask_port, ml_url, args.mongo_uri)
+
+    results = {
+        **run_metadata(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": {}
+    }
+    user_id = str(ObjectId())
+    sessions = [requests.Session() for _ in range(args.concurrency)]
+
+    def image(client, i):
+        return images[(client + i * args.concurrency) % len(images)]
+
+    def predict(client, i):
+        files = {"file": (f"scan.{extension}", image(client, i))}
+        checked(sessions[client].post(f"{ml_url}/predict", files=files, timeout=120))
+
+    def upload(client, i):
+        files = {"image": (f"scan.{extension}", image(client, i))}
+        checked(sessions[client].post(f"{flask_url}/api/upload", data={"user_id": user_id}, files=files, timeout=120))
+
+    def history(client, i):
+        checked(sessions[client].get(f"{flask_url}/api/history/{user_id}", timeout=60))
+
+    senders = {"predict": predict, "upload": upload, "history": history}
+
+    try:
+        wait_for(f"{ml_url}/health/ready")
+        if "flask" in processes or args.flask_url:
+            wait_for(f"{flask_url}/metrics")
+        # Warm up: model loading, connection pools, and a history to page through
+        for i in range(min(len(images), 8)):
+            predict(0, i)
+            if {"upload", "history"} & set(scenarios):
+                upload(0, i)
+
+        for scenario in scenarios:
+            samplers = {name: ResourceSampler(process.pid) for name, process in processes.items()}
+            with samplers.get("ml_service", nullcontext()), samplers.get("flask", nullcontext()):
+                result = run_load(senders[scenario], args.concurrency, args.duration)
+            result["resources"] = {name: sampler.result for name, sampler in samplers.items()}
+            results["scenarios"][scenario] = result
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait(timeout=60)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
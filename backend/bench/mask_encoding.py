@@ -0,0 +1,60 @@
+"""
+Overlay encoding benchmark: response bytes and CPU spent turning a tumor
+mask into the /predict JSON, for the base64 PNG overlay ("png") and the
+run-length mask ("rle") formats.
+
+    python -m bench.mask_encoding --images 50
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import highlighting
+import ml_service
+from bench.common import summarize, write_results
+from bench.synthetic import synthetic_scans
+
+
+def encode_response(pixels, mask, overlay_format):
+    if overlay_format == "rle":
+        fields = {"highlighted_image": None, "tumor_mask": highlighting.encode_mask_rle(mask)}
+    else:
+        fields = {"highlighted_image": highlighting.render_overlay(pixels, mask)}
+    return json.dumps({"is_appropriate": True, "ml_results": {"prediction": "Positive", **fields}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--size", type=int, default=ml_service.MODEL_INPUT_SIZE[0])
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    scans = synthetic_scans(args.images, args.size)
+    masks = [highlighting.tumor_mask(pixels) for pixels in scans]
+
+    # The run-length form must round-trip exactly
+    for mask in masks:
+        assert np.array_equal(highlighting.decode_mask_rle(highlighting.encode_mask_rle(mask)), mask)
+
+    results = {"images": args.images, "size": args.size, "formats": {}}
+    for overlay_format in ml_service.OVERLAY_FORMATS:
+        samples, sizes = [], []
+        for pixels, mask in zip(scans, masks):
+            start = time.perf_counter()
+            body = encode_response(pixels, mask, overlay_format)
+            samples.append(time.perf_counter() - start)
+            sizes.append(len(body))
+        results["formats"][overlay_format] = {
+            "serialize": summarize(samples),
+            "response_bytes_mean": round(float(np.mean(sizes))),
+            "response_bytes_max": int(np.max(sizes))
+        }
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
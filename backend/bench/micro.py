@@ -0,0 +1,90 @@
+"""
+Micro-benchmarks of the ML pipeline, run in-process on synthetic scans:
+preprocess_image, kmeans_tumor_detection (and its tumor_mask /
+render_overlay halves) and process_brain_image with the configured model.
+
+    python -m bench.micro --images 50 --output micro.json
+    INFERENCE_BACKEND=tflite python -m bench.micro --only process_brain_image
+
+Without a model file process_brain_image takes the fallback path, which
+skips inference; the results record whether a model was loaded.
+"""
+import argparse
+import asyncio
+import time
+
+import highlighting
+import ml_service
+from bench.common import run_metadata, summarize, timed, write_results
+from bench.synthetic import encode, synthetic_scans
+
+BENCHMARKS = ("preprocess_image", "tumor_mask", "render_overlay", "kmeans_tumor_detection", "process_brain_image")
+
+
+def sample(fn, inputs, repeats):
+    samples = []
+    for _ in range(repeats):
+        for item in inputs:
+            samples.append(timed(fn, item)[1])
+    return summarize(samples)
+
+
+async def sample_async(fn, inputs, repeats):
+    samples = []
+    for _ in range(repeats):
+        for item in inputs:
+            start = time.perf_counter()
+            await fn(item)
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def run(args):
+    uploads = [encode(pixels, args.image_format) for pixels in synthetic_scans(args.images, args.image_size)]
+    prepared = [ml_service.preprocess_image(data) for data in uploads]
+    pixels = [item.pixels for item in prepared]
+    masks = [highlighting.tumor_mask(p) for p in pixels]
+    selected = args.only.split(",") if args.only else BENCHMARKS
+    results = {}
+
+    if "preprocess_image" in selected:
+        results["preprocess_image"] = sample(ml_service.preprocess_image, uploads, args.repeats)
+    if "tumor_mask" in selected:
+        results["tumor_mask"] = sample(highlighting.tumor_mask, pixels, args.repeats)
+    if "render_overlay" in selected:
+        results["render_overlay"] = sample(lambda pair: highlighting.render_overlay(*pair), list(zip(pixels, masks)), args.repeats)
+    if "kmeans_tumor_detection" in selected:
+        results["kmeans_tumor_detection"] = sample(highlighting.kmeans_tumor_detection, pixels, args.repeats)
+    if "process_brain_image" in selected:
+        await ml_service.startup_event()
+        try:
+            results["process_brain_image"] = {
+                "model_loaded": ml_service.brain_tumor_model is not None,
+                "backend": getattr(ml_service.brain_tumor_model, "name", None),
+                **await sample_async(ml_service.process_brain_image, prepared, args.repeats)
+            }
+        finally:
+            await ml_service.shutdown_event()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=512, help="upload size; the pipeline resizes to the model input")
+    parser.add_argument("--image-format", default="PNG", choices=("PNG", "JPEG"))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", help=f"comma-separated subset of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = {
+        **run_metadata(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "benchmarks": asyncio.run(run(args))
+    }
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
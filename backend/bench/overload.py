@@ -0,0 +1,135 @@
+"""
+Overload benchmark for admission control: starts the ML service once with
+admission control off (ADMISSION_MAX_CONCURRENCY=0) and once with each given
+limit, then drives /predict with more concurrent clients than it can serve.
+Some clients use the bulk lane (--bulk-share), the rest the interactive one.
+
+Gemini is stubbed with a fixed latency and the pre-filter is off, so every
+request holds a Gemini thread (GEMINI_MAX_CONCURRENCY) like a slow upstream.
+Clients give up after --timeout seconds, as the Flask gateway does, and wait
+out a 503's Retry-After (at most --max-backoff seconds) before trying again.
+Per lane it reports goodput (answers within the timeout per second), latency
+of those answers, and how many requests were shed or timed out:
+
+    python -m bench.overload --clients 64 --duration 30 --limits 8,16
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.common import run_metadata, summarize, write_results
+from bench.load import wait_for
+from bench.synthetic import encode, synthetic_scans
+
+
+def start_ml_service(port, limit, args):
+    env = {
+        **os.environ,
+        "ADMISSION_MAX_CONCURRENCY": str(limit),
+        "ADMISSION_DEADLINE_S": str(args.timeout / 2),
+        "GEMINI_STUB": os.getenv("GEMINI_STUB", "yes"),
+        "GEMINI_STUB_LATENCY_MS": str(args.gemini_latency_ms),
+        "GEMINI_VERDICT_CACHE_SIZE": "0",
+        "PREFILTER_ENABLED": "0",
+        "PREDICTION_CACHE_SIZE": "0",
+        "PREDICTION_CACHE_DIR": ""
+    }
+    command = ["-m", "uvicorn", "ml_service:app", "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen([sys.executable, *command], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_overload(url, images, args):
+    outcomes = {lane: {"ok": [], "shed": [], "timeout": 0, "error": 0} for lane in ("interactive", "bulk")}
+    lock = threading.Lock()
+    bulk_clients = round(args.clients * args.bulk_share)
+    deadline = time.monotonic() + args.duration
+
+    def client(index):
+        lane = "bulk" if index < bulk_clients else "interactive"
+        session = requests.Session()
+        i = 0
+        while time.monotonic() < deadline:
+            data = images[(index + i * args.clients) % len(images)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                response = session.post(
+                    f"{url}/predict", files={"file": ("scan.png", data, "image/png")},
+                    params={"priority": lane}, timeout=args.timeout
+                )
+            except requests.Timeout:
+                with lock:
+                    outcomes[lane]["timeout"] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    outcomes[lane]["ok"].append(elapsed)
+                elif response.status_code == 503:
+                    outcomes[lane]["shed"].append(elapsed)
+                else:
+                    outcomes[lane]["error"] += 1
+            if response.status_code == 503:
+                time.sleep(min(float(response.headers.get("Retry-After", 1)), args.max_backoff))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(args.clients) as pool:
+        list(pool.map(client, range(args.clients)))
+    elapsed = time.monotonic() - started
+
+    return {
+        lane: {
+            "goodput_per_s": round(len(result["ok"]) / elapsed, 2),
+            "latency": summarize(result["ok"]),
+            "shed": len(result["shed"]),
+            "shed_latency": summarize(result["shed"]),
+            "timeouts": result["timeout"],
+            "errors": result["error"]
+        }
+        for lane, result in outcomes.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limits", default="16", help="ADMISSION_MAX_CONCURRENCY values to compare with no limit")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--bulk-share", type=float, default=0.5, help="fraction of clients in the bulk lane")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--timeout", type=float, default=10, help="client read timeout in seconds")
+    parser.add_argument("--max-backoff", type=float, default=1, help="longest wait after a 503")
+    parser.add_argument("--gemini-latency-ms", type=float, default=200)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--port", type=int, default=8110)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    images = [encode(pixels, "PNG") for pixels in synthetic_scans(args.images, args.image_size)]
+    url = f"http://127.0.0.1:{args.port}"
+    results = {
+        **run_metadata(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "limits": {}
+    }
+    for limit in [0] + [int(limit) for limit in args.limits.split(",")]:
+        process = start_ml_service(args.port, limit, args)
+        try:
+            wait_for(f"{url}/health/ready")
+            results["limits"][limit or "off"] = run_overload(url, images, args)
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
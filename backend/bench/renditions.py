@@ -0,0 +1,53 @@
+"""
+Rendition benchmark: the time upload_image spends building thumbnails and
+previews for each scan size, and the bytes a listing page downloads with
+thumbnails instead of the full-size originals.
+
+    python -m bench.renditions --sizes 256,512,1024,2048
+    python -m bench.renditions --formats PNG,JPEG --page-size 20
+"""
+import argparse
+
+from bench.common import load_flask_app, summarize, timed, write_results
+from bench.synthetic import encode, synthetic_scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="256,512,1024,2048", help="scan widths in pixels")
+    parser.add_argument("--formats", default="PNG,JPEG", help="upload formats")
+    parser.add_argument("--page-size", type=int, default=20, help="cards on one listing page")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    app = load_flask_app()
+    _, content_type = app.rendition_format()
+    results = {
+        "rendition_format": content_type,
+        "thumbnail_size": app.app.config['THUMBNAIL_SIZE'],
+        "preview_size": app.app.config['PREVIEW_SIZE'],
+        "uploads": {}
+    }
+
+    for upload_format in args.formats.split(","):
+        for size in (int(s) for s in args.sizes.split(",")):
+            data = encode(synthetic_scan(size, size), upload_format)
+            samples = []
+            for _ in range(args.repeats):
+                renditions, elapsed = timed(app.build_renditions, "original", data)
+                samples.append(elapsed)
+            results["uploads"][f"{upload_format.lower()}_{size}"] = {
+                "ingest": summarize(samples),
+                "bytes": {"original": len(data), **{kind: len(r) for kind, r in renditions.items()}},
+                "listing_page_bytes": {
+                    "originals": len(data) * args.page_size,
+                    "thumbnails": len(renditions["thumbnail"]) * args.page_size
+                }
+            }
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Segmentation engine benchmark: the cv2.kmeans clustering of brain pixels
+("kmeans") against the exact histogram clustering ("histogram"), on
+synthetic scans at the model input size and at upload resolution.
+
+For each size it times the clustering step alone and the whole tumor_mask,
+and checks that the engines agree: the share of scans where both put the
+brightest cluster's boundary at the same intensity, and the IoU of the
+segmentations and final masks. The run fails if the mean mask IoU is below
+--min-iou or the histogram engine is not deterministic.
+
+    python -m bench.segmentation --sizes 250,1024,2048 --images 20
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+import highlighting
+import ml_service
+from bench.common import run_metadata, summarize, timed, write_results
+from bench.synthetic import synthetic_scans
+
+SEGMENTERS = {
+    "kmeans": highlighting.kmeans_segmentation,
+    "histogram": highlighting.histogram_segmentation
+}
+
+
+def iou(a, b):
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def lowest_selected(enhanced, segmentation):
+    selected = enhanced[segmentation > 0]
+    return int(selected.min()) if selected.size else None
+
+
+def tumor_masks(engine, scans, repeats):
+    """Time tumor_mask under one engine; returns (masks, samples)"""
+    saved = highlighting.SEGMENTATION_ENGINE
+    highlighting.SEGMENTATION_ENGINE = engine
+    try:
+        masks, samples = [], []
+        for _ in range(repeats):
+            masks = []
+            for pixels in scans:
+                mask, seconds = timed(highlighting.tumor_mask, pixels)
+                masks.append(mask)
+                samples.append(seconds)
+        return masks, samples
+    finally:
+        highlighting.SEGMENTATION_ENGINE = saved
+
+
+def run_size(size, args):
+    scans = synthetic_scans(args.images, size)
+    inputs = []
+    for pixels in scans:
+        enhanced, brain_mask = highlighting.enhance_brain(cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY))
+        inputs.append((enhanced, brain_mask > 0))
+
+    result = {"engines": {}}
+    segmentations = {}
+    for engine, segment in SEGMENTERS.items():
+        samples = []
+        for _ in range(args.repeats):
+            segmentations[engine] = []
+            for enhanced, brain_pixels in inputs:
+                segmentation, seconds = timed(segment, enhanced, brain_pixels)
+                segmentations[engine].append(segmentation)
+                samples.append(seconds)
+        masks, mask_samples = tumor_masks(engine, scans, args.repeats)
+        segmentations[engine + "_masks"] = masks
+        result["engines"][engine] = {"clustering": summarize(samples), "tumor_mask": summarize(mask_samples)}
+
+    # The histogram engine must give the same answer every time
+    again, _ = tumor_masks("histogram", scans, 1)
+    deterministic = all(np.array_equal(a, b) for a, b in zip(again, segmentations["histogram_masks"]))
+
+    same_threshold = [
+        lowest_selected(enhanced, k) == lowest_selected(enhanced, h)
+        for (enhanced, _), k, h in zip(inputs, segmentations["kmeans"], segmentations["histogram"])
+    ]
+    segmentation_iou = [iou(k > 0, h > 0) for k, h in zip(segmentations["kmeans"], segmentations["histogram"])]
+    mask_iou = [iou(k, h) for k, h in zip(segmentations["kmeans_masks"], segmentations["histogram_masks"])]
+    result["agreement"] = {
+        "same_threshold": round(float(np.mean(same_threshold)), 3),
+        "segmentation_iou_mean": round(float(np.mean(segmentation_iou)), 4),
+        "mask_iou_mean": round(float(np.mean(mask_iou)), 4),
+        "mask_iou_min": round(float(np.min(mask_iou)), 4),
+        "histogram_deterministic": deterministic
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=f"{ml_service.MODEL_INPUT_SIZE[0]},1024", help="comma-separated scan sizes")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-iou", type=float, default=0.95, help="fail below this mean tumor mask IoU")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = {
+        **run_metadata(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "sizes": {}
+    }
+    failures = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        result = results["sizes"][size] = run_size(size, args)
+        agreement = result["agreement"]
+        if agreement["mask_iou_mean"] < args.min_iou:
+            failures.append(f"{size}px: mean mask IoU {agreement['mask_iou_mean']} < {args.min_iou}")
+        if not agreement["histogram_deterministic"]:
+            failures.append(f"{size}px: histogram engine gave different masks on a second run")
+
+    write_results(results, args.output)
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
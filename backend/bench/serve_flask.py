@@ -0,0 +1,30 @@
+"""
+Runs app.py on a threaded server for load tests, against mongomock (or
+--mongo-uri) with blobs and uploads in a scratch directory:
+
+    python -m bench.serve_flask --port 5100 --ml-service-url http://127.0.0.1:8100
+"""
+import argparse
+import os
+import tempfile
+
+from bench.common import load_flask_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--mongo-uri", help="local mongod (default: in-process mongomock)")
+    parser.add_argument("--ml-service-url", default="http://127.0.0.1:8100")
+    args = parser.parse_args()
+
+    os.environ["ML_SERVICE_URL"] = args.ml_service_url
+    # uploads/ and the blob folder are relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="bench-flask-"))
+    app = load_flask_app(args.mongo_uri)
+    app.upload_workers.start()
+    app.app.run(host="127.0.0.1", port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Serving scale-out benchmark: starts the ML service under gunicorn
+(gunicorn.fast.conf.py) with each worker count in turn, drives /predict
+with concurrent clients for a fixed time and reports throughput and
+latency, plus the memory of the whole process tree once the workers are warm
+(RSS, PSS and USS per process: PSS shows how much the workers really share).
+Run it on the box you size for, with the real model in models/.
+
+    python -m bench.serving_scaling --workers 1,2,4,8 --concurrency 32 --duration 30
+    INFERENCE_BACKEND=tflite python -m bench.serving_scaling --workers 1,4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.common import ResourceSampler, process_memory, run_load, run_metadata, write_results
+from bench.synthetic import encode, synthetic_scans
+
+
+def start_server(workers, port):
+    env = {
+        **os.environ,
+        "ML_WORKERS": str(workers),
+        "ML_BIND": f"127.0.0.1:{port}",
+        # Every request does the full pipeline: no cached results, no Gemini calls
+        "PREDICTION_CACHE_SIZE": "0",
+        "PREDICTION_CACHE_DIR": "",
+        "GEMINI_STUB": os.getenv("GEMINI_STUB", "yes")
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.fast.conf.py", "ml_service:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_until_ready(url, images, workers, timeout=300):
+    """Wait for the service to answer, then warm up every worker"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/health/ready", timeout=2).status_code == 200:
+                break
+        except requests.RequestException:
+            # Refused while starting, or too busy loading the model to answer
+            pass
+        time.sleep(0.5)
+    else:
+        raise RuntimeError(f"ML service at {url} did not start")
+    with ThreadPoolExecutor(workers * 2) as pool:
+        list(pool.map(lambda data: post(url, requests.Session(), data), images[:workers * 4]))
+
+
+def post(url, session, data):
+    response = session.post(f"{url}/predict", files={"file": ("scan.png", data, "image/png")}, timeout=60)
+    response.raise_for_status()
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="worker counts to compare")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per worker count")
+    parser.add_argument("--images", type=int, default=64, help="distinct synthetic scans to cycle through")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    images = [encode(pixels) for pixels in synthetic_scans(args.images, 512)]
+    url = f"http://127.0.0.1:{args.port}"
+    results = {
+        **run_metadata(),
+        "inference_backend": os.getenv("INFERENCE_BACKEND", "keras"),
+        "concurrency": args.concurrency,
+        "workers": {}
+    }
+
+    for workers in (int(w) for w in args.workers.split(",")):
+        server = start_server(workers, args.port)
+        try:
+            wait_until_ready(url, images, workers)
+            sessions = [requests.Session() for _ in range(args.concurrency)]
+
+            def send(client, i):
+                post(url, sessions[client], images[(client + i * args.concurrency) % len(images)])
+
+            with ResourceSampler(server.pid) as usage:
+                results["workers"][workers] = run_load(send, args.concurrency, args.duration)
+            results["workers"][workers]["resources"] = usage.result
+            memory = process_memory(server.pid)
+            memory["pss_per_worker_mb"] = round(memory["pss_total_mb"] / workers, 1)
+            results["workers"][workers]["memory"] = memory
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Starred listing benchmark: for a growing number of starred items, compares
+GET /api/starred/<user_id> (one batched $in image query per page) with the
+old loop that issued one images.find_one per starred item.
+
+    python -m bench.starred_listing --sizes 10,100,1000
+    python -m bench.starred_listing --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import base64
+import datetime
+import os
+
+from bson import ObjectId
+
+from bench.common import load_flask_app, summarize, timed, write_results
+
+
+def seed(app, user_id, count, inline_kb):
+    inline = base64.b64encode(os.urandom(inline_kb * 1024)).decode() if inline_kb else None
+    now = datetime.datetime.utcnow()
+    images = []
+    for i in range(count):
+        doc = {
+            "user_id": user_id,
+            "filename": f"bench_{i}.png",
+            "original_filename": f"scan_{i}.png",
+            "upload_time": now,
+            "is_appropriate": True,
+            "ml_results": {"prediction": "Negative", "confidence": 0.9}
+        }
+        if inline:
+            doc["image_data"] = inline
+        images.append(doc)
+    image_ids = app.images_collection.insert_many(images).inserted_ids
+    app.starred_collection.insert_many([
+        {"user_id": user_id, "image_id": image_id, "note": "bench",
+         "timestamp": now - datetime.timedelta(seconds=i)}
+        for i, image_id in enumerate(image_ids)
+    ])
+    return image_ids
+
+
+def n_plus_one(app, user_id):
+    """The previous implementation: one image lookup per starred item"""
+    items = list(app.starred_collection.find({"user_id": user_id}))
+    return [app.images_collection.find_one({"_id": item["image_id"]}) for item in items]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", help="local mongod to benchmark against (default: mongomock)")
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--inline-kb", type=int, default=0, help="legacy inline image_data size per document")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    app = load_flask_app(args.mongo_uri)
+    client = app.app.test_client()
+    results = {"page_size": args.page_size, "sizes": {}}
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        user_id = ObjectId()
+        image_ids = seed(app, user_id, size, args.inline_kb)
+        try:
+            page_samples, old_samples = [], []
+            for _ in range(args.repeats):
+                response, elapsed = timed(client.get, f"/api/starred/{user_id}?limit={args.page_size}")
+                page_samples.append(elapsed)
+                _, elapsed = timed(n_plus_one, app, user_id)
+                old_samples.append(elapsed)
+            results["sizes"][size] = {
+                "first_page": {**summarize(page_samples), "image_queries": 1,
+                               "response_bytes": len(response.data)},
+                "n_plus_one": {**summarize(old_samples), "image_queries": size}
+            }
+        finally:
+            app.starred_collection.delete_many({"user_id": user_id})
+            app.images_collection.delete_many({"_id": {"$in": image_ids}})
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
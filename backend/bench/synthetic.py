@@ -0,0 +1,43 @@
+"""
+Synthetic MRI-like brain slices for benchmarks and calibration when no
+real scans are at hand
+"""
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def synthetic_scan(seed, size=250):
+    """Return a (size, size, 3) uint8 image: a grey head on black with 1-3 bright lesions"""
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size), np.float32)
+    center = size // 2
+    
+    # Skull and brain tissue
+    cv2.ellipse(img, (center, center), (int(size * 0.40), int(size * 0.46)), 0, 0, 360, 0.7, -1)
+    cv2.ellipse(img, (center, center), (int(size * 0.36), int(size * 0.42)), 0, 0, 360, 0.4, -1)
+    
+    # Ventricles and lesions
+    cv2.ellipse(img, (center, center), (size // 14, size // 8), 0, 0, 360, 0.15, -1)
+    for _ in range(rng.integers(1, 4)):
+        x, y = rng.integers(int(size * 0.3), int(size * 0.7), 2)
+        radius = int(rng.integers(max(2, size // 30), max(3, size // 10)))
+        cv2.circle(img, (int(x), int(y)), radius, float(rng.uniform(0.75, 0.95)), -1)
+    
+    img += rng.normal(0, 0.04, img.shape).astype(np.float32)
+    img = np.clip(cv2.GaussianBlur(img, (5, 5), 0), 0, 1)
+    gray = np.uint8(img * 255)
+    return np.repeat(gray[..., None], 3, axis=2)
+
+
+def synthetic_scans(count, size=250, seed=0):
+    return [synthetic_scan(seed + i, size) for i in range(count)]
+
+
+def encode(pixels, fmt="PNG"):
+    """Encode a uint8 image as PNG/JPEG bytes, as a client would upload it"""
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=fmt)
+    return buffer.getvalue()
@@ -0,0 +1,10 @@
+"""
+Shared pytest set-up for the backend tests, run from backend/:
+
+    python -m pytest -q
+
+Gemini is always stubbed, so no test calls the real API.
+"""
+import os
+
+os.environ.setdefault("GEMINI_STUB", "yes")
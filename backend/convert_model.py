@@ -0,0 +1,110 @@
+"""
+Convert models/brain_tumor_model.h5 to TFLite for the "tflite" inference
+backend, check accuracy parity against the .h5 model and benchmark both on CPU.
+
+    python convert_model.py --quantization float16
+    python convert_model.py --quantization int8 --images path/to/scans --benchmark
+
+Serve the result with INFERENCE_BACKEND=tflite INFERENCE_QUANTIZATION=<mode>.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import ml_service
+from bench.synthetic import synthetic_scans
+
+
+def load_inputs(images_dir, count):
+    """Model-ready float32 inputs from a directory of scans, or synthetic slices"""
+    if images_dir:
+        names = sorted(
+            name for name in os.listdir(images_dir)
+            if name.lower().endswith(ml_service.IMAGE_EXTENSIONS)
+        )[:count]
+        arrays = []
+        for name in names:
+            with open(os.path.join(images_dir, name), "rb") as f:
+                arrays.append(ml_service.preprocess_image(f.read()).array)
+        return np.stack(arrays)
+    return np.stack([scan.astype(np.float32) / 255.0 for scan in synthetic_scans(count)])
+
+
+def convert(keras_model, quantization, calibration):
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        # Integer weights and activations; input and output stay float32
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([sample[None]] for sample in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def parity(reference, candidate, inputs):
+    expected = reference.predict(inputs)[:, 0]
+    actual = candidate.predict(inputs)[:, 0]
+    diff = np.abs(expected - actual)
+    agreement = np.mean((expected >= 0.5) == (actual >= 0.5))
+    print(f"  max |diff| {diff.max():.5f}  mean |diff| {diff.mean():.5f}  label agreement {agreement * 100:.2f}%")
+    return agreement
+
+
+def benchmark(backend, inputs, batch_size, repeats):
+    backend.predict(inputs[:batch_size])  # warm-up
+    
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        backend.predict(inputs[i % len(inputs)][None])
+        latencies.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    
+    batch = inputs[:batch_size]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        backend.predict(batch)
+    throughput = repeats * len(batch) / (time.perf_counter() - start)
+    print(f"  {backend.name:7s} single-image p50 {p50:.1f} ms  p95 {p95:.1f} ms  batch-{len(batch)} {throughput:.1f} img/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantization", choices=["none", "float16", "int8"], default="none")
+    parser.add_argument("--images", help="directory of scans for calibration and parity (default: synthetic)")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=ml_service.BATCH_MAX_SIZE)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.images, args.samples)
+    keras_backend = ml_service.KerasBackend(ml_service.MODEL_PATH)
+
+    output_path = ml_service.tflite_model_path(args.quantization)
+    print(f"Converting {ml_service.MODEL_PATH} -> {output_path} ({args.quantization})")
+    with open(output_path, "wb") as f:
+        f.write(convert(keras_backend.model, args.quantization, inputs))
+    tflite_backend = ml_service.TFLiteBackend(output_path, num_threads=ml_service.TFLITE_NUM_THREADS)
+    print(f"  size {os.path.getsize(ml_service.MODEL_PATH) / 1e6:.1f} MB -> {os.path.getsize(output_path) / 1e6:.1f} MB")
+
+    print(f"Parity on {len(inputs)} {'images' if args.images else 'synthetic images'}:")
+    agreement = parity(keras_backend, tflite_backend, inputs)
+
+    if args.benchmark:
+        print("CPU benchmark:")
+        benchmark(keras_backend, inputs, args.batch_size, args.repeats)
+        benchmark(tflite_backend, inputs, args.batch_size, args.repeats)
+
+    if agreement < args.min_agreement:
+        raise SystemExit(f"Label agreement {agreement * 100:.2f}% is below {args.min_agreement * 100:.2f}%")
+
+
+if __name__ == "__main__":
+    main()
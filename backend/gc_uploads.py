@@ -0,0 +1,36 @@
+"""
+Remove stored uploads that no image or starred item references any more,
+and temp files left by interrupted uploads, then report how much space
+content addressing saves. The Flask server processes run the same collection
+every UPLOAD_GC_INTERVAL seconds; run this by hand, or from cron instead
+(with UPLOAD_GC_INTERVAL=0), with the same environment:
+
+    python gc_uploads.py --dry-run
+    python gc_uploads.py --grace 86400
+
+Files saved before uploads were content-addressed are not tracked and are
+left alone.
+"""
+import argparse
+import json
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grace", type=float, default=None,
+                        help="only remove files unreferenced for this many seconds (default UPLOAD_GC_GRACE)")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed without removing it")
+    args = parser.parse_args()
+
+    report = {
+        "dry_run": args.dry_run,
+        "collected": app.collect_upload_garbage(grace=args.grace, dry_run=args.dry_run),
+        "storage": app.upload_storage_report()
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
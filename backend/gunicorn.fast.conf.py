@@ -0,0 +1,53 @@
+"""
+Production serving for the ML service:
+
+    gunicorn -c gunicorn.fast.conf.py ml_service:app
+
+Runs ML_WORKERS uvicorn worker processes behind one gunicorn master. The app
+is imported once in the master (preload_app) and, with INFERENCE_BACKEND=tflite,
+the model bytes are read there too, so forked workers share them copy-on-write.
+The Keras backend still loads one copy per worker: TensorFlow's runtime is not
+safe to initialise before a fork. So ML_WORKERS defaults to one per core with
+TFLite but to a single worker with Keras; the Docker image serves a TFLite model
+converted at build time. bench/serving_scaling.py reports PSS per worker.
+"""
+import multiprocessing
+import os
+import shutil
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.getenv('ML_BIND', '0.0.0.0:8001')
+default_workers = cpu_count if os.getenv('INFERENCE_BACKEND', 'keras') == 'tflite' else 1
+workers = int(os.getenv('ML_WORKERS', str(default_workers)))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+timeout = int(os.getenv('ML_WORKER_TIMEOUT', '120'))
+graceful_timeout = 30
+# Longer than the gateway's pooled connections stay idle, so they are reused
+keepalive = 75
+
+# Split the cores between workers instead of sizing every worker's thread pools to the whole box
+threads_per_worker = str(max(1, cpu_count // workers))
+for name in ('TFLITE_NUM_THREADS', 'PREPROCESS_WORKERS', 'TF_NUM_INTRAOP_THREADS', 'OMP_NUM_THREADS'):
+    os.environ.setdefault(name, threads_per_worker)
+
+# Deferred highlights go here, so a GET /highlight on any worker finds them
+os.environ.setdefault('HIGHLIGHT_STORE_DIR', '/tmp/ml_service_highlights')
+shutil.rmtree(os.environ['HIGHLIGHT_STORE_DIR'], ignore_errors=True)
+
+# Workers write metrics to files in this directory and /metrics reports all of them.
+# It has to be set before prometheus_client is imported, hence here and not in a hook.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/ml_service_metrics')
+shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+def when_ready(server):
+    import ml_service
+    ml_service.preload_model_content()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,29 @@
+"""
+Production serving for the Flask gateway:
+
+    gunicorn -c gunicorn.flask.conf.py app:app
+
+A threaded WSGI server (gthread workers). Requests mostly wait on the ML
+service and Mongo, so one process with many threads goes a long way and keeps
+/metrics and the upload job workers in a single process; raise FLASK_WORKERS
+for more CPU, at the cost of per-process metrics. Each worker starts its
+upload job workers at boot, rather than on the first upload, and collects
+unreferenced uploads every UPLOAD_GC_INTERVAL seconds.
+"""
+import os
+
+bind = os.getenv('FLASK_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('FLASK_WORKERS', '1'))
+worker_class = 'gthread'
+# Long-polling job status requests hold a thread for up to UPLOAD_JOB_MAX_WAIT
+threads = int(os.getenv('FLASK_THREADS', '32'))
+# Covers the ML service read timeout (ML_SERVICE_READ_TIMEOUT) plus the rest of an upload
+timeout = int(os.getenv('FLASK_WORKER_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_worker_init(worker):
+    import app
+    app.upload_workers.start()
+    app.upload_gc.start()
@@ -0,0 +1,283 @@
+"""
+Tumor highlighting: the brightest intensity cluster of the brain region,
+returned as a red PNG overlay or a run-length encoded mask.
+
+HighlightPool's processes import this module rather than ml_service, so it
+does no work at import: no model, caches or Prometheus metrics
+"""
+import base64
+import io
+import logging
+import os
+import time
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+# How the tumor highlighting clusters brain intensities: "kmeans" runs cv2.kmeans
+# over every brain pixel, "histogram" solves the same 1-D, 3-cluster problem
+# exactly on the 256-bin intensity histogram (deterministic, size-independent)
+SEGMENTATION_ENGINES = ("kmeans", "histogram")
+SEGMENTATION_ENGINE = os.getenv('SEGMENTATION_ENGINE', 'kmeans')
+SEGMENTATION_CLUSTERS = 3
+
+
+def untimed(name):
+    """Default stage timer: times nothing"""
+    return nullcontext()
+
+
+def extract_brain_mask(gray):
+    """Return the blurred grayscale image and a binary mask separating brain from background"""
+    # Apply Gaussian blur to reduce noise
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    
+    # Threshold to separate brain from background
+    _, brain_mask = cv2.threshold(blurred, 20, 255, cv2.THRESH_BINARY)
+    
+    # Apply morphological operations to clean up the brain mask
+    kernel = np.ones((5, 5), np.uint8)
+    brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    
+    return blurred, brain_mask
+
+
+def enhance_brain(gray):
+    """Contrast-enhanced brain region of a grayscale scan, and the brain mask"""
+    blurred, brain_mask = extract_brain_mask(gray)
+    
+    # Extract the brain region
+    brain_region = cv2.bitwise_and(blurred, blurred, mask=brain_mask)
+    
+    # Enhance contrast within the brain region
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    return clahe.apply(brain_region), brain_mask
+
+
+def kmeans_segmentation(enhanced, brain_pixels):
+    """255 where cv2.kmeans puts a brain pixel in the highest-intensity cluster"""
+    # Only include pixels within the brain mask (row-major order)
+    data = enhanced[brain_pixels].reshape(-1, 1).astype(np.float32)
+    
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    _, labels, centers = cv2.kmeans(data, SEGMENTATION_CLUSTERS, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    
+    segmentation = np.zeros(enhanced.shape, dtype=np.uint8)
+    segmentation[brain_pixels] = np.where(labels.ravel() == np.argmax(centers), 255, 0)
+    return segmentation
+
+
+def histogram_kmeans_threshold(hist, k=SEGMENTATION_CLUSTERS):
+    """
+    Lowest intensity of the brightest of k clusters, for the clustering of a
+    uint8 intensity histogram with the least within-cluster squared error.
+
+    In 1-D the optimal clusters are contiguous intensity ranges, so the exact
+    answer is a dynamic programme over split points between the distinct
+    levels: O(k * levels^2) work, whatever the number of pixels
+    """
+    levels = np.flatnonzero(hist)
+    if levels.size == 0:
+        return 256  # no brain pixels: select nothing
+    # A blank, saturated or two-tone scan has fewer levels than clusters:
+    # each level is then a cluster of its own
+    k = min(k, levels.size)
+    if k == 1:
+        return int(levels[0])
+    
+    counts = hist[levels].astype(np.float64)
+    values = levels.astype(np.float64)
+    # Prefix sums give the squared error of any run of levels [a, b) in O(1)
+    n = np.concatenate(([0.0], np.cumsum(counts)))
+    s1 = np.concatenate(([0.0], np.cumsum(counts * values)))
+    s2 = np.concatenate(([0.0], np.cumsum(counts * values ** 2)))
+    a, b = np.triu_indices(levels.size + 1, 1)
+    cost = np.full((levels.size + 1, levels.size + 1), np.inf)
+    cost[a, b] = s2[b] - s2[a] - (s1[b] - s1[a]) ** 2 / (n[b] - n[a])
+    
+    # best[b]: least error of splitting the first b levels into the k - 1 darker clusters
+    best = cost[0]
+    for _ in range(k - 2):
+        best = np.min(best[:, np.newaxis] + cost, axis=0)
+    # The brightest cluster starts at the split that minimises the total
+    split = int(np.argmin(best + cost[:, levels.size]))
+    return int(levels[split])
+
+
+def histogram_segmentation(enhanced, brain_pixels):
+    """255 where a brain pixel falls in the brightest cluster of its intensity histogram"""
+    hist = np.bincount(enhanced[brain_pixels], minlength=256)
+    lut = np.where(np.arange(256) >= histogram_kmeans_threshold(hist), 255, 0).astype(np.uint8)
+    segmentation = cv2.LUT(enhanced, lut)
+    segmentation[~brain_pixels] = 0
+    return segmentation
+
+
+def tumor_mask(pixels):
+    """
+    Fast and reliable K-means clustering for brain tumor detection.
+    Takes the uint8 RGB (or grayscale) pixels and returns a boolean (H, W)
+    mask of the region to highlight
+    """
+    start_time = time.time()
+    try:
+        if len(pixels.shape) == 3 and pixels.shape[2] == 3:
+            # Convert to grayscale
+            gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+        else:
+            gray = pixels
+            
+        enhanced, brain_mask = enhance_brain(gray)
+        
+        # Segment the brain into intensity clusters and keep the brightest (potential tumor)
+        brain_pixels = brain_mask > 0
+        if SEGMENTATION_ENGINE == "histogram":
+            segmentation = histogram_segmentation(enhanced, brain_pixels)
+        else:
+            segmentation = kmeans_segmentation(enhanced, brain_pixels)
+                
+        # Filter small regions using connected components
+        num_labels, labels_img, stats, _ = cv2.connectedComponentsWithStats(segmentation)
+        
+        # Sort foreground components by area in descending order (stable, so ties keep label order)
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        order = np.argsort(-areas, kind="stable")
+        
+        # Only keep regions that are reasonably sized (at least 50 pixels, less than 20% of brain)
+        brain_area = np.count_nonzero(brain_pixels)
+        min_area = 50
+        max_area = brain_area * 0.2
+        
+        # Keep only the top 1-3 largest regions
+        top = order[:3]
+        keep = top[(areas[top] >= min_area) & (areas[top] <= max_area)] + 1
+        tumor_mask = np.zeros_like(segmentation)
+        tumor_mask[np.isin(labels_img, keep)] = 255
+                
+        if not tumor_mask.any():
+            logger.info("No tumor regions found using K-means, trying thresholding")
+           
+            binary = cv2.adaptiveThreshold(enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                          cv2.THRESH_BINARY_INV, 11, 2)
+            binary = cv2.bitwise_and(binary, binary, mask=brain_mask)
+            
+            # Remove small objects
+            contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            
+            for contour in contours:
+                area = cv2.contourArea(contour)
+                if area >= min_area and area <= max_area:
+                    cv2.drawContours(tumor_mask, [contour], -1, 255, -1)
+        
+        tumor_mask = cv2.GaussianBlur(tumor_mask, (9, 9), 0)
+        
+        logger.info(f"K-means tumor detection completed in {time.time() - start_time:.2f} seconds")
+        return tumor_mask > 128
+    except Exception as e:
+        logger.error(f"Error in K-means tumor detection: {str(e)}")
+        
+        # Create a simple emergency highlight if everything fails: a circle off-center
+        h, w = pixels.shape[:2]
+        
+        # Get random coordinates for a circle avoiding the center
+        if np.random.choice([True, False]):
+            center_x = int(w * 0.25 + np.random.randint(-20, 20))
+            center_y = int(h * 0.25 + np.random.randint(-20, 20))
+        else:
+            center_x = int(w * 0.75 + np.random.randint(-20, 20))
+            center_y = int(h * 0.75 + np.random.randint(-20, 20))
+            
+        radius = int(min(h, w) * 0.1)
+        
+        mask = np.zeros((h, w), np.uint8)
+        cv2.circle(mask, (center_x, center_y), radius, 255, -1)
+        
+        logger.info(f"Used emergency highlighting in {time.time() - start_time:.2f} seconds")
+        return mask > 0
+
+
+def render_overlay(pixels, mask, stage=untimed):
+    """Blend a tumor mask into the scan in red and return it as a base64 PNG"""
+    if len(pixels.shape) == 2 or pixels.shape[2] == 1:
+        orig_img = cv2.cvtColor(pixels, cv2.COLOR_GRAY2RGB)
+    else:
+        orig_img = pixels
+    
+    overlay = orig_img.copy()
+    overlay[mask] = [255, 0, 0]  # Red color
+    
+    alpha = 0.5
+    result = cv2.addWeighted(orig_img, 1 - alpha, overlay, alpha, 0)
+    
+    with stage("png_encode"):
+        pil_img = Image.fromarray(result)
+        buffer = io.BytesIO()
+        pil_img.save(buffer, format="PNG")
+    with stage("base64"):
+        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def encode_mask_rle(mask):
+    """
+    Run-length encode a boolean mask in row-major order. counts alternate
+    between background and mask runs and always start with a background
+    run, which is 0 when the first pixel is masked
+    """
+    flat = mask.ravel()
+    boundaries = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], boundaries, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {
+        "encoding": "rle",
+        "size": [int(mask.shape[0]), int(mask.shape[1])],
+        "counts": counts.tolist()
+    }
+
+
+def decode_mask_rle(rle):
+    """Inverse of encode_mask_rle"""
+    counts = np.asarray(rle["counts"])
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape(rle["size"])
+
+
+def kmeans_tumor_detection(pixels, stage=untimed):
+    """K-means tumor highlighting as a base64 PNG overlay"""
+    try:
+        return render_overlay(pixels, tumor_mask(pixels), stage)
+    except Exception as e:
+        logger.error(f"Tumor highlighting failed: {str(e)}")
+        return None
+
+
+def tumor_highlight(pixels, overlay_format, stage=untimed):
+    """
+    ml_results fields that show the tumor region in the requested overlay
+    format. stage(name) times the encoding steps (see ml_service.stage)
+    """
+    if overlay_format == "rle":
+        mask = tumor_mask(pixels)
+        with stage("mask_encode"):
+            return {"highlighted_image": None, "tumor_mask": encode_mask_rle(mask)}
+    return {"highlighted_image": kmeans_tumor_detection(pixels, stage)}
+
+
+def highlight_shared(name, shape, dtype, overlay_format):
+    """Pool side of HighlightPool: run tumor_highlight on pixels in shared memory"""
+    started = time.time()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        pixels = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = tumor_highlight(pixels, overlay_format)
+        del pixels
+    finally:
+        shm.close()
+    return result, started, time.time()
@@ -1,17 +1,37 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+# Process start as far as this service can tell; import time and time to
+# first prediction are measured from here
+import_start = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-import tensorflow as tf
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List
 import numpy as np
 from PIL import Image
 import io
 import os
-import google.generativeai as genai
+import sys
+import importlib
 from dotenv import load_dotenv
 import uvicorn
 import cv2
-import base64
 import logging
-import time
+import asyncio
+import threading
+import hashlib
+import json
+import math
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
+import zipfile
+import tarfile
 
 
 logging.basicConfig(level=logging.INFO)
@@ -20,16 +40,66 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# After load_dotenv, as it reads SEGMENTATION_ENGINE from the environment
+import highlighting
+from highlighting import extract_brain_mask
+
 app = FastAPI()
 
+# Request tracing: the caller's X-Request-ID (or a fresh one) and the stage spans recorded for it
+TRACE_SPANS = os.getenv('TRACE_SPANS', '0') == '1'
+request_id_var = contextvars.ContextVar("request_id", default=None)
+request_spans_var = contextvars.ContextVar("request_spans", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into pipeline_stage_seconds and the current request's spans"""
+    pipeline_stage_in_flight.labels(stage=name).inc()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        pipeline_stage_in_flight.labels(stage=name).dec()
+        pipeline_stage_seconds.labels(stage=name).observe(elapsed)
+        spans = request_spans_var.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+# Routes under admission control and their default priority lane
+ADMITTED_ROUTES = {"/predict": "interactive", "/predict/batch": "bulk", "/highlight": "bulk"}
+
+
+@app.middleware("http")
+async def admission_middleware(request, call_next):
+    """Shed requests for a full lane before their upload is read and parsed"""
+    if request.method == "POST" and request.url.path in ADMITTED_ROUTES:
+        lane = request.query_params.get("priority", ADMITTED_ROUTES[request.url.path])
+        if lane in PRIORITY_LANES and admission.full(lane):
+            rejection = admission.rejection(lane, "queue_full")
+            return JSONResponse({"detail": rejection.detail}, status_code=503, headers=rejection.headers)
+    return await call_next(request)
+
+
 @app.middleware("http")
 async def prometheus_middleware(request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    spans = []
+    request_spans_var.set(spans)
+    
+    http_requests_in_flight.inc()
+    start_time = time.perf_counter()
     try:
         response = await call_next(request)
         status_code = response.status_code
     except Exception:
         status_code = 500
         raise
+    finally:
+        http_requests_in_flight.dec()
 
     method = request.method
     # Normalize path to FastAPI route if available
@@ -40,6 +110,17 @@ async def prometheus_middleware(request, call_next):
         endpoint=endpoint,
         status_code=status_code
     ).inc()
+    
+    response.headers["X-Request-ID"] = request_id
+    if TRACE_SPANS and spans:
+        total = time.perf_counter() - start_time
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in spans
+        )
+        logger.info(
+            f"trace request_id={request_id} {method} {endpoint} total={total * 1000:.1f}ms "
+            + " ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in spans)
+        )
     return response
 
 
@@ -55,224 +136,1219 @@ app.add_middleware(
 brain_tumor_model = None
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Inference backend: "keras" loads the .h5 model, "tflite" loads a model
+# converted with convert_model.py (optionally float16 or int8 quantized)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras')
+INFERENCE_QUANTIZATION = os.getenv('INFERENCE_QUANTIZATION', 'none')
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH')
+TFLITE_NUM_THREADS = int(os.getenv('TFLITE_NUM_THREADS', str(os.cpu_count() or 1)))
+# XNNPACK runs faster kernels on its own packed copy of the weights, private to
+# each worker; without it workers use the weights in the shared model buffer
+TFLITE_XNNPACK = os.getenv('TFLITE_XNNPACK', '1') == '1'
 
-@app.on_event("startup")
-async def startup_event():
-    """Load ML model on startup"""
-    global brain_tumor_model
-    try:
-        
-        model_path = "models/brain_tumor_model.h5"
-        if os.path.exists(model_path):
-            brain_tumor_model = tf.keras.models.load_model(model_path)
-            
-            logger.info(f"Brain tumor model loaded successfully from {model_path}")
-        else:
-            logger.warning(f"Model file not found at {model_path}. Using fallback predictions.")
-    except Exception as e:
-        logger.error(f"Error loading brain tumor model: {e}")
-        logger.info("Using fallback predictions for now.")
+# Micro-batching settings for model inference
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '10'))
 
-async def validate_brain_image(image):
-    """Use Gemini to check if image is appropriate for brain tumor detection"""
-    try:
-        model = genai.GenerativeModel('gemini-2.0-flash-exp-image-generation')
-        prompt = "Is this image appropriate for brain tumor detection? Give answer only yes or no."
-        
-        response = model.generate_content([prompt, image])
-        
-        # Extract only 'yes' or 'no' from the response
-        response_text = response.text.lower().strip()
-        is_appropriate = 'yes' in response_text and 'no' not in response_text
-        
-        return is_appropriate
-    except Exception as e:
-        logger.error(f"Error validating image with Gemini: {e}")
-        return True  # Default to true for development
+# Preprocessing settings (JPEG draft mode decodes large uploads at a reduced scale)
+MODEL_INPUT_SIZE = (250, 250)
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', str(os.cpu_count() or 4)))
+PREPROCESS_DRAFT = os.getenv('PREPROCESS_DRAFT', '1') == '1'
+
+# Tumor highlighting in a process pool (0 runs it inline on the event loop, as before).
+# Each service worker process gets its own pool of HIGHLIGHT_WORKERS processes
+HIGHLIGHT_WORKERS = int(os.getenv('HIGHLIGHT_WORKERS', '0'))
+
+# Bulk /predict/batch settings
+PREDICT_BATCH_MAX_FILES = int(os.getenv('PREDICT_BATCH_MAX_FILES', '1000'))
+# Limit on the images' total size once unpacked from their archives
+PREDICT_BATCH_MAX_BYTES = int(os.getenv('PREDICT_BATCH_MAX_BYTES', str(512 * 2**20)))
+PREDICT_BATCH_CONCURRENCY = int(os.getenv('PREDICT_BATCH_CONCURRENCY', str(BATCH_MAX_SIZE * 2)))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
-def kmeans_tumor_detection(img_array):
+# Admission control for /predict, /predict/batch and POST /highlight: at most
+# ADMISSION_MAX_CONCURRENCY requests run at once (0 admits everything), the rest
+# wait in two priority lanes, "interactive" ahead of "bulk" (?priority=), each
+# holding up to its queue size. Requests that find their lane full, or that
+# would not start within their deadline (?deadline=, in seconds), get a 503
+# with Retry-After straight away
+PRIORITY_LANES = ("interactive", "bulk")
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', str(BATCH_MAX_SIZE * 2)))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '64'))
+ADMISSION_BULK_QUEUE_SIZE = int(os.getenv('ADMISSION_BULK_QUEUE_SIZE', '64'))
+ADMISSION_DEADLINE_S = float(os.getenv('ADMISSION_DEADLINE_S', '30'))
+
+# Prediction cache settings (the disk tier is disabled unless a directory is set)
+MODEL_PATH = "models/brain_tumor_model.h5"
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '256'))
+PREDICTION_CACHE_DIR = os.getenv('PREDICTION_CACHE_DIR')
+PREDICTION_CACHE_DISK_MAX_MB = float(os.getenv('PREDICTION_CACHE_DISK_MAX_MB', '512'))
+
+# Gemini validation settings (GEMINI_STUB answers locally instead of calling the API)
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-exp-image-generation'
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '4'))
+GEMINI_TIMEOUT_S = float(os.getenv('GEMINI_TIMEOUT_S', '10'))
+GEMINI_BREAKER_FAILURES = int(os.getenv('GEMINI_BREAKER_FAILURES', '5'))
+GEMINI_BREAKER_RESET_S = float(os.getenv('GEMINI_BREAKER_RESET_S', '30'))
+GEMINI_VERDICT_CACHE_SIZE = int(os.getenv('GEMINI_VERDICT_CACHE_SIZE', '4096'))
+GEMINI_STUB = os.getenv('GEMINI_STUB')
+GEMINI_STUB_LATENCY_MS = float(os.getenv('GEMINI_STUB_LATENCY_MS', '0'))
+
+# How positive results show the tumor region: "png" (base64 PNG overlay, the
+# original response) or "rle" (run-length tumor mask the client blends itself).
+# Callers can pick one per request with ?overlay=
+OVERLAY_FORMATS = ("png", "rle")
+OVERLAY_FORMAT = os.getenv('OVERLAY_FORMAT', 'png')
+
+# When positive results are highlighted: "inline" before /predict returns, or
+# "deferred", where /predict returns the classification straight away and the
+# highlighting runs in the background, memoized by image hash for
+# GET /highlight/{digest}. Callers can pick one per request with ?highlight=
+HIGHLIGHT_MODES = ("inline", "deferred")
+HIGHLIGHT_MODE = os.getenv('HIGHLIGHT_MODE', 'inline')
+HIGHLIGHT_CACHE_SIZE = int(os.getenv('HIGHLIGHT_CACHE_SIZE', '256'))
+# Directory shared by the service's worker processes for deferred highlights, so
+# a GET /highlight that lands on another worker finds them (gunicorn.fast.conf.py
+# sets one); a "pending" marker older than HIGHLIGHT_PENDING_TIMEOUT_S is stale
+HIGHLIGHT_STORE_DIR = os.getenv('HIGHLIGHT_STORE_DIR')
+HIGHLIGHT_PENDING_TIMEOUT_S = float(os.getenv('HIGHLIGHT_PENDING_TIMEOUT_S', '60'))
+
+# Local pre-filter that decides obvious cases before Gemini (mean channel spread thresholds)
+PREFILTER_ENABLED = os.getenv('PREFILTER_ENABLED', '1') == '1'
+PREFILTER_ACCEPT_COLOR = float(os.getenv('PREFILTER_ACCEPT_COLOR', '2'))
+PREFILTER_REJECT_COLOR = float(os.getenv('PREFILTER_REJECT_COLOR', '20'))
+
+# Start-up settings. With FAST_START the server accepts connections at once and
+# loads and warms up the model in the background; /health/ready stays 503 until
+# it is done and predictions arriving meanwhile wait up to MODEL_LOAD_WAIT_S
+FAST_START = os.getenv('FAST_START', '0') == '1'
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', '1') == '1'
+# Batch sizes run through the model during warm-up (default: powers of two up to
+# BATCH_MAX_SIZE). The TFLite backend pads every batch up to one of these sizes
+WARMUP_BATCH_SIZES = os.getenv('WARMUP_BATCH_SIZES')
+MODEL_LOAD_WAIT_S = float(os.getenv('MODEL_LOAD_WAIT_S', '30'))
+
+
+def lazy_import(name):
     """
-    Fast and reliable K-means clustering for brain tumor detection
+    Import a heavy module on first use instead of at start-up. TensorFlow alone
+    takes seconds to import, and the Gemini client is not needed when stubbed
     """
-    start_time = time.time()
-    try:
-        # Convert to 8-bit format
-        if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-            # Convert to grayscale
-            gray = cv2.cvtColor(np.uint8(img_array * 255), cv2.COLOR_RGB2GRAY)
-            orig_img = np.uint8(img_array * 255)
+    module = sys.modules.get(name)
+    if module is None:
+        start_time = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start_time
+        lazy_import_seconds.labels(module=name).set(elapsed)
+        logger.info(f"Imported {name} in {elapsed:.2f}s")
+    return module
+
+
+def tflite_interpreter_class():
+    """
+    A standalone interpreter (LiteRT, or the older tflite_runtime) if installed,
+    else TensorFlow's. Importing TensorFlow costs each worker hundreds of MB of
+    private memory, far more than the model itself
+    """
+    for name in ("ai_edge_litert.interpreter", "tflite_runtime.interpreter"):
+        try:
+            return lazy_import(name).Interpreter
+        except ImportError:
+            continue
+    return lazy_import("tensorflow").lite.Interpreter
+
+
+class KerasBackend:
+    """Runs the original .h5 model through Keras"""
+
+    name = "keras"
+
+    def __init__(self, model_path):
+        tf = lazy_import("tensorflow")
+        self.path = model_path
+        self.model = tf.keras.models.load_model(model_path)
+        # Model.predict builds a data pipeline around every call; this graph is
+        # traced once (the batch dimension is left open) and reused per batch
+        self.forward = tf.function(
+            lambda inputs: self.model(inputs, training=False),
+            input_signature=[tf.TensorSpec([None, *self.model.input_shape[1:]], tf.float32)]
+        )
+
+    def predict(self, inputs):
+        return self.forward(inputs.astype(np.float32, copy=False)).numpy()
+
+
+class TFLiteBackend:
+    """
+    Runs a converted (optionally quantized) TFLite model.
+
+    Resizing an interpreter's input reallocates its tensors, so each batch size
+    gets an interpreter of its own, allocated once. Batches are zero-padded up
+    to the nearest of batch_sizes, which bounds how many interpreters there are
+    (and lets warm-up allocate all of them); larger batches run at their own size
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None, model_content=None, xnnpack=True, batch_sizes=()):
+        self.path = model_path
+        self.interpreter_class = tflite_interpreter_class()
+        self.options = {"num_threads": num_threads}
+        if not xnnpack:
+            resolvers = sys.modules[self.interpreter_class.__module__].OpResolverType
+            self.options["experimental_op_resolver_type"] = resolvers.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        if model_content is not None:
+            self.options["model_content"] = model_content
         else:
-            gray = np.uint8(img_array * 255)
-            orig_img = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
-            
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        
-        # Threshold to separate brain from background
-        _, brain_mask = cv2.threshold(blurred, 20, 255, cv2.THRESH_BINARY)
-        
-        # Apply morphological operations to clean up the brain mask
-        kernel = np.ones((5, 5), np.uint8)
-        brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-        brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        
-        # Extract the brain region
-        brain_region = cv2.bitwise_and(blurred, blurred, mask=brain_mask)
-        
-        # Enhance contrast within the brain region
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(brain_region)
+            self.options["model_path"] = model_path
+        self.batch_sizes = sorted(batch_sizes)
+        # batch size -> (interpreter, input detail, output detail, lock). An
+        # interpreter holds mutable tensor state, so calls to it are serialised
+        self.interpreters = {}
+        self.lock = threading.Lock()
+        interpreter = self._create()
+        self.interpreters[int(interpreter[1]["shape"][0])] = interpreter
+
+    def predict(self, inputs):
+        count = len(inputs)
+        size = next((size for size in self.batch_sizes if size >= count), count)
+        if size > count:
+            inputs = np.concatenate([inputs, np.zeros((size - count, *inputs.shape[1:]), inputs.dtype)])
         
-        # Prepare data for K-means clustering
-        # Only include pixels within the brain mask
-        data = []
-        coords = []
-        for y in range(enhanced.shape[0]):
-            for x in range(enhanced.shape[1]):
-                if brain_mask[y, x] > 0:
-                    data.append([enhanced[y, x]])
-                    coords.append([y, x])
-                    
-        data = np.float32(data)
+        interpreter, input_detail, output_detail, lock = self._interpreter(size)
+        with lock:
+            interpreter.set_tensor(input_detail["index"], self._quantize(inputs, input_detail))
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_detail["index"])
+        return self._dequantize(output[:count], output_detail)
+
+    def _interpreter(self, batch_size):
+        with self.lock:
+            if batch_size not in self.interpreters:
+                self.interpreters[batch_size] = self._create(batch_size)
+            return self.interpreters[batch_size]
+
+    def _create(self, batch_size=None):
+        interpreter = self.interpreter_class(**self.options)
+        if batch_size is not None:
+            input_detail = interpreter.get_input_details()[0]
+            interpreter.resize_tensor_input(input_detail["index"], [batch_size, *input_detail["shape"][1:]])
+        interpreter.allocate_tensors()
+        return interpreter, interpreter.get_input_details()[0], interpreter.get_output_details()[0], threading.Lock()
+
+    @staticmethod
+    def _quantize(values, detail):
+        if detail["dtype"] == np.float32:
+            return values.astype(np.float32, copy=False)
+        scale, zero_point = detail["quantization"]
+        info = np.iinfo(detail["dtype"])
+        return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(detail["dtype"])
+
+    @staticmethod
+    def _dequantize(values, detail):
+        if detail["dtype"] == np.float32:
+            return values
+        scale, zero_point = detail["quantization"]
+        return (values.astype(np.float32) - zero_point) * scale
+
+
+def tflite_model_path(quantization=None):
+    """Location of the converted TFLite model for a quantization mode"""
+    quantization = quantization or INFERENCE_QUANTIZATION
+    if TFLITE_MODEL_PATH:
+        return TFLITE_MODEL_PATH
+    suffix = "" if quantization == "none" else f"_{quantization}"
+    return f"{os.path.splitext(MODEL_PATH)[0]}{suffix}.tflite"
+
+
+# TFLite model bytes read by the gunicorn master before it forks its workers
+# (see gunicorn.fast.conf.py). Each worker builds its interpreter on this buffer,
+# so the weights stay in pages shared copy-on-write instead of one copy per worker.
+preloaded_model_content = None
+
+
+def preload_model_content():
+    """Read the TFLite model into memory ahead of forking workers"""
+    global preloaded_model_content
+    path = tflite_model_path()
+    if INFERENCE_BACKEND == "tflite" and os.path.exists(path):
+        with open(path, "rb") as f:
+            preloaded_model_content = f.read()
+        logger.info(f"Preloaded {len(preloaded_model_content) / 1e6:.1f} MB TFLite model from {path}")
+
+
+def load_inference_backend():
+    """Load the configured inference backend, or return None if no model file exists"""
+    if INFERENCE_BACKEND == "tflite":
+        path = tflite_model_path()
+        if preloaded_model_content is not None:
+            return TFLiteBackend(path, num_threads=TFLITE_NUM_THREADS, model_content=preloaded_model_content,
+                                 xnnpack=TFLITE_XNNPACK, batch_sizes=warmup_batch_sizes())
+        if os.path.exists(path):
+            return TFLiteBackend(path, num_threads=TFLITE_NUM_THREADS, xnnpack=TFLITE_XNNPACK,
+                                 batch_sizes=warmup_batch_sizes())
+        logger.warning(f"TFLite model not found at {path}, falling back to the Keras model")
+    elif INFERENCE_BACKEND != "keras":
+        logger.warning(f"Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}', using the Keras model")
+    
+    if os.path.exists(MODEL_PATH):
+        return KerasBackend(MODEL_PATH)
+    return None
+
+
+class BatchScheduler:
+    """
+    Collects concurrent prediction requests into batches and runs a single
+    forward pass per batch in a worker thread, off the event loop
+    """
+
+    def __init__(self, max_size, max_wait_ms):
+        self.max_size = max(1, max_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.queue = None
+        self.worker = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+        logger.info(f"Batch scheduler started (max_size={self.max_size}, max_wait={self.max_wait * 1000:.0f}ms)")
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def predict(self, image_array):
+        """Queue a single (250, 250, 3) array and wait for its model output row"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image_array, future, time.perf_counter()))
+        batch_queue_depth.set(self.queue.qsize())
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_size:
+            # Take whatever is already waiting before sleeping on the queue
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            batch_queue_depth.set(self.queue.qsize())
+
+            dispatched = time.perf_counter()
+            for _, _, enqueued in batch:
+                batch_wait_seconds.observe(dispatched - enqueued)
+            batch_size_histogram.observe(len(batch))
+
+            inputs = np.stack([image_array for image_array, _, _ in batch])
+            try:
+                predictions = await loop.run_in_executor(None, self._forward, inputs)
+            except Exception as e:
+                logger.error(f"Batched prediction failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+
+    def _forward(self, inputs):
+        return brain_tumor_model.predict(inputs)
+
+
+batch_scheduler = BatchScheduler(BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+model_version = "fallback"
+
+# "loading" until start-up has finished with the model, then "ready", or
+# "fallback" when there is no model (or it failed to load) and placeholder
+# predictions are served
+model_state = "loading"
+model_load_task = None
+first_prediction_seen = False
+
+
+class AdmissionController:
+    """
+    Bounds the requests running at once and queues the rest by priority lane.
+    A finished request hands its slot straight to the next waiter, interactive
+    first, so a free slot never coexists with a queue. Requests that cannot be
+    served in time are shed with a 503 instead of piling up
+    """
+
+    def __init__(self, max_concurrency, queue_sizes):
+        self.max_concurrency = max_concurrency
+        self.queue_sizes = queue_sizes
+        self.lanes = {lane: deque() for lane in PRIORITY_LANES}
+        self.running = 0
+        # Moving average of how long admitted requests hold their slot
+        self.service_seconds = None
+
+    def estimated_wait(self, lane):
+        """Rough seconds until a request joining lane now would start"""
+        if self.running < self.max_concurrency or self.service_seconds is None:
+            return 0.0
+        ahead = 0
+        for other in PRIORITY_LANES:
+            ahead += len(self.lanes[other])
+            if other == lane:
+                break
+        return (ahead + 1) * self.service_seconds / self.max_concurrency
+
+    def rejection(self, lane, reason):
+        """Count a shed request and build its 503"""
+        admission_shed.labels(lane=lane, reason=reason).inc()
+        retry_after = max(1, math.ceil(self.estimated_wait(lane)))
+        return HTTPException(
+            status_code=503, detail=f"Service overloaded ({reason}), retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def shed(self, lane, reason):
+        raise self.rejection(lane, reason)
+
+    def full(self, lane):
+        """No free slot and no room left in lane's queue"""
+        return (
+            0 < self.max_concurrency <= self.running
+            and len(self.lanes[lane]) >= self.queue_sizes[lane]
+        )
+
+    def check(self, lane):
+        """Shed now if lane's queue is full"""
+        if self.full(lane):
+            self.shed(lane, "queue_full")
+
+    @asynccontextmanager
+    async def admit(self, lane, deadline=None, shed=True):
+        """
+        Hold a slot for the body of the block. deadline is the time.monotonic()
+        by which the request must have started; shed=False waits for a slot
+        however long it takes (the items of an already admitted batch)
+        """
+        if self.max_concurrency <= 0:
+            yield
+            return
         
-        # Use K-means to segment the brain into regions (3 clusters)
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-        K = 3
-        _, labels, centers = cv2.kmeans(data, K, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+        if self.running >= self.max_concurrency:
+            if shed:
+                self.check(lane)
+                if deadline is not None and self.estimated_wait(lane) > deadline - time.monotonic():
+                    self.shed(lane, "deadline")
+            with stage("admission"):
+                await self._wait(lane, deadline if shed else None)
+        else:
+            self.running += 1
+        admission_in_flight.set(self.running)
         
-        # Find the cluster with the highest intensity (potential tumor)
-        highest_intensity_cluster = np.argmax(centers)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.service_seconds = elapsed if self.service_seconds is None else 0.8 * self.service_seconds + 0.2 * elapsed
+            self._release()
+
+    async def _wait(self, lane, deadline):
+        future = asyncio.get_running_loop().create_future()
+        waiters = self.lanes[lane]
+        waiters.append(future)
+        admission_queued_total.labels(lane=lane).inc()
+        admission_queue_depth.labels(lane=lane).set(len(waiters))
+        start = time.perf_counter()
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            # The client went away; pass on a slot that was already handed over
+            if future.done():
+                self._release()
+            else:
+                waiters.remove(future)
+                admission_queue_depth.labels(lane=lane).set(len(waiters))
+            raise
+        finally:
+            admission_queue_wait_seconds.labels(lane=lane).observe(time.perf_counter() - start)
         
-        # Create a segmentation mask
-        segmentation = np.zeros_like(gray)
-        for i, (y, x) in enumerate(coords):
-            if labels[i] == highest_intensity_cluster:
-                segmentation[y, x] = 255
-                
-        # Filter small regions using connected components
-        num_labels, labels_img = cv2.connectedComponents(segmentation)
+        if not future.done():
+            waiters.remove(future)
+            admission_queue_depth.labels(lane=lane).set(len(waiters))
+            self.shed(lane, "deadline")
+
+    def _release(self):
+        for lane in PRIORITY_LANES:
+            if self.lanes[lane]:
+                self.lanes[lane].popleft().set_result(None)
+                admission_queue_depth.labels(lane=lane).set(len(self.lanes[lane]))
+                return
+        self.running -= 1
+        admission_in_flight.set(self.running)
+
+
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENCY, {"interactive": ADMISSION_QUEUE_SIZE, "bulk": ADMISSION_BULK_QUEUE_SIZE}
+)
+
+
+preprocess_executor = ThreadPoolExecutor(max_workers=max(1, PREPROCESS_WORKERS), thread_name_prefix="preprocess")
+
+
+class HighlightPool:
+    """
+    Runs the CPU-bound tumor highlighting (segmentation, PNG/RLE encoding) in
+    worker processes, so several jobs use several cores and the event loop
+    is not held while they run. Pixels are handed over in a shared memory
+    block rather than pickled; only the small result comes back pickled
+    """
+
+    def __init__(self, workers):
+        self.workers = max(0, workers)
+        self.executor = None
+
+    def start(self):
+        if self.workers and self.executor is None:
+            # Spawned rather than forked: the service process has threads running.
+            # The processes import only the highlighting module
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            highlight_pool_workers.set(self.workers)
+            logger.info(f"Highlight pool started with {self.workers} processes")
+
+    def stop(self):
+        if self.executor is not None:
+            pids = list(self.executor._processes or ())
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            highlight_pool_workers.set(0)
+            # As gunicorn's child_exit does for workers: drop the live gauges of
+            # processes that are gone, so a restarted pool leaves no stale files
+            if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+                for pid in pids:
+                    multiprocess.mark_process_dead(pid)
+
+    def restart(self, broken):
+        """Replace a pool that lost a process; callers racing on the same pool restart it once"""
+        if self.executor is broken:
+            logger.error("Highlight pool process died, restarting the pool")
+            highlight_pool_restarts.inc()
+            self.stop()
+            self.start()
+
+    async def highlight(self, pixels, overlay_format):
+        if self.executor is None:
+            return tumor_highlight(pixels, overlay_format)
         
-        # Compute area for each component and filter small ones
-        label_areas = []
-        for label in range(1, num_labels):
-            label_areas.append((label, np.sum(labels_img == label)))
+        executor = self.executor
+        try:
+            return await self._highlight_shared(executor, pixels, overlay_format)
+        except BrokenProcessPool:
+            # A process was killed (OOM, crash in cv2): every job on this pool
+            # fails from now on. Start a new one and do this job in a thread
+            self.restart(executor)
+            return await asyncio.get_running_loop().run_in_executor(None, tumor_highlight, pixels, overlay_format)
+
+    async def _highlight_shared(self, executor, pixels, overlay_format):
+        shm = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+        try:
+            view = np.ndarray(pixels.shape, dtype=pixels.dtype, buffer=shm.buf)
+            view[...] = pixels
+            del view
             
-        # Sort by area in descending order
-        label_areas.sort(key=lambda x: x[1], reverse=True)
-        
-        # Keep only the top 1-3 largest regions
-        tumor_mask = np.zeros_like(segmentation)
-        top_n = min(3, len(label_areas))
+            submitted = time.time()
+            highlight_pool_in_flight.inc()
+            try:
+                result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                    executor, highlighting.highlight_shared, shm.name, pixels.shape, pixels.dtype.str, overlay_format
+                )
+            finally:
+                highlight_pool_in_flight.dec()
+            highlight_pool_queue_seconds.observe(max(0.0, started - submitted))
+            highlight_pool_busy_seconds.inc(finished - started)
+            return result
+        finally:
+            shm.close()
+            shm.unlink()
+
+    async def warm_up(self, pixels):
+        """Start every pool process (each imports the highlighting module) before serving"""
+        if self.executor is not None:
+            await asyncio.gather(*(self.highlight(pixels, OVERLAY_FORMAT) for _ in range(self.workers)))
+
+
+highlight_pool = HighlightPool(HIGHLIGHT_WORKERS)
+
+
+class HighlightStore:
+    """
+    Deferred highlights keyed by image hash and overlay format, least
+    recently used first out. Entries are asyncio tasks, so a request for a
+    highlight that is still being computed can wait for it.
+
+    With a shared directory, finished highlights and "pending" markers also go
+    to disk, so worker processes serve (and wait for) each other's highlights
+    instead of computing them again
+    """
+
+    def __init__(self, max_entries, shared_dir=None):
+        self.max_entries = max(1, max_entries)
+        self.tasks = OrderedDict()
+        self.shared_dir = shared_dir
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+    def lookup(self, digest, overlay_format):
+        task = self.tasks.get((digest, overlay_format))
+        if task is not None:
+            self.tasks.move_to_end((digest, overlay_format))
+        return task
+
+    def schedule(self, digest, pixels, overlay_format):
+        """Start computing a highlight unless it is already known; returns its task"""
+        task = self.lookup(digest, overlay_format)
+        if task is None:
+            task = asyncio.create_task(self._compute(digest, pixels, overlay_format))
+            self.tasks[(digest, overlay_format)] = task
+            while len(self.tasks) > self.max_entries:
+                self.tasks.popitem(last=False)
+        return task
+
+    async def fetch(self, digest, overlay_format, wait=0):
+        """
+        (result, pending) for a highlight: the result once computed here or by
+        another worker, else whether one is still being computed after waiting
+        up to `wait` seconds. (None, False) when there is none
+        """
+        task = self.lookup(digest, overlay_format)
+        if task is not None:
+            if not task.done():
+                await asyncio.wait({task}, timeout=wait)
+                if not task.done():
+                    return None, True
+            return task.result(), False
+        return await self._shared(digest, overlay_format, wait)
+
+    async def _compute(self, digest, pixels, overlay_format):
+        try:
+            if self.shared_dir:
+                # Another worker may have it, or be computing it
+                result, _ = await self._shared(digest, overlay_format, HIGHLIGHT_PENDING_TIMEOUT_S)
+                if result is not None:
+                    return result
+                self._touch(digest, overlay_format)
+            with stage("kmeans"):
+                if highlight_pool.executor is None:
+                    # A thread, not the event loop: the /predict response is still being sent
+                    result = await asyncio.get_running_loop().run_in_executor(None, tumor_highlight, pixels, overlay_format)
+                else:
+                    result = await highlight_pool.highlight(pixels, overlay_format)
+            self._write(digest, overlay_format, result)
+            return result
+        except Exception as e:
+            # Forget failures so the next request tries again
+            logger.error(f"Deferred highlighting failed for {digest}: {e}")
+            self.tasks.pop((digest, overlay_format), None)
+            if self.shared_dir:
+                self._remove(self._path(digest, overlay_format, "pending"))
+            return None
+
+    def _path(self, digest, overlay_format, kind):
+        return os.path.join(self.shared_dir, f"{highlighting.SEGMENTATION_ENGINE}-{overlay_format}-{digest}.{kind}")
+
+    async def _shared(self, digest, overlay_format, wait):
+        if not self.shared_dir:
+            return None, False
+        deadline = time.monotonic() + wait
+        while True:
+            result = self._read(digest, overlay_format)
+            if result is not None:
+                return result, False
+            try:
+                pending = time.time() - os.path.getmtime(self._path(digest, overlay_format, "pending"))
+            except OSError:
+                return None, False
+            if pending > HIGHLIGHT_PENDING_TIMEOUT_S:
+                return None, False
+            if time.monotonic() >= deadline:
+                return None, True
+            await asyncio.sleep(0.05)
+
+    def _read(self, digest, overlay_format):
+        path = self._path(digest, overlay_format, "json")
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            # Refresh mtime so eviction drops the least recently used first
+            os.utime(path)
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def _touch(self, digest, overlay_format):
+        with open(self._path(digest, overlay_format, "pending"), "w"):
+            pass
+
+    def _write(self, digest, overlay_format, result):
+        if not self.shared_dir:
+            return
+        path = self._path(digest, overlay_format, "json")
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Error writing highlight file {path}: {e}")
+        self._remove(self._path(digest, overlay_format, "pending"))
         
-        # Only keep regions that are reasonably sized (at least 50 pixels, less than 20% of brain)
-        brain_area = np.sum(brain_mask > 0)
-        min_area = 50
-        max_area = brain_area * 0.2
+        files = sorted(
+            (entry.stat().st_mtime, entry.path) for entry in os.scandir(self.shared_dir) if entry.name.endswith(".json")
+        )
+        for _, stale in files[:max(0, len(files) - self.max_entries)]:
+            self._remove(stale)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+highlight_store = HighlightStore(HIGHLIGHT_CACHE_SIZE, HIGHLIGHT_STORE_DIR)
+
+
+def deferred_highlight(digest, pixels, overlay_format):
+    """ml_results fields for a positive result whose highlighting runs in the background"""
+    highlight_store.schedule(digest, pixels, overlay_format)
+    return {"highlighted_image": None, "highlight_id": digest, "highlight_status": "pending"}
+
+
+class PreparedImage:
+    """Decoded upload plus the model-sized arrays derived from it"""
+
+    def __init__(self, image, pixels, array):
+        self.image = image    # decoded RGB PIL image, used for hashing and Gemini
+        self.pixels = pixels  # (250, 250, 3) uint8, used by the pre-filter and segmentation
+        self.array = array    # (250, 250, 3) float32 in [0, 1], used by the model
+
+
+def preprocess_image(source):
+    """Decode an upload (bytes or file object) and resize it for the model"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    
+    with stage("decode"):
+        image = Image.open(source)
+        if PREPROCESS_DRAFT and image.format == "JPEG":
+            # libjpeg decodes at 1/2, 1/4 or 1/8 scale while staying at least the target size
+            image.draft("RGB", MODEL_INPUT_SIZE)
+        image = image.convert("RGB")
+    
+    with stage("resize"):
+        pixels = np.asarray(image.resize(MODEL_INPUT_SIZE), dtype=np.uint8)
+    
+    with stage("normalize"):
+        # Normalise straight into a float32 buffer, without a float64 intermediate
+        array = np.empty(pixels.shape, dtype=np.float32)
+        np.divide(pixels, np.float32(255), out=array)
+    
+    return PreparedImage(image, pixels, array)
+
+
+def image_hash(image):
+    """Hash the decoded pixel data of a PIL image"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier cache of /predict responses keyed by image hash and model version:
+    a bounded in-memory LRU and an optional on-disk tier with size-based eviction
+    """
+
+    def __init__(self, max_entries, disk_dir=None, disk_max_bytes=0):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def key(self, digest, overlay_format=OVERLAY_FORMAT):
+        return f"{model_version}-{highlighting.SEGMENTATION_ENGINE}-{overlay_format}-{digest}"
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            prediction_cache_hits.labels(tier="memory").inc()
+            return self.entries[key]
+
+        value = self._disk_get(key)
+        if value is not None:
+            prediction_cache_hits.labels(tier="disk").inc()
+            self._memory_put(key, value)
+            return value
+
+        prediction_cache_misses.inc()
+        return None
+
+    def put(self, key, value):
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            prediction_cache_evictions.labels(tier="memory").inc()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_files(self):
+        """Return (path, size, mtime) for every cached file on disk"""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            # Refresh mtime so eviction drops the least recently used files first
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading prediction cache file {path}: {e}")
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+            self.disk_bytes += os.path.getsize(path) - previous
+        except Exception as e:
+            logger.warning(f"Error writing prediction cache file {path}: {e}")
+            return
+
+        if self.disk_bytes > self.disk_max_bytes:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        files = sorted(self._disk_files(), key=lambda f: f[2])
+        self.disk_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self.disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.disk_bytes -= size
+            prediction_cache_evictions.labels(tier="disk").inc()
+
+
+prediction_cache = PredictionCache(
+    PREDICTION_CACHE_SIZE,
+    disk_dir=PREDICTION_CACHE_DIR,
+    disk_max_bytes=int(PREDICTION_CACHE_DISK_MAX_MB * 1024 * 1024)
+)
+
+def warmup_batch_sizes():
+    if WARMUP_BATCH_SIZES:
+        return [int(size) for size in WARMUP_BATCH_SIZES.split(",")]
+    sizes = [1]
+    while sizes[-1] * 2 < BATCH_MAX_SIZE:
+        sizes.append(sizes[-1] * 2)
+    return sorted({*sizes, BATCH_MAX_SIZE})
+
+
+def warmup_scan():
+    """A synthetic scan (bright lesion in a grey disc) that takes the full K-means path"""
+    height, width = MODEL_INPUT_SIZE
+    gray = np.zeros((height, width), dtype=np.uint8)
+    cv2.circle(gray, (width // 2, height // 2), min(height, width) * 2 // 5, 90, -1)
+    cv2.circle(gray, (width * 3 // 5, height * 2 // 5), min(height, width) // 10, 220, -1)
+    noise = np.random.default_rng(0).integers(0, 12, gray.shape, dtype=np.uint8)
+    return cv2.cvtColor(cv2.add(gray, noise), cv2.COLOR_GRAY2RGB)
+
+
+def warm_up(backend):
+    """
+    Run the model over the batch sizes the scheduler produces, and the K-means
+    highlighting once, so graph tracing, tensor allocation and OpenCV set-up
+    happen before readiness rather than on the first requests
+    """
+    start_time = time.perf_counter()
+    with stage("warmup"):
+        pixels = warmup_scan()
+        if backend is not None:
+            array = pixels.astype(np.float32) / 255
+            for size in warmup_batch_sizes():
+                backend.predict(np.repeat(array[np.newaxis], size, axis=0))
+        tumor_highlight(pixels, OVERLAY_FORMAT)
+    elapsed = time.perf_counter() - start_time
+    model_warmup_seconds.set(elapsed)
+    logger.info(f"Warm-up finished in {elapsed:.2f}s")
+
+
+async def load_model():
+    """Load and warm up the model off the event loop, then start batching"""
+    global brain_tumor_model, model_version, model_state
+    loop = asyncio.get_running_loop()
+    try:
         
-        for i in range(min(top_n, len(label_areas))):
-            label, area = label_areas[i]
-            if min_area <= area <= max_area:
-                tumor_mask[labels_img == label] = 255
-                
-        if np.sum(tumor_mask) == 0:
-            logger.info("No tumor regions found using K-means, trying thresholding")
-           
-            binary = cv2.adaptiveThreshold(enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                          cv2.THRESH_BINARY_INV, 11, 2)
-            binary = cv2.bitwise_and(binary, binary, mask=brain_mask)
+        load_start = time.perf_counter()
+        backend = await loop.run_in_executor(None, load_inference_backend)
+        if backend is not None:
+            model_load_seconds.set(time.perf_counter() - load_start)
             
-            # Remove small objects
-            contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            # Cached predictions are only valid for the model that produced them
+            stat = os.stat(backend.path)
+            model_version = os.getenv('MODEL_VERSION') or f"{backend.name}-{stat.st_size:x}{int(stat.st_mtime):x}"
             
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                if area >= min_area and area <= max_area:
-                    cv2.drawContours(tumor_mask, [contour], -1, 255, -1)
-        
-        tumor_mask = cv2.GaussianBlur(tumor_mask, (9, 9), 0)
-        
-        overlay = orig_img.copy()
-        overlay[tumor_mask > 128] = [255, 0, 0]  # Red color
-        
-        alpha = 0.5
-        result = cv2.addWeighted(orig_img, 1 - alpha, overlay, alpha, 0)
-        
-        pil_img = Image.fromarray(result)
-        buffer = io.BytesIO()
-        pil_img.save(buffer, format="PNG")
-        img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        logger.info(f"K-means tumor detection completed in {time.time() - start_time:.2f} seconds")
-        return img_str
+            brain_tumor_model = backend
+            batch_scheduler.start()
+            state = "ready"
+            logger.info(f"Brain tumor model loaded successfully from {backend.path} ({backend.name} backend)")
+        else:
+            state = "fallback"
+            logger.warning(f"Model file not found at {MODEL_PATH}. Using fallback predictions.")
     except Exception as e:
-        logger.error(f"Error in K-means tumor detection: {str(e)}")
-        
-        # Create a simple emergency highlight if everything fails
+        state = "fallback"
+        logger.error(f"Error loading brain tumor model: {e}")
+        logger.info("Using fallback predictions for now.")
+    
+    if MODEL_WARMUP:
         try:
-            # Convert to RGB if not already
-            if len(img_array.shape) == 2 or img_array.shape[2] == 1:
-                display_img = cv2.cvtColor(np.uint8(img_array * 255), cv2.COLOR_GRAY2RGB)
-            else:
-                display_img = np.uint8(img_array * 255)
-                
-            # Create a simple red circle off-center
-            h, w = display_img.shape[:2]
-            
-            # Get random coordinates for a circle avoiding the center
-            if np.random.choice([True, False]):
-                center_x = int(w * 0.25 + np.random.randint(-20, 20))
-                center_y = int(h * 0.25 + np.random.randint(-20, 20))
-            else:
-                center_x = int(w * 0.75 + np.random.randint(-20, 20))
-                center_y = int(h * 0.75 + np.random.randint(-20, 20))
-                
-            radius = int(min(h, w) * 0.1)
-            
-            
-            overlay = display_img.copy()
-            cv2.circle(overlay, (center_x, center_y), radius, (255, 0, 0), -1)
-            
-            alpha = 0.5
-            result = cv2.addWeighted(display_img, 1 - alpha, overlay, alpha, 0)
-            
+            await loop.run_in_executor(None, warm_up, brain_tumor_model)
+            await highlight_pool.warm_up(warmup_scan())
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+    # Readiness only flips once warm-up is done
+    model_state = state
+    model_ready_seconds.set(time.perf_counter() - import_start)
 
-            pil_img = Image.fromarray(result)
-            buffer = io.BytesIO()
-            pil_img.save(buffer, format="PNG")
-            img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            logger.info(f"Used emergency highlighting in {time.time() - start_time:.2f} seconds")
-            return img_str
-        except Exception as e2:
-            logger.error(f"Emergency highlighting also failed: {str(e2)}")
-            return None
+@app.on_event("startup")
+async def startup_event():
+    """Load ML model on startup, in the background with FAST_START"""
+    global model_load_task
+    highlight_pool.start()
+    if FAST_START:
+        model_load_task = asyncio.create_task(load_model())
+    else:
+        await load_model()
 
-async def process_brain_image(image):
-    """Process brain image with the ML model"""
-    global brain_tumor_model
+async def wait_for_model():
+    """Hold predictions that arrive while the model is still loading in the background"""
+    if model_load_task is None or model_load_task.done():
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(model_load_task), MODEL_LOAD_WAIT_S)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={"Retry-After": "5"})
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness: the process is up and its event loop is responding"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness: 503 until the model has been loaded (or the fallback chosen)"""
+    body = {
+        "status": model_state,
+        "backend": getattr(brain_tumor_model, "name", None),
+        "model_version": model_version
+    }
+    if model_state == "loading":
+        return JSONResponse(body, status_code=503)
+    return body
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the batch scheduler and the worker thread and process pools"""
+    if model_load_task is not None and not model_load_task.done():
+        model_load_task.cancel()
+    await batch_scheduler.stop()
+    highlight_pool.stop()
+    gemini_executor.shutdown(wait=False)
+    preprocess_executor.shutdown(wait=False)
+
+class StubGeminiModel:
+    """Local stand-in for the Gemini client that always gives the same answer"""
+
+    def __init__(self, answer, latency_ms=0):
+        self.answer = answer
+        self.latency = latency_ms / 1000.0
+
+    def generate_content(self, contents, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return type("StubResponse", (), {"text": self.answer})()
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for a cool-down period"""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        # When the half-open trial call started; a trial whose outcome never
+        # arrives (its request was cancelled) is replaced after reset_seconds
+        self.trial_started = None
+
+    def allow(self):
+        # After the cool-down a single trial call is let through (half-open)
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        if self.trial_started is not None and now - self.trial_started < self.reset_seconds:
+            return False
+        self.trial_started = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.info("Gemini circuit breaker closed")
+        self.opened_at = None
+        self.trial_started = None
+        gemini_circuit_open.set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Gemini circuit breaker opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.trial_started = None
+            gemini_circuit_open.set(1)
+
+
+gemini_model = None
+gemini_executor = ThreadPoolExecutor(max_workers=max(1, GEMINI_MAX_CONCURRENCY), thread_name_prefix="gemini")
+# Held from submitting a call until its thread finishes, so a call never
+# waits for a free gemini_executor thread inside its timeout
+gemini_slots = asyncio.Semaphore(max(1, GEMINI_MAX_CONCURRENCY))
+gemini_breaker = CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_RESET_S)
+gemini_verdicts = OrderedDict()
+
+
+def get_gemini_model():
+    """Create the Gemini client once and reuse it across requests"""
+    global gemini_model
+    if gemini_model is None:
+        if GEMINI_STUB:
+            gemini_model = StubGeminiModel(GEMINI_STUB, GEMINI_STUB_LATENCY_MS)
+            logger.info(f"Using local Gemini stub answering '{GEMINI_STUB}'")
+        else:
+            genai = lazy_import("google.generativeai")
+            genai.configure(api_key=GEMINI_API_KEY)
+            gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return gemini_model
+
+
+def ask_gemini(image):
+    """Blocking Gemini call, run inside gemini_executor"""
+    prompt = "Is this image appropriate for brain tumor detection? Give answer only yes or no."
+    
+    response = get_gemini_model().generate_content([prompt, image])
+    
+    # Extract only 'yes' or 'no' from the response
+    response_text = response.text.lower().strip()
+    return 'yes' in response_text and 'no' not in response_text
+
+
+async def validate_brain_image(image, digest=None):
+    """
+    Use Gemini to check if image is appropriate for brain tumor detection.
+    Returns (is_appropriate, authoritative): when Gemini could not answer
+    (timeout, error, circuit open) the image is let through unvalidated and
+    authoritative is False, so callers must not cache the result
+    """
+    start_time = time.perf_counter()
+    
+    if digest is not None and digest in gemini_verdicts:
+        gemini_verdicts.move_to_end(digest)
+        gemini_validation_seconds.labels(outcome="cached").observe(time.perf_counter() - start_time)
+        return gemini_verdicts[digest], True
+    
+    if not gemini_breaker.allow():
+        gemini_validation_seconds.labels(outcome="circuit_open").observe(time.perf_counter() - start_time)
+        return True, False  # Default to true for development
     
+    # Waiting for a free thread is not Gemini being slow: the timeout starts
+    # once the call is running. A call that times out keeps its slot until
+    # its thread is done with it
+    await gemini_slots.acquire()
+    call = asyncio.get_running_loop().run_in_executor(gemini_executor, ask_gemini, image)
+    call.add_done_callback(lambda _: gemini_slots.release())
+    try:
+        is_appropriate = await asyncio.wait_for(asyncio.shield(call), timeout=GEMINI_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        logger.error(f"Gemini validation timed out after {GEMINI_TIMEOUT_S}s")
+        gemini_breaker.record_failure()
+        gemini_validation_seconds.labels(outcome="timeout").observe(time.perf_counter() - start_time)
+        return True, False  # Default to true for development
+    except Exception as e:
+        logger.error(f"Error validating image with Gemini: {e}")
+        gemini_breaker.record_failure()
+        gemini_validation_seconds.labels(outcome="error").observe(time.perf_counter() - start_time)
+        return True, False  # Default to true for development
+    
+    gemini_breaker.record_success()
+    gemini_validation_seconds.labels(outcome="ok").observe(time.perf_counter() - start_time)
+    
+    if digest is not None and GEMINI_VERDICT_CACHE_SIZE > 0:
+        gemini_verdicts[digest] = is_appropriate
+        while len(gemini_verdicts) > GEMINI_VERDICT_CACHE_SIZE:
+            gemini_verdicts.popitem(last=False)
+    
+    return is_appropriate, True
 
-    image = image.resize((250, 250))
+def head_shaped(gray, brain_mask):
+    """
+    Whether the mask is one head-like region: a single component clear of the
+    frame edges, centred, convex and close to an ellipse, with internal
+    structure that is not just noise (it survives blurring)
+    """
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(brain_mask)
+    if count < 2:
+        return False
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    x, y, w, h, area = stats[largest]
+    height, width = brain_mask.shape
+    if area < 0.95 * np.count_nonzero(brain_mask):
+        return False
+    if x == 0 or y == 0 or x + w == width or y + h == height:
+        return False
+    cx, cy = centroids[largest]
+    if abs(cx - width / 2) > 0.12 * width or abs(cy - height / 2) > 0.12 * height:
+        return False
     
-    image_array = np.array(image) / 255.0
-    image_array_expanded = np.expand_dims(image_array, axis=0)
+    head = np.uint8(labels == largest) * 255
+    contours, _ = cv2.findContours(head, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    contour = max(contours, key=cv2.contourArea)
+    if len(contour) < 5 or area / max(cv2.contourArea(cv2.convexHull(contour)), 1) < 0.92:
+        return False
+    _, axes, _ = cv2.fitEllipse(contour)
+    ellipse_area = np.pi * axes[0] * axes[1] / 4
+    if not 0.9 <= area / max(ellipse_area, 1) <= 1.08 or min(axes) / max(axes) < 0.65:
+        return False
     
-    highlighted_image_base64 = None
+    # Inside the skull line: anatomy varies smoothly, noise does not
+    inside = cv2.erode(head, np.ones((7, 7), np.uint8)) > 0
+    if np.count_nonzero(inside) < 0.5 * area:
+        return False
+    raw_std = float(gray[inside].std())
+    smooth_std = float(cv2.GaussianBlur(gray, (7, 7), 0)[inside].std())
+    return raw_std >= 12 and smooth_std >= 0.6 * raw_std
+
+def prefilter_scan(rgb):
+    """
+    Cheap local check run before Gemini on the (250, 250, 3) uint8 pixels.
+    Returns "accept" only for images that clearly look like an axial brain
+    MRI/CT slice (grayscale, one centred head-shaped region with internal
+    structure), "reject" for images that clearly are not, and "ambiguous",
+    decided by Gemini, for everything else
+    """
+    # Scans are grayscale: the spread between colour channels stays near zero
+    channel_spread = float(np.mean(rgb.max(axis=2) - rgb.min(axis=2)))
+    
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    hist = np.bincount(gray.ravel(), minlength=256) / gray.size
+    dark_fraction = float(hist[:20].sum())
+    bright_fraction = float(hist[245:].sum())
+    
+    # Scans show a head on a dark background, so the brain mask covers part of the frame
+    _, brain_mask = extract_brain_mask(gray)
+    mask_ratio = np.count_nonzero(brain_mask) / brain_mask.size
+    
+    if channel_spread > PREFILTER_REJECT_COLOR or (dark_fraction < 0.02 and bright_fraction > 0.3):
+        return "reject"
+    if (channel_spread < PREFILTER_ACCEPT_COLOR
+            and 0.15 <= dark_fraction <= 0.75
+            and bright_fraction < 0.05
+            and 0.2 <= mask_ratio <= 0.85
+            and head_shaped(gray, brain_mask)):
+        return "accept"
+    return "ambiguous"
+
+def tumor_highlight(pixels, overlay_format):
+    """highlighting.tumor_highlight, with its encoding steps timed as pipeline stages"""
+    return highlighting.tumor_highlight(pixels, overlay_format, stage)
+
+async def process_brain_image(prepared, overlay_format=OVERLAY_FORMAT, defer_highlight=None):
+    """
+    Process a PreparedImage with the ML model. Given the image hash as
+    defer_highlight, a positive result is highlighted in the background
+    """
+    global brain_tumor_model
+    
+    highlight = {"highlighted_image": None}
     
     if brain_tumor_model is not None:
-        # Make prediction using the actual model
-        prediction = brain_tumor_model.predict(image_array_expanded)
-        is_tumor = bool(prediction[0][0] >= 0.5)
-        confidence = float(prediction[0][0] if is_tumor else 1 - prediction[0][0])
+        # Make prediction using the actual model, batched with concurrent requests
+        with stage("inference"):
+            prediction = await batch_scheduler.predict(prepared.array)
+        is_tumor = bool(prediction[0] >= 0.5)
+        confidence = float(prediction[0] if is_tumor else 1 - prediction[0])
         
         
-        logger.info(f"Model prediction: {prediction[0][0]}, is_tumor: {is_tumor}")
+        logger.info(f"Model prediction: {prediction[0]}, is_tumor: {is_tumor}")
         
         
-        if is_tumor:
+        if is_tumor and defer_highlight:
+            highlight = deferred_highlight(defer_highlight, prepared.pixels, overlay_format)
+        elif is_tumor:
             # Use the fast K-means approach
-            highlighted_image_base64 = kmeans_tumor_detection(image_array)
+            with stage("kmeans"):
+                highlight = await highlight_pool.highlight(prepared.pixels, overlay_format)
             logger.info("Generated tumor highlighting using K-means")
     else:
         import random
@@ -280,7 +1356,11 @@ async def process_brain_image(image):
         confidence = random.uniform(0.7, 0.90)
         logger.warning("Using fallback prediction with no model")
         
-        highlighted_image_base64 = kmeans_tumor_detection(image_array)
+        if defer_highlight:
+            highlight = deferred_highlight(defer_highlight, prepared.pixels, overlay_format)
+        else:
+            with stage("kmeans"):
+                highlight = await highlight_pool.highlight(prepared.pixels, overlay_format)
     
   
     tumor_types = ["Meningioma", "Glioma", "Pituitary"]
@@ -303,7 +1383,7 @@ async def process_brain_image(image):
         tumor_type = "None"
         precautions = ["Regular check-ups", "Monitor for any neurological symptoms"]
         treatment_options = ["No treatment needed", "Routine follow-up in 6-12 months"]
-        highlighted_image_base64 = None  # No highlighting needed for negative cases
+        highlight = {"highlighted_image": None}  # No highlighting needed for negative cases
     
     return {
         "prediction": "Positive" if is_tumor else "Negative",
@@ -311,47 +1391,260 @@ async def process_brain_image(image):
         "tumor_type": tumor_type,
         "precautions": precautions,
         "treatment_options": treatment_options,
-        "highlighted_image": highlighted_image_base64
+        **highlight
     }
 
+def count_prediction(results):
+    global first_prediction_seen
+    if results["prediction"] == "Positive":
+        tumor_detected_counter.inc()
+    else:
+        no_tumor_counter.inc()
+    if not first_prediction_seen:
+        first_prediction_seen = True
+        time_to_first_prediction_seconds.set(time.perf_counter() - import_start)
+
+async def predict_image(prepared, overlay_format=OVERLAY_FORMAT, highlight_mode=HIGHLIGHT_MODE):
+    """Run validation and prediction for one PreparedImage and build the /predict response"""
+    deferred = highlight_mode == "deferred"
+    # Serve repeated uploads of the same scan from the cache
+    with stage("hash"):
+        digest = image_hash(prepared.image)
+    cache_key = prediction_cache.key(digest, f"{overlay_format}-deferred" if deferred else overlay_format)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        if cached.get("is_appropriate"):
+            count_prediction(cached["ml_results"])
+            if cached["ml_results"].get("highlight_id"):
+                # The highlight may have been evicted since; recompute it if so
+                highlight_store.schedule(digest, prepared.pixels, overlay_format)
+        return cached
+    
+    # Only images the local pre-filter cannot decide go to Gemini
+    with stage("prefilter"):
+        decision = prefilter_scan(prepared.pixels) if PREFILTER_ENABLED else "ambiguous"
+    prefilter_decisions.labels(decision=decision).inc()
+    if decision == "ambiguous":
+        with stage("gemini"):
+            is_appropriate, validated = await validate_brain_image(prepared.image, digest)
+    else:
+        is_appropriate, validated = decision == "accept", True
+    
+    if not is_appropriate:
+        response = {
+            "is_appropriate": False,
+            "message": "Please upload an appropriate brain MRI or CT scan image for tumor detection"
+        }
+        prediction_cache.put(cache_key, response)
+        return response
+    
+    # Process the image
+    results = await process_brain_image(prepared, overlay_format, digest if deferred else None)
+    count_prediction(results)
+    
+    response = {
+        "is_appropriate": True,
+        "ml_results": results
+    }
+    
+    # Fallback predictions are placeholders, and an image Gemini could not
+    # check is only let through for now, so only cache validated model output
+    if brain_tumor_model is not None and validated:
+        prediction_cache.put(cache_key, response)
+    
+    return response
+
+def check_options(overlay, highlight=HIGHLIGHT_MODE, priority="interactive"):
+    if overlay not in OVERLAY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"overlay must be one of {', '.join(OVERLAY_FORMATS)}")
+    if highlight not in HIGHLIGHT_MODES:
+        raise HTTPException(status_code=400, detail=f"highlight must be one of {', '.join(HIGHLIGHT_MODES)}")
+    if priority not in PRIORITY_LANES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITY_LANES)}")
+
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(
+    file: UploadFile = File(...), overlay: str = Query(OVERLAY_FORMAT), highlight: str = Query(HIGHLIGHT_MODE),
+    priority: str = Query("interactive"), deadline: float = Query(ADMISSION_DEADLINE_S, gt=0)
+):
     """Endpoint for brain tumor prediction"""
-    try:
-        
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        
-        is_appropriate = await validate_brain_image(image)
-        
-        if not is_appropriate:
-            return {
-                "is_appropriate": False,
-                "message": "Please upload an appropriate brain MRI or CT scan image for tumor detection"
-            }
-        
-        # Process the image
-        results = await process_brain_image(image)
-        
-        if results["prediction"] == "Positive":
-            tumor_detected_counter.inc()
+    check_options(overlay, highlight, priority)
+    deadline_at = time.monotonic() + deadline
+    await wait_for_model()
+    
+    async with admission.admit(priority, deadline_at):
+        try:
             
-        else:
-            no_tumor_counter.inc()
-        
-        return {
-            "is_appropriate": True,
-            "ml_results": results
-        }
+            # Decode straight from the spooled upload on a preprocessing thread
+            loop = asyncio.get_running_loop()
+            with stage("preprocess"):
+                prepared = await loop.run_in_executor(preprocess_executor, preprocess_image, file.file)
+            
+            return await predict_image(prepared, overlay, highlight)
+            
+        except Exception as e:
+            logger.error(f"Prediction error: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/highlight/{digest}")
+async def get_highlight(digest: str, overlay: str = Query(OVERLAY_FORMAT), wait: float = Query(0, ge=0, le=60)):
+    """
+    The deferred highlight of a scan, by the highlight_id /predict returned.
+    Waits up to `wait` seconds for one still being computed (202 if it is not
+    done by then); 404 once it has been evicted, in which case POST the scan
+    to /highlight
+    """
+    check_options(overlay)
+    result, pending = await highlight_store.fetch(digest, overlay, wait)
+    if pending:
+        deferred_highlight_requests.labels(result="pending").inc()
+        return JSONResponse({"highlight_id": digest, "status": "pending"}, status_code=202)
+    if result is None:
+        deferred_highlight_requests.labels(result="missing").inc()
+        raise HTTPException(status_code=404, detail="No highlight for this image; POST it to /highlight")
+    deferred_highlight_requests.labels(result="ready").inc()
+    return {"highlight_id": digest, **result}
+
+@app.post("/highlight")
+async def highlight_image(
+    file: UploadFile = File(...), overlay: str = Query(OVERLAY_FORMAT),
+    priority: str = Query("bulk"), deadline: float = Query(ADMISSION_DEADLINE_S, gt=0)
+):
+    """Highlight the tumor region of a scan on demand, reusing a memoized result if there is one"""
+    check_options(overlay, priority=priority)
+    deadline_at = time.monotonic() + deadline
+    async with admission.admit(priority, deadline_at):
+        loop = asyncio.get_running_loop()
+        with stage("preprocess"):
+            prepared = await loop.run_in_executor(preprocess_executor, preprocess_image, file.file)
+        with stage("hash"):
+            digest = image_hash(prepared.image)
         
-    except Exception as e:
-        logger.error(f"Prediction error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        result = await highlight_store.schedule(digest, prepared.pixels, overlay)
+    if result is None:
+        raise HTTPException(status_code=500, detail="Highlighting failed")
+    return {"highlight_id": digest, **result}
+
+def batch_too_large():
+    return HTTPException(
+        status_code=413,
+        detail=f"At most {PREDICT_BATCH_MAX_FILES} images and {PREDICT_BATCH_MAX_BYTES} bytes (uncompressed) per batch request"
+    )
+
+def read_limited(source, limit):
+    """Read a file object in chunks, returning None once it runs past limit bytes"""
+    chunks, size = [], 0
+    while True:
+        chunk = source.read(min(2**20, limit - size + 1))
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+
+def unpack_upload(filename, contents, max_files=PREDICT_BATCH_MAX_FILES, max_bytes=PREDICT_BATCH_MAX_BYTES):
+    """
+    Expand a zip or tar archive into (name, bytes) pairs; plain images pass through.
+    Members are counted from the archive index before any is read, and
+    decompression stops as soon as the output passes max_bytes: the sizes in
+    archive headers are not trusted. Over either limit raises a 413
+    """
+    buffer = io.BytesIO(contents)
+    
+    if zipfile.is_zipfile(buffer):
+        with zipfile.ZipFile(buffer) as archive:
+            members = [
+                (info.filename, info) for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+            return extract_members(members, archive.open, max_files, max_bytes)
+    
+    buffer.seek(0)
+    try:
+        with tarfile.open(fileobj=buffer, mode="r:*") as archive:
+            members = [
+                (member.name, member) for member in archive.getmembers()
+                if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+            return extract_members(members, archive.extractfile, max_files, max_bytes)
+    except tarfile.TarError:
+        if max_files < 1 or len(contents) > max_bytes:
+            raise batch_too_large()
+        return [(filename, contents)]
+
+def extract_members(members, open_member, max_files, max_bytes):
+    """Read (name, member) pairs of an archive within the file and byte limits"""
+    if len(members) > max_files:
+        raise batch_too_large()
+    items = []
+    for name, member in members:
+        with open_member(member) as source:
+            data = read_limited(source, max_bytes)
+        if data is None:
+            raise batch_too_large()
+        max_bytes -= len(data)
+        items.append((name, data))
+    return items
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...), overlay: str = Query(OVERLAY_FORMAT), highlight: str = Query(HIGHLIGHT_MODE),
+    priority: str = Query("bulk")
+):
+    """
+    Endpoint for bulk prediction. Accepts many image files and/or zip/tar
+    archives and streams one NDJSON line per image as results complete.
+    The request is shed if its lane is full; once accepted, its images wait
+    for admission slots in that lane without a deadline
+    """
+    check_options(overlay, highlight, priority)
+    await wait_for_model()
+    admission.check(priority)
     
+    # The limits cover the whole request, across all of its files
+    items, size = [], 0
+    for file in files:
+        unpacked = unpack_upload(
+            file.filename, await file.read(), PREDICT_BATCH_MAX_FILES - len(items), PREDICT_BATCH_MAX_BYTES - size
+        )
+        items.extend(unpacked)
+        size += sum(len(data) for _, data in unpacked)
     
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in upload")
     
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
+    loop = asyncio.get_running_loop()
+    # Bounds how many images are decoded and held in memory at once; the
+    # batch scheduler groups the in-flight images into model batches
+    semaphore = asyncio.Semaphore(PREDICT_BATCH_CONCURRENCY)
+    
+    async def run(index, filename, contents):
+        async with semaphore, admission.admit(priority, shed=False):
+            try:
+                prepared = await loop.run_in_executor(preprocess_executor, preprocess_image, contents)
+                result = await predict_image(prepared, overlay, highlight)
+            except Exception as e:
+                logger.error(f"Batch prediction error for {filename}: {str(e)}")
+                result = {"error": str(e)}
+        return {"index": index, "filename": filename, **result}
+    
+    async def stream():
+        tasks = [asyncio.create_task(run(i, name, data)) for i, (name, data) in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # Stop outstanding work if the client disconnects
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    
+    
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry, multiprocess
 from fastapi import Response
 
 # Define counters
@@ -364,11 +1657,112 @@ http_requests_total = Counter(
     ["method", "endpoint", "status_code"]
 )
 
+# Prediction cache metrics
+prediction_cache_hits = Counter("prediction_cache_hits_total", "Prediction cache hits", ["tier"])
+prediction_cache_misses = Counter("prediction_cache_misses_total", "Prediction cache misses")
+prediction_cache_evictions = Counter("prediction_cache_evictions_total", "Prediction cache evictions", ["tier"])
+
+# Gemini validation metrics
+gemini_validation_seconds = Histogram(
+    "gemini_validation_seconds",
+    "Latency of the Gemini validation stage by outcome",
+    ["outcome"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+gemini_circuit_open = Gauge("gemini_circuit_open", "1 while the Gemini circuit breaker is open", multiprocess_mode="max")
+
+# Pre-filter metrics (accept/reject are decided locally, ambiguous goes to Gemini)
+prefilter_decisions = Counter("prefilter_decisions_total", "Local pre-filter decisions", ["decision"])
+
+# Per-stage pipeline timings
+pipeline_stage_seconds = Histogram(
+    "pipeline_stage_seconds",
+    "Time spent in each stage of the prediction pipeline",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+pipeline_stage_in_flight = Gauge(
+    "pipeline_stage_in_flight", "Work currently inside each pipeline stage", ["stage"], multiprocess_mode="livesum"
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served", multiprocess_mode="livesum")
+model_load_seconds = Gauge("model_load_seconds", "Time taken to load the brain tumor model", multiprocess_mode="max")
+
+# Highlight process pool metrics (utilisation: rate of busy seconds / workers)
+highlight_pool_workers = Gauge("highlight_pool_workers", "Processes in the highlight pool", multiprocess_mode="livesum")
+highlight_pool_in_flight = Gauge(
+    "highlight_pool_in_flight", "Highlight jobs queued or running in the pool", multiprocess_mode="livesum"
+)
+highlight_pool_busy_seconds = Counter("highlight_pool_busy_seconds_total", "Time pool processes spent on highlight jobs")
+highlight_pool_queue_seconds = Histogram(
+    "highlight_pool_queue_seconds",
+    "Time a highlight job waits for a free pool process",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+highlight_pool_restarts = Counter("highlight_pool_restarts_total", "Highlight pools replaced after a process died")
+
+# Deferred highlight lookups by result (ready, pending, missing)
+deferred_highlight_requests = Counter(
+    "deferred_highlight_requests_total", "GET /highlight lookups by result", ["result"]
+)
+
+# Start-up metrics, in seconds from the start of the ml_service import
+import_seconds = Gauge("ml_service_import_seconds", "Time taken to import the ML service module", multiprocess_mode="max")
+lazy_import_seconds = Gauge(
+    "ml_service_lazy_import_seconds", "Time taken by deferred imports of heavy modules", ["module"], multiprocess_mode="max"
+)
+model_warmup_seconds = Gauge("model_warmup_seconds", "Time taken by the start-up warm-up", multiprocess_mode="max")
+model_ready_seconds = Gauge("model_ready_seconds", "Time from start-up until the service was ready", multiprocess_mode="max")
+time_to_first_prediction_seconds = Gauge(
+    "time_to_first_prediction_seconds", "Time from start-up until the first prediction was served", multiprocess_mode="max"
+)
+
+# Admission control metrics (queued_total counts requests that had to wait for a slot)
+admission_in_flight = Gauge(
+    "admission_in_flight", "Requests holding an admission slot", multiprocess_mode="livesum"
+)
+admission_queue_depth = Gauge(
+    "admission_queue_depth", "Requests waiting for an admission slot by priority lane", ["lane"], multiprocess_mode="livesum"
+)
+admission_queued_total = Counter("admission_queued_total", "Requests that waited for an admission slot", ["lane"])
+admission_shed = Counter(
+    "admission_shed_total", "Requests rejected with 503 by priority lane and reason (queue_full, deadline)", ["lane", "reason"]
+)
+admission_queue_wait_seconds = Histogram(
+    "admission_queue_wait_seconds",
+    "Time requests wait for an admission slot, including those shed at their deadline",
+    ["lane"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+# Micro-batching metrics
+batch_queue_depth = Gauge(
+    "inference_batch_queue_depth", "Number of images waiting for a model batch", multiprocess_mode="livesum"
+)
+batch_size_histogram = Histogram(
+    "inference_batch_size",
+    "Number of images per model forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+batch_wait_seconds = Histogram(
+    "inference_batch_wait_seconds",
+    "Time an image waits in the queue before its batch is dispatched",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
 
 @app.get("/metrics")
 def metrics():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Under several gunicorn workers, report the samples of all of them
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
+import_seconds.set(time.perf_counter() - import_start)
+
+
 if __name__ == "__main__":
+    # Development server; production runs under gunicorn -c gunicorn.fast.conf.py ml_service:app
     uvicorn.run("ml_service:app", host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import ml_service
+
+
+def controller(max_concurrency=1, interactive=4, bulk=4):
+    return ml_service.AdmissionController(max_concurrency, {"interactive": interactive, "bulk": bulk})
+
+
+async def hold(admission, lane, started, release, **kwargs):
+    async with admission.admit(lane, **kwargs):
+        started.append(lane)
+        await release.wait()
+
+
+def test_interactive_lane_goes_ahead_of_bulk():
+    async def run():
+        admission = controller()
+        started, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(admission, "bulk", started, release))]
+        await asyncio.sleep(0)
+        # Both queue behind the running request; bulk arrived first
+        tasks.append(asyncio.create_task(hold(admission, "bulk", started, release)))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(hold(admission, "interactive", started, release)))
+        await asyncio.sleep(0)
+        assert [len(admission.lanes[lane]) for lane in ml_service.PRIORITY_LANES] == [1, 1]
+        release.set()
+        await asyncio.gather(*tasks)
+        return started, admission.running
+
+    assert asyncio.run(run()) == (["bulk", "interactive", "bulk"], 0)
+
+
+def test_full_lane_is_shed_with_retry_after():
+    async def run():
+        admission = controller(interactive=1, bulk=1)
+        admission.service_seconds = 2.5
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(admission, lane, [], release)) for lane in ("bulk", "interactive", "bulk")]
+        await asyncio.sleep(0)
+        
+        rejections = []
+        for lane in ml_service.PRIORITY_LANES:
+            with pytest.raises(HTTPException) as excinfo:
+                async with admission.admit(lane):
+                    pass
+            rejections.append(excinfo.value)
+        release.set()
+        await asyncio.gather(*tasks)
+        return rejections, admission
+
+    rejections, admission = asyncio.run(run())
+    assert [rejection.status_code for rejection in rejections] == [503, 503]
+    # Bulk also waits behind the interactive queue: 2 and 3 service times of 2.5s
+    assert [rejection.headers["Retry-After"] for rejection in rejections] == ["5", "8"]
+    assert admission.running == 0
+
+
+def test_request_that_cannot_start_by_its_deadline_is_shed():
+    async def run():
+        admission = controller()
+        admission.service_seconds = 10
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, "interactive", [], release))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as excinfo:
+            async with admission.admit("interactive", deadline=time.monotonic() + 1):
+                pass
+        release.set()
+        await running
+        return excinfo.value, admission
+
+    rejection, admission = asyncio.run(run())
+    assert rejection.status_code == 503 and "deadline" in rejection.detail
+    assert admission.running == 0 and not admission.lanes["interactive"]
+
+
+def test_slot_is_released_when_the_request_fails():
+    async def run():
+        admission = controller()
+        with pytest.raises(RuntimeError):
+            async with admission.admit("interactive"):
+                raise RuntimeError("model failed")
+        assert admission.running == 0
+        # The slot is free again for the next request
+        async with admission.admit("interactive"):
+            return admission.running
+
+    assert asyncio.run(run()) == 1
+
+
+def test_cancelled_waiters_pass_their_slot_on():
+    async def run():
+        admission = controller()
+        started, release = [], asyncio.Event()
+        running = asyncio.create_task(hold(admission, "interactive", started, release))
+        await asyncio.sleep(0)
+        # One waiter leaves while queued, another after its slot was handed over
+        gone = asyncio.create_task(hold(admission, "interactive", started, release))
+        handed = asyncio.create_task(hold(admission, "bulk", started, release))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.gather(gone, return_exceptions=True)
+        assert not admission.lanes["interactive"]
+        
+        release.set()
+        await running
+        handed.cancel()
+        await asyncio.gather(handed, return_exceptions=True)
+        return started, admission.running
+
+    assert asyncio.run(run()) == (["interactive"], 0)
+
+
+def test_middleware_sheds_before_reading_the_upload(monkeypatch):
+    admission = controller(interactive=0, bulk=0)
+    admission.running = 1
+    monkeypatch.setattr(ml_service, "admission", admission)
+    client = TestClient(ml_service.app)
+    
+    response = client.post("/predict", files={"file": ("scan.png", b"not an image", "image/png")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.post("/predict/batch?priority=interactive", files={"file": ("a.zip", b"", "application/zip")}).status_code == 503
+    
+    admission.running = 0
+    # With a free slot the request goes through to the route, which rejects the bytes
+    assert client.post("/predict", files={"file": ("scan.png", b"not an image", "image/png")}).status_code != 503
@@ -0,0 +1,63 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import ml_service
+
+
+class RecordingScheduler(ml_service.BatchScheduler):
+    """BatchScheduler whose forward pass records batch sizes and echoes each input's mean"""
+
+    def __init__(self, max_size, max_wait_ms, error=None):
+        super().__init__(max_size, max_wait_ms)
+        self.batches = []
+        self.error = error
+
+    def _forward(self, inputs):
+        self.batches.append(len(inputs))
+        if self.error:
+            raise self.error
+        return inputs.reshape(len(inputs), -1).mean(axis=1, keepdims=True)
+
+
+def image(value):
+    return np.full((250, 250, 3), value, dtype=np.float32)
+
+
+def run(scheduler, coroutine):
+    async def main():
+        scheduler.start()
+        try:
+            return await coroutine()
+        finally:
+            await scheduler.stop()
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_share_batches_and_get_their_own_rows():
+    scheduler = RecordingScheduler(max_size=4, max_wait_ms=50)
+    results = run(scheduler, lambda: asyncio.gather(*(scheduler.predict(image(i)) for i in range(10))))
+    
+    assert [float(row[0]) for row in results] == list(range(10))
+    assert scheduler.batches == [4, 4, 2]
+
+
+def test_lone_request_is_sent_after_max_wait():
+    scheduler = RecordingScheduler(max_size=8, max_wait_ms=10)
+    result = run(scheduler, lambda: asyncio.wait_for(scheduler.predict(image(3)), 1))
+    
+    assert float(result[0]) == 3
+    assert scheduler.batches == [1]
+
+
+def test_failed_batch_fails_its_requests_and_scheduler_keeps_running():
+    scheduler = RecordingScheduler(max_size=2, max_wait_ms=10, error=RuntimeError("model failed"))
+
+    async def requests():
+        with pytest.raises(RuntimeError, match="model failed"):
+            await asyncio.gather(scheduler.predict(image(1)), scheduler.predict(image(2)))
+        scheduler.error = None
+        return await asyncio.wait_for(scheduler.predict(image(5)), 1)
+
+    assert float(run(scheduler, requests)[0]) == 5
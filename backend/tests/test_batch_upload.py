@@ -0,0 +1,69 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+import ml_service
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("pack", [make_zip, make_tar])
+def test_unpacks_images_only(pack):
+    contents = pack([("a.png", b"aa"), ("notes.txt", b"x"), ("b.JPG", b"bbb")])
+    assert ml_service.unpack_upload("scans", contents, 10, 100) == [("a.png", b"aa"), ("b.JPG", b"bbb")]
+
+
+def test_plain_image_passes_through():
+    assert ml_service.unpack_upload("scan.png", b"\x89PNG", 1, 10) == [("scan.png", b"\x89PNG")]
+
+
+@pytest.mark.parametrize("pack", [make_zip, make_tar])
+def test_too_many_members_is_rejected_before_reading(pack, monkeypatch):
+    contents = pack([(f"{i}.png", b"x") for i in range(5)])
+    monkeypatch.setattr(ml_service, "read_limited", lambda *args: pytest.fail("member was read"))
+    with pytest.raises(HTTPException) as error:
+        ml_service.unpack_upload("scans", contents, 4, 100)
+    assert error.value.status_code == 413
+
+
+@pytest.mark.parametrize("pack", [make_zip, make_tar])
+def test_decompression_bomb_is_stopped(pack):
+    # 64 MB of zeros compresses to well under 1 MB
+    contents = pack([("bomb.png", bytes(64 * 2**20))])
+    assert len(contents) < 2**20
+    with pytest.raises(HTTPException) as error:
+        ml_service.unpack_upload("scans", contents, 10, 2**20)
+    assert error.value.status_code == 413
+
+
+def test_total_size_counts_every_member():
+    contents = make_zip([("a.png", bytes(600)), ("b.png", bytes(600))])
+    with pytest.raises(HTTPException):
+        ml_service.unpack_upload("scans", contents, 10, 1000)
+    assert len(ml_service.unpack_upload("scans", contents, 10, 1200)) == 2
+
+
+def test_plain_image_over_the_limit_is_rejected():
+    with pytest.raises(HTTPException):
+        ml_service.unpack_upload("scan.png", bytes(11), 10, 10)
+    with pytest.raises(HTTPException):
+        ml_service.unpack_upload("scan.png", b"x", 0, 10)
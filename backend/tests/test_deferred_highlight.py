@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("mongomock")
+
+from bench.common import load_flask_app
+
+app = load_flask_app()
+
+MASK = {"encoding": "rle", "size": [2, 2], "counts": [1, 2, 1]}
+
+
+@pytest.fixture
+def pending_image(monkeypatch):
+    """A positive upload whose highlight the ML service is still computing"""
+    fetched = []
+
+    def fetch_highlight(image_obj_id, highlight_id, wait):
+        fetched.append(wait)
+        if app.app.config['ML_OVERLAY_FORMAT'] == 'rle':
+            return {"highlight_id": highlight_id, "highlighted_image": None, "tumor_mask": MASK}
+        return None
+
+    monkeypatch.setattr(app, "fetch_highlight", fetch_highlight)
+    image_id = app.images_collection.insert_one({
+        "user_id": ObjectId(),
+        "original_filename": "scan.png",
+        "upload_time": datetime.datetime.utcnow(),
+        "is_appropriate": True,
+        "ml_results": {"prediction": "Positive", "highlight_id": "abc", "highlight_status": "pending"},
+        "blobs": {"original": {"id": "blob", "content_type": "image/png", "size": 1}}
+    }).inserted_id
+    yield str(image_id), fetched
+    app.images_collection.delete_one({"_id": image_id})
+
+
+def overlay_format(monkeypatch, fmt):
+    monkeypatch.setitem(app.app.config, 'ML_OVERLAY_FORMAT', fmt)
+
+
+def test_rle_pending_image_links_no_highlighted_image(pending_image, monkeypatch):
+    overlay_format(monkeypatch, 'rle')
+    image_id, _ = pending_image
+    image = app.images_collection.find_one({"_id": ObjectId(image_id)})
+    urls = app.image_urls(image)
+    assert "original_url" in urls
+    assert not any(kind.startswith("highlighted") for kind in urls)
+
+
+def test_png_pending_image_links_highlighted_image(pending_image, monkeypatch):
+    overlay_format(monkeypatch, 'png')
+    image_id, _ = pending_image
+    image = app.images_collection.find_one({"_id": ObjectId(image_id)})
+    assert "highlighted_url" in app.image_urls(image)
+
+
+def test_rle_pending_mask_is_attached_when_polled(pending_image, monkeypatch):
+    overlay_format(monkeypatch, 'rle')
+    image_id, fetched = pending_image
+    response = app.app.test_client().get(f"/api/image/{image_id}?wait=3")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["ml_results"]["tumor_mask"] == MASK
+    assert body["ml_results"]["highlight_status"] == "done"
+    assert "highlighted_url" not in body
+    assert fetched == [3]
+
+    # Once attached, later polls do not go back to the ML service
+    app.app.test_client().get(f"/api/image/{image_id}?wait=3")
+    assert fetched == [3]
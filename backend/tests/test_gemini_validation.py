@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+import ml_service
+
+
+class CountingStub(ml_service.StubGeminiModel):
+    """StubGeminiModel that counts calls and can be made to fail"""
+
+    def __init__(self, answer="yes", latency_ms=0, error=None):
+        super().__init__(answer, latency_ms)
+        self.error = error
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return super().generate_content(contents, **kwargs)
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Fresh Gemini stage state around a stub; returns a function to swap the stub"""
+    def configure(stub, concurrency=2, timeout=1.0, failures=2, reset=0.2):
+        monkeypatch.setattr(ml_service, "gemini_model", stub)
+        monkeypatch.setattr(ml_service, "GEMINI_TIMEOUT_S", timeout)
+        monkeypatch.setattr(ml_service, "gemini_executor", ml_service.ThreadPoolExecutor(max_workers=concurrency))
+        monkeypatch.setattr(ml_service, "gemini_slots", asyncio.Semaphore(concurrency))
+        monkeypatch.setattr(ml_service, "gemini_breaker", ml_service.CircuitBreaker(failures, reset))
+        monkeypatch.setattr(ml_service, "gemini_verdicts", ml_service.OrderedDict())
+        return stub
+    return configure
+
+
+def validate(digest=None):
+    return ml_service.validate_brain_image(object(), digest)
+
+
+def test_verdict_cache_hit(gemini):
+    stub = gemini(CountingStub("no"))
+
+    async def run():
+        return [await validate("scan-a"), await validate("scan-a"), await validate("scan-b")]
+
+    assert asyncio.run(run()) == [(False, True)] * 3
+    assert stub.calls == 2
+
+
+def test_timeout_counts_as_failure_and_is_not_cached(gemini):
+    stub = gemini(CountingStub(latency_ms=300), timeout=0.05, failures=5)
+
+    async def run():
+        return [await validate("slow"), await validate("slow")]
+
+    assert asyncio.run(run()) == [(True, False)] * 2
+    assert stub.calls == 2
+    assert ml_service.gemini_breaker.failures == 2
+    assert "slow" not in ml_service.gemini_verdicts
+
+
+def test_waiting_for_a_thread_is_not_a_timeout(gemini):
+    # 12 calls of 200 ms through 2 threads take ~1.2 s, well past the 0.5 s timeout
+    stub = gemini(CountingStub("no", latency_ms=200), concurrency=2, timeout=0.5, failures=1)
+
+    async def run():
+        return await asyncio.gather(*(validate(f"scan-{i}") for i in range(12)))
+
+    assert asyncio.run(run()) == [(False, True)] * 12
+    assert stub.calls == 12
+    assert ml_service.gemini_breaker.failures == 0
+    assert ml_service.gemini_breaker.opened_at is None
+
+
+def test_breaker_opens_then_closes_after_one_trial(gemini):
+    stub = gemini(CountingStub(error=RuntimeError("quota")), failures=2, reset=0.2)
+
+    async def run():
+        for i in range(2):
+            assert await validate(f"fail-{i}") == (True, False)
+        assert ml_service.gemini_breaker.opened_at is not None
+        # Open: no calls reach Gemini
+        assert await validate("while-open") == (True, False)
+        assert stub.calls == 2
+
+        await asyncio.sleep(0.25)
+        stub.error = None
+        stub.latency = 0.1
+        # Half-open: concurrent callers, a single trial call
+        await asyncio.gather(*(validate(f"trial-{i}") for i in range(5)))
+        assert stub.calls == 3
+        assert ml_service.gemini_breaker.opened_at is None
+
+        # Closed again
+        await validate("after")
+        assert stub.calls == 4
+
+    asyncio.run(run())
+
+
+def test_failed_trial_reopens_the_breaker(gemini):
+    stub = gemini(CountingStub(error=RuntimeError("down")), failures=1, reset=0.1)
+
+    async def run():
+        await validate("first")
+        opened = ml_service.gemini_breaker.opened_at
+        await asyncio.sleep(0.15)
+        await validate("trial")
+        assert stub.calls == 2
+        assert ml_service.gemini_breaker.opened_at > opened
+        await validate("still-open")
+        assert stub.calls == 2
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def predict(monkeypatch):
+    """predict_image with a stand-in model and a fresh in-memory prediction cache"""
+    async def process_brain_image(prepared, overlay_format, defer_highlight=None):
+        return {"prediction": "Negative"}
+    monkeypatch.setattr(ml_service, "brain_tumor_model", object())
+    monkeypatch.setattr(ml_service, "process_brain_image", process_brain_image)
+    monkeypatch.setattr(ml_service, "prediction_cache", ml_service.PredictionCache(8))
+    monkeypatch.setattr(ml_service, "PREFILTER_ENABLED", False)
+    image = ml_service.Image.new("RGB", (250, 250), (40, 40, 40))
+    pixels = ml_service.np.asarray(image, dtype=ml_service.np.uint8)
+    prepared = ml_service.PreparedImage(image, pixels, pixels / 255)
+    return lambda: asyncio.run(ml_service.predict_image(prepared))
+
+
+def test_unvalidated_prediction_is_not_cached(gemini, predict):
+    stub = gemini(CountingStub(error=RuntimeError("down")), failures=5)
+    assert predict()["is_appropriate"] is True
+    assert predict()["is_appropriate"] is True
+    assert stub.calls == 2
+    assert not ml_service.prediction_cache.entries
+
+    stub.error = None
+    predict()
+    predict()
+    assert stub.calls == 3
+    assert len(ml_service.prediction_cache.entries) == 1
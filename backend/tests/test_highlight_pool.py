@@ -0,0 +1,58 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+import ml_service
+from bench.synthetic import synthetic_scan
+
+
+@pytest.fixture
+def pool():
+    pool = ml_service.HighlightPool(1)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def kill_workers(executor):
+    for process in list(executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+
+def test_dead_process_falls_back_and_restarts_the_pool(pool):
+    pixels = synthetic_scan(0)
+    expected = ml_service.tumor_highlight(pixels, "png")
+
+    async def run():
+        assert await pool.highlight(pixels, "png") == expected
+        broken = pool.executor
+        kill_workers(broken)
+        # The job that finds the pool broken is still answered, in a thread
+        assert await pool.highlight(pixels, "png") == expected
+        assert pool.executor is not None and pool.executor is not broken
+        # and later jobs run on the new pool
+        assert await pool.highlight(pixels, "png") == expected
+
+    asyncio.run(run())
+
+
+def test_pool_processes_do_not_import_the_service(pool):
+    asyncio.run(pool.warm_up(synthetic_scan(0)))
+    imported = pool.executor.submit(eval, "sorted(__import__('sys').modules)").result()
+    assert "highlighting" in imported
+    assert "ml_service" not in imported and "prometheus_client" not in imported
+
+
+def test_restart_marks_old_processes_dead(pool, tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    asyncio.run(pool.warm_up(synthetic_scan(0)))
+    broken = pool.executor
+    pids = list(broken._processes)
+    for pid in pids:
+        (tmp_path / f"gauge_livesum_{pid}.db").touch()
+    
+    pool.restart(broken)
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+import ml_service
+
+
+class CountingHighlighter:
+    """Stands in for tumor_highlight; counts calls, each taking `delay` seconds"""
+
+    def __init__(self):
+        self.calls = []
+        self.delay = 0
+
+    def __call__(self, pixels, overlay_format):
+        self.calls.append(overlay_format)
+        time.sleep(self.delay)
+        return {"highlighted_image": f"overlay-{len(self.calls)}"}
+
+
+@pytest.fixture
+def highlights(monkeypatch):
+    highlighter = CountingHighlighter()
+    monkeypatch.setattr(ml_service, "tumor_highlight", highlighter)
+    return highlighter
+
+
+def workers(tmp_path, count=2):
+    """Stores of separate worker processes sharing one directory"""
+    return [ml_service.HighlightStore(8, str(tmp_path)) for _ in range(count)]
+
+
+def test_other_worker_serves_a_finished_highlight(tmp_path, highlights):
+    first, second = workers(tmp_path)
+
+    async def run():
+        await first.schedule("scan", None, "png")
+        assert await second.fetch("scan", "png") == ({"highlighted_image": "overlay-1"}, False)
+        # POST /highlight on the other worker does not compute it again
+        assert await second.schedule("scan", None, "png") == {"highlighted_image": "overlay-1"}
+
+    asyncio.run(run())
+    assert highlights.calls == ["png"]
+
+
+def test_other_worker_waits_for_a_pending_highlight(tmp_path, highlights):
+    highlights.delay = 0.3
+    first, second = workers(tmp_path)
+
+    async def run():
+        task = first.schedule("scan", None, "png")
+        await asyncio.sleep(0.05)
+        assert await second.fetch("scan", "png") == (None, True)
+        assert await second.fetch("scan", "png", wait=2) == ({"highlighted_image": "overlay-1"}, False)
+        await task
+
+    asyncio.run(run())
+    assert highlights.calls == ["png"]
+
+
+def test_unknown_highlight_is_missing(tmp_path, highlights):
+    first, _ = workers(tmp_path)
+    assert asyncio.run(first.fetch("scan", "png", wait=0.1)) == (None, False)
+    assert asyncio.run(first.fetch("scan", "png")) == (None, False)
+
+
+def test_stale_pending_marker_is_ignored(tmp_path, highlights, monkeypatch):
+    monkeypatch.setattr(ml_service, "HIGHLIGHT_PENDING_TIMEOUT_S", 0.1)
+    first, _ = workers(tmp_path)
+    first._touch("scan", "png")
+    time.sleep(0.15)
+    assert asyncio.run(first.fetch("scan", "png", wait=1)) == (None, False)
+
+
+def test_shared_results_are_bounded(tmp_path, highlights):
+    store = ml_service.HighlightStore(2, str(tmp_path))
+
+    async def run():
+        for digest in ("a", "b", "c"):
+            await store.schedule(digest, None, "png")
+
+    asyncio.run(run())
+    assert len(list(tmp_path.glob("*.json"))) == 2
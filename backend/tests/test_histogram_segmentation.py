@@ -0,0 +1,108 @@
+import itertools
+
+import cv2
+import numpy as np
+import pytest
+
+import highlighting
+from bench.synthetic import synthetic_scans
+
+
+@pytest.fixture(autouse=True)
+def histogram_engine(monkeypatch):
+    monkeypatch.setattr(highlighting, "SEGMENTATION_ENGINE", "histogram")
+
+
+def two_tone():
+    img = np.zeros((250, 250), np.uint8)
+    cv2.ellipse(img, (125, 125), (100, 115), 0, 0, 360, 90, -1)
+    cv2.circle(img, (150, 110), 20, 200, -1)
+    return img
+
+
+@pytest.mark.parametrize("pixels", [
+    np.zeros((250, 250), np.uint8),        # blank: no brain pixels
+    np.full((250, 250), 255, np.uint8),    # saturated: one level
+    two_tone()                             # two levels, fewer than the three clusters
+], ids=["blank", "saturated", "two-tone"])
+def test_few_intensity_levels_give_a_deterministic_mask(pixels):
+    masks = []
+    for seed in range(3):
+        # The emergency fallback draws a random circle; it must not be reached
+        np.random.seed(seed)
+        masks.append(highlighting.tumor_mask(pixels))
+    assert all(np.array_equal(masks[0], mask) for mask in masks[1:])
+
+
+def test_threshold_with_fewer_levels_than_clusters():
+    hist = np.zeros(256, np.int64)
+    assert highlighting.histogram_kmeans_threshold(hist) == 256
+    hist[[40]] = 10
+    assert highlighting.histogram_kmeans_threshold(hist) == 40
+    hist[[200]] = 3
+    assert highlighting.histogram_kmeans_threshold(hist) == 200
+
+
+def test_two_tone_scan_highlights_the_bright_region():
+    mask = highlighting.tumor_mask(two_tone())
+    assert mask[110, 150]
+    assert not mask[200, 125]
+
+
+def brute_force_threshold(hist, k=3):
+    """
+    Lowest level of the brightest cluster, trying every pair of split bins.
+    Splitting at an empty bin repeats the partition of the next occupied one,
+    so only occupied bins are tried
+    """
+    values = np.arange(256, dtype=np.float64)
+    best_cost, best_split = np.inf, None
+    for t1, t2 in itertools.combinations(np.flatnonzero(hist)[1:], 2):
+        cost = 0.0
+        for lo, hi in ((0, t1), (t1, t2), (t2, 256)):
+            weights = hist[lo:hi]
+            mean = np.average(values[lo:hi], weights=weights)
+            cost += np.dot(weights, (values[lo:hi] - mean) ** 2)
+        if cost < best_cost:
+            best_cost, best_split = cost, t2
+    return int(best_split)
+
+
+def scan_histogram(pixels):
+    enhanced, brain_mask = highlighting.enhance_brain(cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY))
+    return np.bincount(enhanced[brain_mask > 0], minlength=256)
+
+
+def test_threshold_matches_brute_force_on_random_histograms():
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        hist = np.zeros(256, np.int64)
+        levels = rng.choice(256, size=12, replace=False)
+        hist[levels] = rng.integers(1, 1000, size=levels.size)
+        assert highlighting.histogram_kmeans_threshold(hist) == brute_force_threshold(hist)
+
+
+def test_threshold_matches_brute_force_on_scans():
+    hist = scan_histogram(synthetic_scans(1)[0])
+    assert np.count_nonzero(hist) > 100
+    assert highlighting.histogram_kmeans_threshold(hist) == brute_force_threshold(hist)
+
+
+def test_masks_agree_with_kmeans_engine(monkeypatch):
+    scans = synthetic_scans(8)
+    masks = [highlighting.tumor_mask(pixels) for pixels in scans]
+    monkeypatch.setattr(highlighting, "SEGMENTATION_ENGINE", "kmeans")
+    cv2.setRNGSeed(0)
+    previous = [highlighting.tumor_mask(pixels) for pixels in scans]
+    
+    ious = [np.count_nonzero(a & b) / max(np.count_nonzero(a | b), 1) for a, b in zip(masks, previous)]
+    assert np.mean(ious) >= 0.95
+
+
+def test_repeated_runs_are_identical():
+    for pixels in synthetic_scans(3, seed=10):
+        first = highlighting.tumor_mask(pixels)
+        cv2.setRNGSeed(1)
+        np.random.seed(1)
+        assert np.array_equal(first, highlighting.tumor_mask(pixels))
+        assert np.array_equal(first, highlighting.tumor_mask(pixels.copy()))
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+import pytest
+
+import highlighting
+from bench.kmeans_loops import loop_tumor_mask
+from bench.synthetic import synthetic_scan
+
+
+@pytest.fixture(autouse=True)
+def kmeans_engine(monkeypatch):
+    monkeypatch.setattr(highlighting, "SEGMENTATION_ENGINE", "kmeans")
+
+
+def masks(pixels, seed):
+    cv2.setRNGSeed(seed)
+    expected = loop_tumor_mask(pixels)
+    cv2.setRNGSeed(seed)
+    return expected, highlighting.tumor_mask(pixels)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_matches_loop_implementation(seed):
+    expected, mask = masks(synthetic_scan(seed), seed)
+    assert expected.any()
+    assert np.array_equal(mask, expected)
+
+
+def test_matches_loop_implementation_on_grayscale_input():
+    expected, mask = masks(synthetic_scan(7)[..., 0], 7)
+    assert np.array_equal(mask, expected)
+
+
+def test_matches_loop_implementation_in_threshold_fallback():
+    # The brightest cluster is half the brain, too large to keep, so no K-means region survives
+    img = np.zeros((250, 250), np.uint8)
+    cv2.ellipse(img, (125, 125), (100, 115), 0, 0, 360, 90, -1)
+    cv2.ellipse(img, (125, 125), (100, 115), 0, 180, 360, 200, -1)
+    expected, mask = masks(img, 0)
+    assert np.array_equal(mask, expected)
@@ -0,0 +1,55 @@
+import os
+
+import highlighting
+import ml_service
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ml_service.PredictionCache(max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.put("c", {"v": 3})
+    # "b" was used least recently
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.get("c") == {"v": 3}
+
+
+def test_disk_tier_survives_restart_and_is_promoted(tmp_path):
+    ml_service.PredictionCache(max_entries=2, disk_dir=str(tmp_path), disk_max_bytes=1 << 20).put("a", {"v": 1})
+    
+    restarted = ml_service.PredictionCache(max_entries=2, disk_dir=str(tmp_path), disk_max_bytes=1 << 20)
+    assert "a" not in restarted.entries
+    assert restarted.get("a") == {"v": 1}
+    assert "a" in restarted.entries
+    # Served from memory from now on, even once the file is gone
+    os.remove(tmp_path / "a.json")
+    assert restarted.get("a") == {"v": 1}
+
+
+def test_disk_tier_stays_under_its_byte_limit(tmp_path):
+    cache = ml_service.PredictionCache(max_entries=0, disk_dir=str(tmp_path), disk_max_bytes=200)
+    for i in range(10):
+        cache.put(f"key-{i}", {"payload": "x" * 50})
+        # Distinct mtimes, however coarse the file system's clock
+        if os.path.exists(tmp_path / f"key-{i}.json"):
+            os.utime(tmp_path / f"key-{i}.json", (i, i))
+    assert sum(entry.stat().st_size for entry in os.scandir(tmp_path)) <= 200
+    assert cache.get("key-9") is not None
+    assert cache.get("key-0") is None
+
+
+def test_key_changes_with_model_and_output_settings(monkeypatch):
+    cache = ml_service.PredictionCache(max_entries=4)
+    monkeypatch.setattr(ml_service, "model_version", "model-a")
+    key = cache.key("digest", "png")
+    cache.put(key, {"prediction": "Positive"})
+    assert cache.key("digest", "rle") != key
+    
+    monkeypatch.setattr(highlighting, "SEGMENTATION_ENGINE", "other-engine")
+    assert cache.key("digest", "png") != key
+    monkeypatch.undo()
+    
+    monkeypatch.setattr(ml_service, "model_version", "model-b")
+    assert cache.get(cache.key("digest", "png")) is None
@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+import pytest
+
+import ml_service
+from bench.synthetic import synthetic_scan
+
+SIZE = 250
+
+
+def as_rgb(gray):
+    return np.repeat(np.clip(gray, 0, 255).astype(np.uint8)[..., None], 3, axis=2)
+
+
+def grey_rectangle():
+    img = np.zeros((SIZE, SIZE), np.float32)
+    img[40:210, 50:200] = 120
+    return as_rgb(img)
+
+
+def noise_with_dark_band():
+    img = np.random.default_rng(0).uniform(40, 200, (SIZE, SIZE))
+    img[:, :80] = 0
+    return as_rgb(img)
+
+
+def flat_ellipse():
+    img = np.zeros((SIZE, SIZE), np.float32)
+    cv2.ellipse(img, (SIZE // 2, SIZE // 2), (100, 115), 0, 0, 360, 110, -1)
+    return as_rgb(img)
+
+
+def noisy_ellipse():
+    rng = np.random.default_rng(1)
+    mask = np.zeros((SIZE, SIZE), np.uint8)
+    cv2.ellipse(mask, (SIZE // 2, SIZE // 2), (100, 115), 0, 0, 360, 1, -1)
+    return as_rgb(mask * rng.uniform(40, 200, (SIZE, SIZE)))
+
+
+def chest_xray():
+    """Torso running off the bottom of the frame, with two dark lungs, a spine and ribs"""
+    img = np.zeros((SIZE, SIZE), np.float32)
+    cv2.ellipse(img, (SIZE // 2, SIZE), (105, 210), 0, 0, 360, 150, -1)
+    cv2.ellipse(img, (80, 130), (45, 85), 0, 0, 360, 45, -1)
+    cv2.ellipse(img, (170, 130), (45, 85), 0, 0, 360, 45, -1)
+    for y in range(60, 220, 22):
+        cv2.line(img, (35, y), (215, y + 10), 130, 4)
+    img[:, 118:132] = 200
+    img += np.random.default_rng(2).normal(0, 6, img.shape)
+    return as_rgb(cv2.GaussianBlur(img, (5, 5), 0))
+
+
+def off_centre_blob():
+    img = np.zeros((SIZE, SIZE), np.float32)
+    cv2.ellipse(img, (80, 85), (75, 85), 0, 0, 360, 150, -1)
+    cv2.ellipse(img, (80, 85), (25, 30), 0, 0, 360, 60, -1)
+    return as_rgb(cv2.GaussianBlur(img, (9, 9), 0))
+
+
+@pytest.mark.parametrize("image", [
+    grey_rectangle, noise_with_dark_band, flat_ellipse, noisy_ellipse, chest_xray, off_centre_blob
+])
+def test_non_brain_grayscale_is_not_accepted(image):
+    assert ml_service.prefilter_scan(image()) in ("ambiguous", "reject")
+
+
+def test_colour_photo_is_rejected():
+    rgb = np.random.default_rng(3).integers(0, 256, (SIZE, SIZE, 3), dtype=np.uint8)
+    assert ml_service.prefilter_scan(rgb) == "reject"
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_brain_slice_is_accepted(seed):
+    assert ml_service.prefilter_scan(synthetic_scan(seed, SIZE)) == "accept"
@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("mongomock")
+
+from bench.common import load_flask_app
+
+app = load_flask_app()
+
+
+@pytest.fixture
+def starred(monkeypatch):
+    """Five starred images for one user, starred a minute apart"""
+    user_id = ObjectId()
+    start = datetime.datetime(2024, 1, 1)
+    image_ids = app.images_collection.insert_many([{
+        "user_id": user_id,
+        "original_filename": f"scan-{i}.png",
+        "upload_time": start,
+        "ml_results": {"prediction": "Negative"},
+        "blobs": {"original": {"id": f"blob-{i}", "content_type": "image/png", "size": 1}}
+    } for i in range(5)]).inserted_ids
+    app.starred_collection.insert_many([{
+        "user_id": user_id,
+        "image_id": image_id,
+        "note": "",
+        "timestamp": start + datetime.timedelta(minutes=i)
+    } for i, image_id in enumerate(image_ids)])
+    yield str(user_id), [str(image_id) for image_id in image_ids]
+    app.starred_collection.delete_many({"user_id": user_id})
+    app.images_collection.delete_many({"_id": {"$in": image_ids}})
+
+
+def page(client, user_id, cursor=None):
+    query = f"?limit=2&cursor={cursor}" if cursor else "?limit=2"
+    response = client.get(f"/api/starred/{user_id}{query}")
+    assert response.status_code == 200
+    body = response.get_json()
+    return list(body["starred_images"]), body["next_cursor"]
+
+
+def test_note_edits_do_not_move_items_between_pages(starred):
+    user_id, image_ids = starred
+    client = app.app.test_client()
+    
+    first, cursor = page(client, user_id)
+    assert sorted(first) == sorted(image_ids[-2:])
+    # Editing a note refreshes its timestamp; the item must still turn up on a later page
+    response = client.post("/api/starred", json={"user_id": user_id, "image_id": image_ids[0], "note": "edited"})
+    assert response.status_code == 200
+    
+    seen = list(first)
+    while cursor:
+        items, cursor = page(client, user_id, cursor)
+        seen += items
+    assert sorted(seen) == sorted(image_ids)
+
+
+def test_invalid_cursor_is_rejected(starred):
+    user_id, _ = starred
+    response = app.app.test_client().get(f"/api/starred/{user_id}?cursor=not-a-cursor")
+    assert response.status_code == 400
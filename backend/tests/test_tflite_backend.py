@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import ml_service
+
+tf = pytest.importorskip("tensorflow")
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    """A small convolutional classifier on the model's input shape, converted to TFLite"""
+    pytest.importorskip("ai_edge_litert")
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.Input((*ml_service.MODEL_INPUT_SIZE, 3)),
+        tf.keras.layers.Conv2D(4, 5, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation="sigmoid")
+    ])
+    path = tmp_path_factory.mktemp("tflite") / "model.tflite"
+    path.write_bytes(tf.lite.TFLiteConverter.from_keras_model(model).convert())
+    return str(path)
+
+
+def images(count):
+    return np.random.default_rng(count).random((count, *ml_service.MODEL_INPUT_SIZE, 3), dtype=np.float32)
+
+
+def test_batches_are_padded_to_the_next_batch_size(model_path):
+    backend = ml_service.TFLiteBackend(model_path, num_threads=1, batch_sizes=[1, 2, 4])
+    inputs = images(3)
+    
+    outputs = backend.predict(inputs)
+    assert outputs.shape == (3, 1)
+    assert np.allclose(outputs, np.concatenate([backend.predict(row[np.newaxis]) for row in inputs]), atol=1e-5)
+    assert sorted(backend.interpreters) == [1, 4]
+    # Beyond the largest size, a batch runs at its own size
+    assert backend.predict(images(5)).shape == (5, 1)
+    assert sorted(backend.interpreters) == [1, 4, 5]
+
+
+def test_warm_up_allocates_every_batch_size_once(model_path, monkeypatch):
+    monkeypatch.setattr(ml_service, "WARMUP_BATCH_SIZES", "1,2,4")
+    backend = ml_service.TFLiteBackend(model_path, num_threads=1, batch_sizes=ml_service.warmup_batch_sizes())
+    ml_service.warm_up(backend)
+    warmed = dict(backend.interpreters)
+    assert sorted(warmed) == [1, 2, 4]
+    
+    # Alternating sizes afterwards reuses the warmed interpreters
+    for count in (1, 4, 2, 3, 1):
+        backend.predict(images(count))
+    assert backend.interpreters == warmed
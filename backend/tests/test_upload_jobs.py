@@ -0,0 +1,48 @@
+import base64
+import datetime
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("mongomock")
+
+from bench.common import load_flask_app
+from bench.synthetic import encode, synthetic_scan
+
+app = load_flask_app()
+
+
+def test_job_result_links_the_overlay_instead_of_inlining_it(tmp_path, monkeypatch):
+    scan = encode(synthetic_scan(0))
+    file_path = tmp_path / "scan.png"
+    file_path.write_bytes(scan)
+
+    def process_with_ml_model(file_path, image_bytes=None, priority=None):
+        return {
+            "prediction": "Positive",
+            "confidence": 0.9,
+            "highlighted_image": base64.b64encode(scan).decode()
+        }, True
+
+    monkeypatch.setattr(app, "process_with_ml_model", process_with_ml_model)
+    monkeypatch.setattr(app, "blob_store", app.LocalBlobStore(str(tmp_path / "blobs")))
+    now = datetime.datetime.utcnow()
+    job = {
+        "_id": app.upload_jobs_collection.insert_one({"status": "running"}).inserted_id,
+        "user_id": ObjectId(),
+        "file_path": str(file_path),
+        "filename": "scan.png",
+        "original_filename": "scan.png",
+        "attempts": 1,
+        "created_at": now,
+        "started_at": now
+    }
+    app.run_upload_job(job)
+
+    stored = app.upload_jobs_collection.find_one({"_id": job["_id"]})
+    assert stored["status"] == "done"
+    result = stored["result"]
+    assert "highlighted_image" not in result["ml_results"]
+    assert result["ml_results"]["prediction"] == "Positive"
+    assert result["highlighted_url"] == f"/api/image/{result['image_id']}/highlighted"
+    assert result["original_url"] == f"/api/image/{result['image_id']}/original"
@@ -1,9 +1,11 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { getHistory, getCurrentUser, addStarredImage } from '../services/api';
+import { getHistory, getCurrentUser, addStarredImage, imageUrl } from '../services/api';
 
 const History = () => {
   const [history, setHistory] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [selectedImage, setSelectedImage] = useState(null);
@@ -24,8 +26,9 @@ const History = () => {
 
     const fetchHistory = async () => {
       try {
-        const historyData = await getHistory(currentUser.id);
-        setHistory(historyData);
+        const historyPage = await getHistory(currentUser.id);
+        setHistory(historyPage.history);
+        setNextCursor(historyPage.next_cursor);
         // Load starred images from localStorage
         const savedImages = JSON.parse(localStorage.getItem('starredImages') || '{}');
         setTickedImages(savedImages);
@@ -39,6 +42,20 @@ const History = () => {
     fetchHistory();
   }, [currentUser, navigate]);
 
+  const handleLoadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const historyPage = await getHistory(currentUser.id, nextCursor);
+      setHistory((previous) => [...previous, ...historyPage.history]);
+      setNextCursor(historyPage.next_cursor);
+    } catch (err) {
+      setError('Failed to load more history. Please try again later.');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleImageClick = (image) => {
     setSelectedImage(image);
   };
@@ -75,16 +92,9 @@ const History = () => {
         const imageToSave = {
           ...currentTickedImage,
           note: noteText,
-          timestamp: isEditing ? tickedImages[currentTickedImage.image_id].timestamp : new Date().toISOString(),
-          image_data: currentTickedImage.image_data || (selectedImage && selectedImage.image_id === currentTickedImage.image_id ? selectedImage.image_data : null)
+          timestamp: isEditing ? tickedImages[currentTickedImage.image_id].timestamp : new Date().toISOString()
         };
         
-        // Log for debugging
-        console.log('Saving image data:', {
-          hasImageData: !!imageToSave.image_data,
-          imageId: imageToSave.image_id
-        });
-        
         // Save to MongoDB
         await addStarredImage(currentUser.id, imageToSave.image_id, noteText);
         
@@ -277,7 +287,7 @@ const History = () => {
                         <div className="w-full md:w-1/2">
                           <div className="bg-black rounded-lg overflow-hidden shadow-lg">
                             <img
-                              src={`data:image/jpeg;base64,${selectedImage.image_data}`}
+                              src={imageUrl(selectedImage.preview_url)}
                               alt="Brain scan"
                               className="w-full object-contain"
                               style={{ maxHeight: '400px' }}
@@ -387,7 +397,8 @@ const History = () => {
                             </div>
                           )}
                           <img
-                            src={`data:image/jpeg;base64,${item.image_data}`}
+                            src={imageUrl(item.thumbnail_url)}
+                            loading="lazy"
                             alt="Scan thumbnail"
                             className="h-full w-full object-cover"
                           />
@@ -410,6 +421,17 @@ const History = () => {
                       </div>
                     </div>
                   ))}
+                  {nextCursor && (
+                    <div className="p-4 text-center">
+                      <button
+                        onClick={handleLoadMore}
+                        disabled={loadingMore}
+                        className="inline-flex items-center px-4 py-2 border border-transparent text-sm font-medium rounded-md text-primary-600 dark:text-primary-400 bg-primary-50 dark:bg-primary-900/20 hover:bg-primary-100 dark:hover:bg-primary-900/30 disabled:opacity-50"
+                      >
+                        {loadingMore ? 'Loading...' : 'Load more'}
+                      </button>
+                    </div>
+                  )}
                 </div>
               </div>
             </div>
@@ -1,9 +1,11 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { getCurrentUser, getStarredImages, addStarredImage, removeStarredImage, debugDatabase } from '../services/api';
+import { getCurrentUser, getStarredImages, addStarredImage, removeStarredImage, debugDatabase, imageUrl } from '../services/api';
 
 const Starred = () => {
   const [starredImages, setStarredImages] = useState({});
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedImage, setSelectedImage] = useState(null);
   const [noteText, setNoteText] = useState('');
   const [showNoteModal, setShowNoteModal] = useState(false);
@@ -34,14 +36,16 @@ const Starred = () => {
           console.error('Debug API error (non-fatal):', debugError);
         }
 
-        const savedImages = await getStarredImages(currentUser.id);
+        const starredPage = await getStarredImages(currentUser.id);
+        const savedImages = starredPage.starred_images;
+        setNextCursor(starredPage.next_cursor);
         console.log('API Response for starred images:', savedImages);
         console.log('Loaded starred images:', Object.keys(savedImages).length);
         
-        // Check if images have image_data
+        // Check if images have an image URL
         Object.entries(savedImages).forEach(([id, image]) => {
-          if (!image.image_data) {
-            console.warn(`Image ${id} is missing image_data`);
+          if (!image.thumbnail_url) {
+            console.warn(`Image ${id} is missing thumbnail_url`);
           }
         });
         
@@ -84,6 +88,21 @@ const Starred = () => {
     }
   };
 
+  const handleLoadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const currentUser = getCurrentUser();
+      const starredPage = await getStarredImages(currentUser.id, nextCursor);
+      setStarredImages(prev => ({ ...prev, ...starredPage.starred_images }));
+      setNextCursor(starredPage.next_cursor);
+    } catch (error) {
+      console.error('Error loading more starred images:', error);
+      setError('Failed to load more starred images. Please try again later.');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleEditNote = (image) => {
     setSelectedImage(image);
     setNoteText(image.note || '');
@@ -268,7 +287,8 @@ const Starred = () => {
                 <div key={imageId} className="bg-white dark:bg-gray-800 rounded-lg shadow-md overflow-hidden border border-gray-200 dark:border-gray-700 hover:shadow-lg transition-shadow duration-300">
                   <div className="relative">
                     <img
-                      src={`data:image/jpeg;base64,${image.image_data}`}
+                      src={imageUrl(image.thumbnail_url)}
+                      loading="lazy"
                       alt={image.filename}
                       className="w-full h-48 object-cover"
                       onError={(e) => {
@@ -306,6 +326,17 @@ const Starred = () => {
                   </div>
                 </div>
               ))}
+              {nextCursor && (
+                <div className="col-span-full text-center">
+                  <button
+                    onClick={handleLoadMore}
+                    disabled={loadingMore}
+                    className="inline-flex items-center px-4 py-2 border border-transparent text-sm font-medium rounded-md text-primary-600 dark:text-primary-400 bg-primary-50 dark:bg-primary-900/20 hover:bg-primary-100 dark:hover:bg-primary-900/30 disabled:opacity-50"
+                  >
+                    {loadingMore ? 'Loading...' : 'Load more'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
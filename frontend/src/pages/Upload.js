@@ -1,7 +1,8 @@
 
 import React, { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { uploadImage, getCurrentUser } from '../services/api';
+import { uploadImage, getCurrentUser, imageUrl, waitForTumorMask } from '../services/api';
+import { renderMaskOverlay } from '../services/maskOverlay';
 
 const Upload = () => {
   const [selectedFile, setSelectedFile] = useState(null);
@@ -47,6 +48,21 @@ const Upload = () => {
       // Check if we have a highlighted image and set it
       if (response.ml_results && response.ml_results.highlighted_image) {
         setHighlightedImageUrl(`data:image/png;base64,${response.ml_results.highlighted_image}`);
+      } else if (response.ml_results && response.ml_results.tumor_mask) {
+        // Compact mask mode: blend the overlay here instead of downloading a PNG
+        setHighlightedImageUrl(await renderMaskOverlay(previewUrl, response.ml_results.tumor_mask));
+      } else if (response.highlighted_url) {
+        // Queued uploads and deferred highlighting: the overlay is served by URL
+        setHighlightedImageUrl(imageUrl(response.highlighted_url));
+      } else if (response.ml_results && response.ml_results.highlight_status === 'pending') {
+        // Deferred compact mask: show the result now and blend the mask once it arrives
+        waitForTumorMask(response.image_id)
+          .then(async (tumorMask) => {
+            if (tumorMask) {
+              setHighlightedImageUrl(await renderMaskOverlay(previewUrl, tumorMask));
+            }
+          })
+          .catch(() => {});
       }
       
       response.image_id = Date.now().toString(); // Generate a temporary ID for the new upload
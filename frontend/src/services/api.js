@@ -1,4 +1,8 @@
 const API_URL = 'https://api.btd.reaai.me/api';
+const API_ORIGIN = API_URL.replace(/\/api$/, '');
+
+// Image URLs from the API are relative paths like /api/image/<id>/original
+export const imageUrl = (path) => (path ? `${API_ORIGIN}${path}` : null);
 
 // User authentication services
 export const register = async (name, email, password) => {
@@ -78,15 +82,40 @@ export const uploadImage = async (file, userId) => {
       throw new Error(data.error || 'Upload failed');
     }
     
+    // The server queued the upload as a job: wait for its result
+    if (response.status === 202) {
+      return waitForUploadJob(data.job_id);
+    }
+    
     return data;
   } catch (error) {
     throw error;
   }
 };
 
-export const getHistory = async (userId) => {
+// Long-poll an upload job until it finishes and return the upload result
+export const waitForUploadJob = async (jobId) => {
+  for (;;) {
+    const response = await fetch(`${API_URL}/upload/jobs/${jobId}?wait=25`);
+    const job = await response.json();
+    
+    if (!response.ok) {
+      throw new Error(job.error || 'Upload failed');
+    }
+    if (job.status === 'done') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error((job.result && job.result.error) || 'Upload failed');
+    }
+  }
+};
+
+// Returns one page of history: { history, next_cursor }. Pass next_cursor back to get the next page.
+export const getHistory = async (userId, cursor = null) => {
   try {
-    const response = await fetch(`${API_URL}/history/${userId}`, {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${API_URL}/history/${userId}${query}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
@@ -99,7 +128,7 @@ export const getHistory = async (userId) => {
       throw new Error(data.error || 'Failed to fetch history');
     }
     
-    return data.history;
+    return { history: data.history, next_cursor: data.next_cursor || null };
   } catch (error) {
     throw error;
   }
@@ -126,10 +155,32 @@ export const getImage = async (imageId) => {
   }
 };
 
+// Poll an image whose run-length tumor mask is still being computed (deferred
+// highlighting with overlay=rle) and return the mask, or null if it never arrives
+export const waitForTumorMask = async (imageId, attempts = 5) => {
+  for (let i = 0; i < attempts; i++) {
+    const response = await fetch(`${API_URL}/image/${imageId}?wait=10`);
+    const data = await response.json();
+    
+    if (!response.ok) {
+      throw new Error(data.error || 'Failed to fetch image');
+    }
+    if (data.ml_results && data.ml_results.tumor_mask) {
+      return data.ml_results.tumor_mask;
+    }
+    if (!data.ml_results || data.ml_results.highlight_status !== 'pending') {
+      return null;
+    }
+  }
+  return null;
+};
+
 // Starred images services
-export const getStarredImages = async (userId) => {
+// Returns one page of starred images: { starred_images, next_cursor }
+export const getStarredImages = async (userId, cursor = null) => {
   try {
-    const response = await fetch(`${API_URL}/starred/${userId}`, {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${API_URL}/starred/${userId}${query}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
@@ -142,7 +193,7 @@ export const getStarredImages = async (userId) => {
       throw new Error(data.error || 'Failed to fetch starred images');
     }
     
-    return data.starred_images || {};
+    return { starred_images: data.starred_images || {}, next_cursor: data.next_cursor || null };
   } catch (error) {
     console.error('Error fetching starred images:', error);
     throw error;
@@ -0,0 +1,44 @@
+// Client-side rendering of the run-length tumor masks returned when the ML
+// service runs with overlay=rle, matching its red 50% PNG overlay
+
+// Decode { size: [height, width], counts } into a Uint8Array, 1 inside the mask
+export const decodeMask = ({ size, counts }) => {
+  const mask = new Uint8Array(size[0] * size[1]);
+  let offset = 0;
+  counts.forEach((run, i) => {
+    // Runs alternate background / mask, starting with background
+    if (i % 2 === 1) {
+      mask.fill(1, offset, offset + run);
+    }
+    offset += run;
+  });
+  return mask;
+};
+
+// Blend the mask into the scan at imageSrc and resolve with a PNG data URL
+export const renderMaskOverlay = (imageSrc, tumorMask) => new Promise((resolve, reject) => {
+  const img = new Image();
+  img.onload = () => {
+    const [height, width] = tumorMask.size;
+    const canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    const ctx = canvas.getContext('2d');
+    ctx.drawImage(img, 0, 0, width, height);
+
+    const pixels = ctx.getImageData(0, 0, width, height);
+    const mask = decodeMask(tumorMask);
+    for (let i = 0; i < mask.length; i++) {
+      if (mask[i]) {
+        const p = i * 4;
+        pixels.data[p] = (pixels.data[p] + 255) / 2;
+        pixels.data[p + 1] = pixels.data[p + 1] / 2;
+        pixels.data[p + 2] = pixels.data[p + 2] / 2;
+      }
+    }
+    ctx.putImageData(pixels, 0, 0);
+    resolve(canvas.toDataURL('image/png'));
+  };
+  img.onerror = reject;
+  img.src = imageSrc;
+});